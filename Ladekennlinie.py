@@ -1,35 +1,35 @@
 import Sensorik
-import time
+import pigpio_manager
+import recorder
 import asyncio
 
+# Zeichnet Spannung, Strom und Ladung des Akkus alle 10 Sekunden auf (Dateien Ladekennlinie-*.rec).
+# Auswerten z.B. mit:
+#   data = recorder.load("Ladekennlinie")
+#   data["time"], data["Batt.-Voltage"], data["Batt.-Current"], data["Batt.-Charge"]
+#
+# ACHTUNG, geaendertes Format: Frueher wurden Textdateien (Ladekennlinie_Voltage, _Current, _Charge) geschrieben,
+# in denen die Zeit in Sekunden seit dem Start und die Ladung relativ zur Ladung beim Start (mAh) stand.
+# Jetzt werden die Rohwerte aufgezeichnet: "time" in Sekunden seit 1970 und "Batt.-Charge" als absoluter Zaehlerstand
+# des BattMon in mAh. Die frueheren relativen Werte erhaelt man durch Abziehen des ersten (gueltigen) Werts:
+#   import math
+#   t0 = data["time"][0]
+#   c0 = next(c for c in data["Batt.-Charge"] if not math.isnan(c))
+#   time = [t - t0 for t in data["time"]]
+#   charge = [c - c0 for c in data["Batt.-Charge"]]
+
 loop = asyncio.get_event_loop()
 Sensorik.init(loop)
 
-V = Sensorik.Batt_Mon_Voltage()
-I = Sensorik.Batt_Mon_Current()
-C = Sensorik.Batt_Mon_Charge()
-
-start = time.time()
+rec = recorder.Recorder(loop, [Sensorik.Batt_Mon_Voltage, Sensorik.Batt_Mon_Current, Sensorik.Batt_Mon_Charge],
+                        "Ladekennlinie", interval = 10)
 
 try:
-    v = open('Ladekennlinie_Voltage', 'w')
-    v.write("time, voltage[V]\n")
-    V.subscribe((lambda n,d,u : v.write(str(time.time() - start) +", " + d + "\n")), False, 10)
-
-    i = open('Ladekennlinie_Current', 'w')
-    i.write("time, current[A]\n")
-    I.subscribe((lambda n,d,u : i.write(str(time.time() - start) +", " + d + "\n")), False, 10)
-
-    c = open('Ladekennlinie_Charge', 'w')
-    c.write("time, charge[mAh]\n")
-    start_charge = float(C.getSensorData())
-    C.subscribe((lambda n,d,u : c.write( str(time.time() - start) +", " + str(float(d) - start_charge) + "\n")), False, 10)
-
+    rec.start()
     loop.run_forever()
 
 finally:
     print("Saving Files...")
-    v.close()
-    i.close()
-    c.close()
+    rec.close()
     Sensorik.close()
+    pigpio_manager.stop()
@@ -1,9 +1,80 @@
 #!/usr/bin/env python3
 
-## Version 0.7
+## Version 0.8.8
 #
 ## Changelog:
 #
+# --- 0.8.8 ---
+# - Batt_Mon ist selbst ein (interner) Sensor, dessen Wert der zuletzt empfangene BattMonRecord ist.
+#   Die Batt_Mon-Sensoren haengen ueber DEPENDS_ON davon ab und werden wie alle abgeleiteten Sensoren
+#   mit _Propagate aktualisiert, statt von ReadSerial einzeln angestossen zu werden (Batt_Mon.Sensors entfaellt).
+# - Sensoren mit INTERNAL = True werden nicht in Sensoren/SensorenList eingetragen (nicht veroeffentlicht und nicht angezeigt)
+#
+# --- 0.8.7 ---
+# - das LCD zeigt jeden (vom AlertBus mit ALERT_LCD_RATELIMIT gedrosselten) Alert an, nicht nur den ersten bis zum Tastendruck.
+#   Ein neuer Alert ersetzt einen noch durchlaufenden Text, der Tastendruck quittiert weiterhin den angezeigten Alert.
+#
+# --- 0.8.6 ---
+# - Bremsassistent mit Stufen und Hysterese (BRAKE_ASSIST_LEVELS) --> Speedlimit und Bremsen flattern nicht mehr
+# - fehlerhafte Regeln in alerts.json werden gemeldet und uebersprungen, statt init abzubrechen
+#
+# --- 0.8.5 ---
+# - Alerts werden ueber einen AlertBus ausgeliefert: eigene Warteschlange und Ratenbegrenzung pro Abnehmer (Log, LCD, LEDs, Netzwerk)
+# - LCD und LEDs sind getrennte Abnehmer (DisplayAlert, LightAlert)
+#
+# --- 0.8.4 ---
+# - Alerts werden ueber Regeln mit Hysterese, Haltezeit, Severity und Ratenbegrenzung ausgeloest (alerts.py)
+# --> die Schwellwerte koennen ohne Aendern der Sensor-Klassen in alerts.json angepasst werden
+# - Alert-Subscriber bekommen die Severity als dritten Parameter
+#
+# --- 0.8.3 ---
+# - subscribeAggregate: pro Intervall werden min, max, mean, count und last aller Werte veroeffentlicht
+#
+# --- 0.8.2 ---
+# - subscribeOnChange: Werte werden nur veroeffentlicht, wenn sie sich um mehr als ein (relatives) Totband aendern,
+#   optional mit Heartbeat nach maxsilence Sekunden ohne Veroeffentlichung
+#
+# --- 0.8.1 ---
+# - Sensordaten werden von einem zentralen Zeitplan (PublishScheduler) veroeffentlicht: ein Timer pro Intervall statt pro Subscription
+# - desubscribe entfernt die Subscription sofort, es bleiben keine Timer zurueck
+#
+# --- 0.8 ---
+# - Abgeleitete Sensoren geben mit DEPENDS_ON an, aus welchen Sensoren sie berechnet werden
+# --> sie haben keinen eigenen Timer mehr und werden sofort bei jedem neuen Upstream-Wert genau einmal neu berechnet
+#
+# --- 0.7.9 ---
+# - Sensoren werden nur noch so oft aktualisiert, wie es ihre Abnehmer verlangen (AddDemand/RemoveDemand)
+# - Sensoren ohne Abnehmer werden nur noch alle IDLE_REFRESH_TIME Sekunden aktualisiert (fuer die Alerts)
+#
+# --- 0.7.8 ---
+# - Ergebnisse aus den Threads des Executors und den pigpio-Callbacks werden ueber PostEvent an den Loop uebergeben
+# --> Sensordaten, Alerts und das Senden an die Clients laufen nur noch im Loop-Thread
+#
+# --- 0.7.7 ---
+# - Jeder Sensor speichert den Verlauf seiner Werte in einem Ringpuffer (Sensor.History, siehe history.py)
+#
+# --- 0.7.6 ---
+# - jede Zeile vom BattMon wird nur noch einmal in einen BattMonRecord zerlegt (ParseBattMonLine)
+# - Batt_Mon-Sensoren geben nur noch ihr Feld (FIELD) und ihre Plausibilitaetspruefung (Valid) an
+#
+# --- 0.7.5 ---
+# - BattMon wird nicht mehr in einem dauerhaft blockierten Thread des Executors gelesen, sondern mit loop.add_reader
+# - jede Zeile vom BattMon wird mit Empfangszeitpunkt (Batt_Mon.ReceiveTime) verarbeitet, kein reset_input_buffer mehr
+#
+# --- 0.7.4 ---
+# - Ultraschall-Sensoren werden von einem gemeinsamen Zeitplan (sonar.scheduler) nacheinander angepingt --> kein Uebersprechen
+# - Messintervall der Ultraschall-Sensoren richtet sich nach Geschwindigkeit und Fahrtrichtung
+#
+# --- 0.7.3 ---
+# - Sensoren koennen mit READ_ASYNC = True im asyncio-Loop ausgelesen werden (ReadSensorDataAsync)
+# - Ultraschall-Sensoren werden asynchron ausgelesen (sonar.ranger.read_async) und blockieren keinen Thread des Executors mehr
+#
+# --- 0.7.2 ---
+# - gemeinsame Verbindung zu pigpiod ueber pigpio_manager
+#
+# --- 0.7.1 ---
+# - Numerische Sensor-IDs (Klassenattribut "ID") fuer die binaere SRCCP-Kodierung eingefuehrt
+#
 # --- 0.7 ---
 # - Bremsassistent testweise eingebaut (Voraussetzung: Steuerung.py Version 0.3)
 #
@@ -59,13 +130,18 @@
 
 import time
 import sys
+import collections
+import threading
 from concurrent.futures import ThreadPoolExecutor
 executor = ThreadPoolExecutor(max_workers = 4)
 import pigpio
+import pigpio_manager
 import subprocess
 import asyncio
 import serial
 import sonar
+import history
+import alerts
 import lcd
 import DHT22
 import Adafruit_BMP.BMP085
@@ -75,10 +151,36 @@ import Steuerung
 DEBUG = True if "-d" in sys.argv else False
 
 EN_BRAKE_ASSIST = True    # Bremsassistent aktivieren (=True) / deaktivieren (=False)
+# Stufen des Bremsassistenten (Sonar_Sensor_Front): (Abstand in cm, Speedlimit vorwaerts in Prozent), naechste Stufe zuerst.
+# Eine Stufe wird erst verlassen, wenn der Abstand die Grenze um BRAKE_ASSIST_HYSTERESIS cm ueberschritten hat.
+BRAKE_ASSIST_LEVELS = ((10, 0), (25, 20), (50, 50))
+BRAKE_ASSIST_HYSTERESIS = 3
 DISP_BUTTON = 20
 BUZZER_PIN = 25
 BUZZER_FREQ = 800
-pi = pigpio.pi()          # pigpiod muss im Hintergrund laufen!
+
+# Intervalle der Ultraschall-Sensoren in Sekunden (siehe Klasse Sonar):
+SONAR_FAST_TIME = 0.1     # in Fahrtrichtung bei voller Geschwindigkeit
+SONAR_SLOW_TIME = 0.6     # entgegen der Fahrtrichtung
+SONAR_IDLE_TIME = 10      # im Stand, wenn kein Client die Entfernung abfragt
+SONAR_TIMEOUT = 0.06      # maximale Wartezeit auf das Echo (entspricht ca. 10 m)
+
+MAX_SERIAL_LINE = 256     # maximale Laenge einer Zeile vom BattMon in Bytes
+
+IDLE_REFRESH_TIME = 30    # Standard-Intervall in Sekunden fuer Sensoren, die gerade niemand abfragt
+
+ALERT_LCD_RATELIMIT = 3   # hoechstens alle 3 s einen Alert auf dem Display anzeigen
+ALERT_LED_RATELIMIT = 10  # hoechstens alle 10 s die LEDs fuer einen Alert blinken lassen
+
+pi = pigpio_manager.get() # gemeinsame Verbindung zu pigpiod
+
+# Aufrufe aus anderen Threads, die im Loop abgearbeitet werden (siehe PostEvent):
+Events = collections.deque()
+EventsLock = threading.Lock()
+EventsScheduled = False
+LoopThread = None
+
+AlertRules = {} # Sensorname --> alerts.RuleSet, wird in init geladen
 
 
 # ---------------------------
@@ -86,18 +188,34 @@ pi = pigpio.pi()          # pigpiod muss im Hintergrund laufen!
 # ---------------------------
 
 def init(_loop):
-    global loop, Sensoren, SensorenList, pi, cb1, shutdown, DispAlert
+    global loop, Sensoren, SensorenList, pi, cb1, shutdown, DispAlert, SonarScheduler, LoopThread, Publisher, AlertRules, Bus
     shutdown = False
     loop = _loop
+    # init wird im Thread aufgerufen, in dem danach der Loop laeuft (siehe PostEvent):
+    LoopThread = threading.get_ident()
     # Solange das Display nicht initialisiert ist, keine Alerts darstellen:
     DispAlert = True
     # Ein Dictionary, das den Namen aller Subklassen von "Sensor" als Key enthaelt und die jeweilige Klasse als Wert:
     Sensoren = {}
     # Alle Subklassen und das jeweils zugehoerige Klassenatrribut "NAME" werden automatisch in das obige Dictionary eingetragen:
     for subcl in Sensor.__subclasses__():
-        Sensoren[subcl.NAME] = subcl
+        if not subcl.INTERNAL:
+            Sensoren[subcl.NAME] = subcl
     # Zusaetzlich eine SensorListe erstellen, ueber die iteriert werden kann:
     SensorenList = list(Sensoren.values())   
+    # Regeln fuer die Alerts laden (alerts.DEFAULT_RULES, ggf. ueberschrieben durch alerts.json):
+    AlertRules = alerts.load_rules()
+    # Alerts an die Abnehmer verteilen, jeder mit eigener Warteschlange und Ratenbegrenzung:
+    Bus = alerts.AlertBus(loop)
+    Bus.register(PrintAlerts)
+    Bus.register(DisplayAlert, ALERT_LCD_RATELIMIT, single = True)
+    Bus.register(LightAlert, ALERT_LED_RATELIMIT, single = True)
+    # Abhaengigkeiten der abgeleiteten Sensoren (DEPENDS_ON) aufloesen:
+    BuildDependencies(SensorenList)
+    # Gemeinsamer Zeitplan fuer alle Ultraschall-Sensoren:
+    SonarScheduler = sonar.scheduler(loop)
+    # Gemeinsamer Zeitplan fuer die Veroeffentlichung der Sensordaten:
+    Publisher = PublishScheduler(loop)
     
     for Sen in Sensoren:
         # Start Refresh-Tasks:
@@ -106,6 +224,10 @@ def init(_loop):
         Sensoren[Sen].SubscribeAlerts(PrintAlerts)
         # Display all Alerts at Display:
         Sensoren[Sen].SubscribeAlerts(DisplayAlert)
+        # Show all Alerts with the LEDs:
+        Sensoren[Sen].SubscribeAlerts(LightAlert)
+    # Der BattMon ist als interne Datenquelle nicht in Sensoren eingetragen und wird hier gestartet:
+    Batt_Mon._AutoRefresh()
         
     # kurz warten, bis die IP-Adresse ausgelesen ist:
     time.sleep(1)
@@ -142,38 +264,115 @@ def close():
         Sensoren[Sen].DesubscribeAlerts(PrintAlerts)
         # Desubscribe Alerts at Display:
         Sensoren[Sen].DesubscribeAlerts(DisplayAlert)
+        # Desubscribe Alerts at LEDs:
+        Sensoren[Sen].DesubscribeAlerts(LightAlert)
     executor.shutdown(wait=True)
     cb1.cancel()
     loop.run_until_complete(lcd.init())
     loop.run_until_complete(lcd.clear())
     loop.run_until_complete(lcd.setBacklightOff())
+    SonarScheduler.cancel()
+    Publisher.cancel_all()
+    Batt_Mon.close()
     Sonar_Sensor_Front.son.cancel()
     Sonar_Sensor_Rear.son.cancel()
     pi.set_PWM_dutycycle(BUZZER_PIN, 0)
     DHT22_Temp.dht22.cancel()
-    pi.stop()
+
+def BuildDependencies(SensorList):
+    """
+    Ermittelt fuer jeden Sensor alle (auch indirekt) von ihm abhaengigen Sensoren (siehe Sensor.DEPENDS_ON)
+    in topologischer Reihenfolge, d.h. jeder Sensor steht erst hinter allen Sensoren, von denen er abhaengt.
+    """
+    order = []
+    state = {} # Sensor --> 1: wird gerade besucht, 2: fertig
+    def visit(Sen):
+        if state.get(Sen) == 2:
+            return
+        if state.get(Sen) == 1:
+            raise ValueError("circular sensor dependency at {}".format(Sen.NAME))
+        state[Sen] = 1
+        for up in Sen.DEPENDS_ON:
+            visit(up)
+        state[Sen] = 2
+        order.append(Sen)
+    for Sen in SensorList:
+        visit(Sen)
+
+    for Sen in order:
+        Sen.Downstream = ()
+    for Sen in order:
+        # Sen haengt von allen Upstream-Sensoren ab und damit auch von deren Upstream-Sensoren:
+        upstream = set()
+        todo = list(Sen.DEPENDS_ON)
+        while todo:
+            up = todo.pop()
+            if up not in upstream:
+                upstream.add(up)
+                todo.extend(up.DEPENDS_ON)
+        for up in upstream:
+            up.Downstream += (Sen,)
+    # Da "order" topologisch sortiert ist, sind es auch die Downstream-Tupel.
+
+def PostEvent(func, *args):
+    """
+    Uebergibt einen Aufruf func(*args) aus einem beliebigen Thread (Executor, pigpio-Callbacks) an den asyncio-Loop.
+    Alle Sensordaten, Alerts und damit auch alle Schreibzugriffe auf die Verbindungen laufen so nur im Loop-Thread.
+    Die Aufrufe werden gesammelt und vom Loop mit einem einzigen Aufwachen in der richtigen Reihenfolge abgearbeitet.
+    Im Loop-Thread selbst wird func direkt aufgerufen.
+    """
+    global EventsScheduled
+    if threading.get_ident() == LoopThread:
+        func(*args)
+        return
+    with EventsLock:
+        Events.append((func, args))
+        if not EventsScheduled:
+            EventsScheduled = True
+            loop.call_soon_threadsafe(_DrainEvents)
+
+def _DrainEvents():
+    """laeuft im Loop und arbeitet alle gesammelten Aufrufe ab (siehe PostEvent)."""
+    global EventsScheduled
+    with EventsLock:
+        EventsScheduled = False
+        batch = list(Events)
+        Events.clear()
+    for func, args in batch:
+        try:
+            func(*args)
+        except Exception as e:
+            print("ERROR while handling event {}: {}".format(func.__name__, e))
 
 def PrintSensorData(Sensor, Data, Unit):
     print(str(Sensor), ":", str(Data) + " " + str(Unit))
 
-def PrintAlerts(Type, Msg):
-    print("! Alert from Sensor {} received: {} !".format(Type, Msg))
+def PrintAlerts(Type, Msg, Severity = 1):
+    print("! Alert from Sensor {} received (severity {}): {} !".format(Type, Severity, Msg))
 
 def DisplaySensorData(Sensor, Data, Unit):
     if not DispAlert: #Alerets haben Vorrang
         asyncio.run_coroutine_threadsafe(lcd.printString(str(Sensor) + ":", lcd.line1), loop)
         asyncio.run_coroutine_threadsafe(lcd.printString(str(Data) + " " + str(Unit), lcd.line2), loop)
 
-def DisplayAlert(Type, Msg):   
+def DisplayAlert(Type, Msg, Severity = 1):
+    # Ein "ueberfordern" des Displays verhindert die Ratenbegrenzung des AlertBus (ALERT_LCD_RATELIMIT).
+    # DispAlert bleibt bis zum Tastendruck gesetzt, damit die Sensordaten den Alert nicht ueberschreiben.
     global DispAlert
-    if not DispAlert: #Alerts nur einmal anzeigen --> verhindert ein "ueberfordern" des Displays
-        asyncio.run_coroutine_threadsafe(lcd.printScrollingString("!ALERT!" + ":" + str(Type), str(Msg)), loop)
-        # light-mode auf -1 (Alert) stellen:
+    lcd.stop_scrolling = True # einen noch durchlaufenden (aelteren) Alert abbrechen
+    asyncio.run_coroutine_threadsafe(lcd.printScrollingString("!ALERT!" + ":" + str(Type), str(Msg)), loop)
+    DispAlert = True
+
+def LightAlert(Type, Msg, Severity = 1):
+    # light-mode auf -1 (Alert) stellen, falls die LEDs nicht schon blinken:
+    if Steuerung.light.light_mode != -1:
         Steuerung.light.change_mode(mode = -1)
-        DispAlert = True
 
-#Callback function fuer Button:
-def DisplayNextSensorData(gpio, level, tick): 
+#Callback function fuer Button (laeuft im Callback-Thread von pigpio --> an den Loop uebergeben):
+def DisplayNextSensorData(gpio, level, tick):
+    PostEvent(_DisplayNextSensorData, tick)
+
+def _DisplayNextSensorData(tick):
     global DispSen, DispSenNr, lastTick, DispAlert
     # entprellen:
     if DEBUG: print(pigpio.tickDiff(lastTick, tick))
@@ -190,6 +389,82 @@ def DisplayNextSensorData(gpio, level, tick):
             DispSen.subscribe(DisplaySensorData, True, 0.5)
         lastTick = tick
 
+# --------------------------------------------
+## --- Zeitplan fuer die Veroeffentlichung ---
+# --------------------------------------------
+
+class PublishHandle:
+    """Handle einer Subscription im PublishScheduler, mit cancel() wird sie in O(1) entfernt."""
+
+    def __init__(self, bucket, callback, args):
+        self.bucket = bucket
+        self.callback = callback
+        self.args = args
+
+    def cancel(self):
+        if self.bucket:
+            self.bucket.remove(self)
+            self.bucket = None
+
+
+class PublishBucket:
+    """Alle Subscriptions mit demselben Intervall, die gemeinsam von einem einzigen Timer ausgeloest werden."""
+
+    def __init__(self, scheduler, interval):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.handles = collections.OrderedDict() # OrderedDict als geordnete Menge --> Entfernen in O(1)
+        self.due = scheduler.loop.time() + interval
+        self.timer = scheduler.loop.call_at(self.due, self.fire)
+
+    def remove(self, handle):
+        del self.handles[handle]
+        if not self.handles:
+            # kein Timer ohne Subscriptions:
+            self.timer.cancel()
+            del self.scheduler.buckets[self.interval]
+
+    def fire(self):
+        # Der naechste Zeitpunkt wird vom geplanten (nicht vom tatsaechlichen) Zeitpunkt aus berechnet --> kein Wegdriften:
+        self.due = max(self.due + self.interval, self.scheduler.loop.time())
+        self.timer = self.scheduler.loop.call_at(self.due, self.fire)
+        # Kopie, da Subscriber waehrenddessen desubscriben koennen:
+        for handle in list(self.handles):
+            if handle.bucket is not self:
+                continue
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                print("ERROR while publishing: {}".format(e))
+
+
+class PublishScheduler:
+    """
+    Zentraler Zeitplan fuer alle Subscriptions der Sensordaten. Die Subscriptions werden nach Intervall
+    in Buckets einsortiert, jeder Bucket hat genau einen Timer und veroeffentlicht alle seine Subscriptions
+    gemeinsam. Desubscriben loescht die Subscription sofort, es bleiben keine Timer zurueck.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.buckets = {} # Intervall --> PublishBucket
+
+    def add(self, interval, callback, *args):
+        """Ruft callback(*args) alle "interval" Sekunden auf und liefert ein PublishHandle zurueck."""
+        interval = float(interval)
+        bucket = self.buckets.get(interval)
+        if bucket is None:
+            bucket = self.buckets[interval] = PublishBucket(self, interval)
+        handle = PublishHandle(bucket, callback, args)
+        bucket.handles[handle] = None
+        return handle
+
+    def cancel_all(self):
+        for bucket in list(self.buckets.values()):
+            for handle in list(bucket.handles):
+                handle.cancel()
+
+
 # --------------------------
 ## --- Sensor-Metaklasse ---
 # --------------------------
@@ -206,8 +481,19 @@ class SensorMeta(type):
         new_class.SensorData = None
         # In dieser Static Variable werden Alert-Nachrichten als String gespeichert. Solange kein Alert vorliegt: None
         new_class.AlertMsg = None
+        # Severity des aktuellen Alerts (1 = Hinweis, 2 = Warnung, 3 = kritisch, siehe alerts.py):
+        new_class.AlertSeverity = 1
         # In dieser Liste werden die Funktionen hinterlegt. die bei einem Alert aufgerufen werden.
         new_class.AlertSubscriber = []
+        # Verlauf der numerischen Sensordaten (Ringpuffer mit HISTORY_SIZE Eintraegen):
+        new_class.History = history.History(getattr(new_class, "HISTORY_SIZE", history.DEFAULT_SIZE))
+        # Aktive Abnehmer (z.B. subscribte Sensor-Objekte) --> gewuenschtes Intervall in Sekunden (siehe AddDemand):
+        new_class.Demand = {}
+        # Naechster geplanter Refresh (Handle von call_later) und dessen Zeitpunkt (loop.time()):
+        new_class.NextRefresh = None
+        new_class.NextRefreshTime = None
+        # Sensor-Objekte --> Methode, die bei jedem neuen Wert aufgerufen wird (siehe subscribeOnChange, subscribeAggregate):
+        new_class.SampleSubscribers = collections.OrderedDict()
                 
         return new_class
 
@@ -231,6 +517,14 @@ class Sensor(metaclass=SensorMeta):
     NAME = "AbstrakteSensorklasse" # Gibt den Namen des Sensors an. Dieser wird als Key im Dict 'Sensoren' abgelegt
     REFRESH_TIME = False           # Nach dieser Zeit in Sekunden weden die Sensordaten erneut vom Sensor aktualisiert, wenn False nur einmal beim Start
     UNIT = "Einheit"               # Einheit der Sensordaten
+    ID = None                      # Eindeutige numerische ID (1-255) fuer die binaere SRCCP-Kodierung. Vergebene IDs nie aendern!
+    READ_ASYNC = False             # Wenn True, wird ReadSensorDataAsync im asyncio-Loop aufgerufen statt ReadSensorData im Executor
+    HISTORY_SIZE = history.DEFAULT_SIZE # Anzahl der Werte, die im Verlauf (History) aufgehoben werden
+    IDLE_REFRESH_TIME = IDLE_REFRESH_TIME # Intervall ohne Abnehmer (nur noch fuer die Alerts), None: gar nicht mehr aktualisieren
+    DEPENDS_ON = ()                # Sensor-Klassen, aus deren Werten dieser Sensor berechnet wird (kein eigener Timer!)
+    INTERNAL = False               # True: nur Datenquelle fuer abhaengige Sensoren, wird nicht in Sensoren eingetragen
+    PROPAGATE_ALWAYS = False       # True: abhaengige Sensoren nach jedem Auslesen neu berechnen, nicht nur bei neuen Werten
+    Downstream = ()                # alle abhaengigen Sensoren in Berechnungsreihenfolge (wird von BuildDependencies gesetzt)
 
 
     # ----------------------
@@ -248,28 +542,103 @@ class Sensor(metaclass=SensorMeta):
     @classmethod
     def CheckAlerts(cls):
         """
-        muss in den erbenden Sensor-Klassen implementiert werden.
+        kann in den erbenden Sensor-Klassen implementiert werden.
         Die Funktion wird bei jedem Aktualisieren der Sensordaten aufgerufen.
         Sie muss die Sensordaten aus cls.SensorData auslesen und je nach gegebenen
         Bedingungen eine Alert-Nachricht oder False (kein Alert) zurueckliefern.
+        Gibt es fuer den Sensor Regeln in alerts.py, wird die Alert-Nachricht aus den Regeln genommen
+        und der Rueckgabewert ignoriert (CheckAlerts wird dann nur noch fuer Nebeneffekte, z.B. den Bremsassistenten, aufgerufen).
         """
         return False
 
 
+    @classmethod
+    async def ReadSensorDataAsync(cls):
+        """
+        Kann in den erbenden Sensor-Klassen statt ReadSensorData implementiert werden, falls der Sensor
+        ohne zu blockieren im asyncio-Loop ausgelesen werden kann (dann zusaetzlich READ_ASYNC = True setzen).
+        """
+        return cls.ReadSensorData()
+
     @classmethod
     def Refresh(cls):
+        """
+        Liest den Sensor aus (laeuft meist in einem Thread des Executors).
+        Die neuen Daten werden ueber PostEvent im Loop uebernommen, dort werden auch die Alerts verschickt.
+        """
         if DEBUG: print("Reading Data from Sensor {}".format(cls.NAME))
         try:
-            cls.SensorData = cls.ReadSensorData()
+            data = cls.ReadSensorData()
         except Exception as e: #TODO: Exception-Handling verbessern
-            print("ERROR while reading Data from Sensor {}: {}!".format(cls.NAME, e))
-            cls.NewAlertMsg = "Error while reading Data from Sensor {}: {}!".format(cls.NAME, e)
+            PostEvent(cls._Apply, None, e)
         else:
+            PostEvent(cls._Apply, data)
+
+    @classmethod
+    async def RefreshAsync(cls):
+        """wie Refresh, aber fuer Sensoren mit READ_ASYNC = True (laeuft im asyncio-Loop statt im Executor)."""
+        if DEBUG: print("Reading Data from Sensor {} (async)".format(cls.NAME))
+        try:
+            data = await cls.ReadSensorDataAsync()
+        except Exception as e:
+            cls._Apply(None, e)
+        else:
+            cls._Apply(data)
+
+    @classmethod
+    def _Apply(cls, data, error = None, propagate = True):
+        """
+        Uebernimmt neu ausgelesene Sensordaten (bzw. den Fehler beim Auslesen),
+        prueft die Alerts und verschickt neue Alerts.
+        Anschliessend werden die abhaengigen Sensoren neu berechnet (siehe _Propagate).
+        """
+        changed = error is None and (data != cls.SensorData or cls.PROPAGATE_ALWAYS)
+        if error is None:
+            cls.SensorData = data
+            try:
+                cls.History.append(float(data))
+            except (TypeError, ValueError):
+                pass # nicht numerische Werte (z.B. IP-Adresse) haben keinen Verlauf
             cls.NewAlertMsg = cls.CheckAlerts()
+            cls.NewAlertSeverity = 1
+            rules = AlertRules.get(cls.NAME)
+            if rules is not None:
+                # Regeln mit Hysterese, Haltezeit und Ratenbegrenzung (siehe alerts.py):
+                rules.evaluate(data, loop.time())
+                cls.NewAlertMsg = rules.state.message if rules.state else False
+                cls.NewAlertSeverity = rules.state.severity if rules.state else 0
+            for callback in list(cls.SampleSubscribers.values()):
+                callback()
+        else:
+            print("ERROR while reading Data from Sensor {}: {}!".format(cls.NAME, error))
+            cls.NewAlertMsg = "Error while reading Data from Sensor {}: {}!".format(cls.NAME, error)
+            cls.NewAlertSeverity = 1
         if cls.NewAlertMsg != cls.AlertMsg: # nur neue Alerts
             # Bei jedem Refresh werden, falls vorhanden, neue Alert-Nachrichten verschickt
             cls.AlertMsg = cls.NewAlertMsg
+            cls.AlertSeverity = cls.NewAlertSeverity
             if cls.AlertMsg: cls.Alert()
+        if propagate and changed and cls.Downstream:
+            cls._Propagate()
+        return changed
+
+    @classmethod
+    def _Propagate(cls):
+        """
+        Berechnet alle von diesem Sensor abhaengigen Sensoren in topologischer Reihenfolge neu.
+        Jeder abhaengige Sensor wird genau einmal berechnet, und nur, wenn sich einer seiner Upstream-Sensoren geaendert hat.
+        """
+        changed = {cls}
+        for Sen in cls.Downstream:
+            if not any(up in changed for up in Sen.DEPENDS_ON):
+                continue
+            try:
+                data = Sen.ReadSensorData()
+            except Exception as e:
+                Sen._Apply(None, e, propagate = False)
+            else:
+                if Sen._Apply(data, propagate = False):
+                    changed.add(Sen)
 
     @classmethod
     def SubscribeAlerts(cls, AlertOutput):
@@ -281,21 +650,71 @@ class Sensor(metaclass=SensorMeta):
 
     @classmethod
     def Alert(cls):
-        for Output in cls.AlertSubscriber:
-            if DEBUG: print("Sending Alert {} to {}".format(cls.AlertMsg, Output))
-            Output(cls.NAME, cls.GetAlert())
+        if DEBUG: print("Sending Alert {} to {} subscribers".format(cls.AlertMsg, len(cls.AlertSubscriber)))
+        # Ausgeliefert wird ueber die Warteschlangen der Abnehmer im AlertBus (nicht direkt):
+        Bus.post(cls.NAME, cls.GetAlert(), cls.AlertSeverity, list(cls.AlertSubscriber))
 
     @classmethod
     def GetAlert(cls):
             return cls.AlertMsg + ": " + str(cls.SensorData)
 
+    @classmethod
+    def AddDemand(cls, consumer, interval):
+        """
+        Meldet einen Abnehmer an, der den Sensor alle "interval" Sekunden braucht. Der Sensor wird so oft
+        aktualisiert, wie es der schnellste Abnehmer verlangt (aber nie oefter als REFRESH_TIME).
+        """
+        cls.Demand[consumer] = interval
+        # Abgeleitete Sensoren werden nur mit ihren Upstream-Sensoren aktualisiert:
+        for up in cls.DEPENDS_ON:
+            up.AddDemand((cls, consumer), interval)
+        cls._Reschedule()
+
+    @classmethod
+    def RemoveDemand(cls, consumer):
+        # Der naechste Refresh wird ohnehin mit dem neuen (langsameren) Intervall geplant:
+        cls.Demand.pop(consumer, None)
+        for up in cls.DEPENDS_ON:
+            up.RemoveDemand((cls, consumer))
+
+    @classmethod
+    def CurrentRefreshTime(cls):
+        """Intervall, in dem der Sensor gerade aktualisiert wird (None: gar nicht)."""
+        if not cls.REFRESH_TIME:
+            return None
+        if cls.Demand:
+            return max(cls.REFRESH_TIME, min(cls.Demand.values()))
+        return cls.IDLE_REFRESH_TIME
+
     @classmethod
     def _AutoRefresh(cls):
+        if cls.DEPENDS_ON:
+            return # wird bei jedem neuen Wert der Upstream-Sensoren neu berechnet (siehe _Propagate)
         if not shutdown:
-            cls.RefreshTask = loop.run_in_executor(executor, cls.Refresh)
-            if cls.REFRESH_TIME:
-                # schedule next Refresh if REFRESH_TIME is not False:
-                cls.NextRefresh = loop.call_later(cls.REFRESH_TIME, cls._AutoRefresh)
+            if cls.READ_ASYNC:
+                cls.RefreshTask = asyncio.ensure_future(cls.RefreshAsync(), loop = loop)
+            else:
+                cls.RefreshTask = loop.run_in_executor(executor, cls.Refresh)
+            cls.NextRefresh = None
+            t = cls.CurrentRefreshTime()
+            if t:
+                # schedule next Refresh if the sensor is still needed:
+                cls.NextRefreshTime = loop.time() + t
+                cls.NextRefresh = loop.call_later(t, cls._AutoRefresh)
+
+    @classmethod
+    def _Reschedule(cls):
+        """Zieht den naechsten Refresh vor, falls ein neuer Abnehmer den Sensor oefter braucht."""
+        t = cls.CurrentRefreshTime()
+        if shutdown or not t or cls.DEPENDS_ON or Sensoren.get(cls.NAME) is not cls:
+            return
+        if cls.NextRefresh is None:
+            # Sensor wurde ohne Abnehmer gar nicht mehr aktualisiert --> sofort wieder starten
+            cls._AutoRefresh()
+        elif loop.time() + t < cls.NextRefreshTime:
+            cls.NextRefresh.cancel()
+            cls.NextRefreshTime = loop.time() + t
+            cls.NextRefresh = loop.call_later(t, cls._AutoRefresh)
 
     # ---------------------
     ## -- Objektmethoden --
@@ -304,6 +723,8 @@ class Sensor(metaclass=SensorMeta):
     def __init__(self):
         self._sub = False
         self.lastPubValue = None
+        self.lastPubTime = None
+        self.PublishHandle = None
 
     def subscribe(self, Output, OnlyNew = True, time = False):
         """
@@ -326,11 +747,123 @@ class Sensor(metaclass=SensorMeta):
         if t < type(self).REFRESH_TIME:
             if DEBUG: print("Time lower than refresh rate! Taking refresh rate instead.")
             t = type(self).REFRESH_TIME
+        if self.PublishHandle:
+            self.PublishHandle.cancel()
+        self._sub = True
+        # Der Sensor muss mindestens so oft aktualisiert werden, wie veroeffentlicht wird:
+        type(self).AddDemand(self, t)
+        # Sofort einmal veroeffentlichen, danach alle t Sekunden zusammen mit allen anderen Subscriptions mit demselben Intervall:
+        self._SendSensorData(Output, OnlyNew)
+        self.PublishHandle = Publisher.add(t, self._SendSensorData, Output, OnlyNew)
+
+    def subscribeOnChange(self, Output, time = False, deadband = None, reldeadband = None, maxsilence = None):
+        """
+        Wie subscribe, aber ein Wert wird nur veroeffentlicht, wenn er sich seit dem zuletzt veroeffentlichten Wert
+        um mehr als "deadband" (absolut) oder mehr als "reldeadband" (relativ, z.B. 0.05 = 5%) geaendert hat.
+        Ohne deadband und reldeadband wird jede Aenderung veroeffentlicht.
+        Wurde "maxsilence" Sekunden lang nichts veroeffentlicht, wird der aktuelle Wert trotzdem geschickt (Heartbeat).
+        "time" gibt an, wie oft der Sensor dafuer mindestens aktualisiert werden soll (Standard: REFRESH_TIME).
+        Neue Werte werden sofort beim Aktualisieren geprueft, nicht erst im naechsten Intervall.
+        """
+        t = max(float(time), type(self).REFRESH_TIME or 0) if time else type(self).REFRESH_TIME
+        self.desubscribe()
+        self._sub = True
+        self._Output = Output
+        self._deadband = float(deadband) if deadband else None
+        self._reldeadband = float(reldeadband) if reldeadband else None
+        self._maxsilence = float(maxsilence) if maxsilence else None
+        if t:
+            type(self).AddDemand(self, t)
+        type(self).SampleSubscribers[self] = self._PublishOnChange
+        # aktuellen Wert sofort veroeffentlichen:
+        self._Publish(type(self).SensorData)
+        if self._maxsilence:
+            # Pruefen, ob der Heartbeat faellig ist --> spaetestens nach 1.25 x maxsilence wird etwas verschickt:
+            self.PublishHandle = Publisher.add(self._maxsilence / 4, self._Heartbeat)
+
+    def _Publish(self, Data):
+        self.lastPubValue = Data
+        self.lastPubTime = loop.time()
+        if Data is not None and not shutdown:
+            if DEBUG: print("Sending Sensor Data: {}".format(Data))
+            self._Output(str(type(self).NAME), str(Data), str(type(self).UNIT))
+
+    def _PublishOnChange(self):
+        """wird nach jedem neuen Wert des Sensors aufgerufen (siehe Sensor._Apply)."""
+        Data = type(self).SensorData
+        last = self.lastPubValue
+        if Data == last:
+            return
+        try:
+            diff = abs(float(Data) - float(last))
+        except (TypeError, ValueError):
+            # nicht numerisch oder noch kein Wert veroeffentlicht --> jede Aenderung veroeffentlichen
+            self._Publish(Data)
+            return
+        if self._deadband is None and self._reldeadband is None:
+            changed = True
+        else:
+            changed = (self._deadband is not None and diff > self._deadband) or \
+                      (self._reldeadband is not None and diff > self._reldeadband * abs(float(last)))
+        if changed:
+            self._Publish(Data)
+
+    def _Heartbeat(self):
+        if loop.time() - self.lastPubTime >= self._maxsilence:
+            self._Publish(type(self).SensorData)
+
+    def subscribeAggregate(self, Output, time = False):
+        """
+        Fasst alle Werte des Sensors ueber jeweils "time" Sekunden (Standard: REFRESH_TIME) zusammen und
+        veroeffentlicht pro Intervall einmal Output(Name, (min, max, mean, count, last), Unit).
+        Der Sensor wird dafuer so schnell wie moeglich aktualisiert, damit auch kurze Spitzen erfasst werden.
+        Intervalle ohne neue Werte werden nicht veroeffentlicht.
+        """
+        t = max(float(time), type(self).REFRESH_TIME or 0) if time else type(self).REFRESH_TIME
+        if not t:
+            raise ValueError("Sensor {} is not refreshed, nothing to aggregate".format(type(self).NAME))
+        self.desubscribe()
         self._sub = True
-        self._SendSensorData(Output, OnlyNew, t)
+        self._Output = Output
+        self._ResetAggregate()
+        type(self).AddDemand(self, type(self).REFRESH_TIME)
+        type(self).SampleSubscribers[self] = self._AddSample
+        self.PublishHandle = Publisher.add(t, self._PublishAggregate)
+
+    def _ResetAggregate(self):
+        self._aggMin = self._aggMax = self._aggLast = None
+        self._aggSum = 0.0
+        self._aggCount = 0
+
+    def _AddSample(self):
+        """wird nach jedem neuen Wert des Sensors aufgerufen (siehe Sensor._Apply)."""
+        try:
+            value = float(type(self).SensorData)
+        except (TypeError, ValueError):
+            return
+        if self._aggCount:
+            self._aggMin = min(self._aggMin, value)
+            self._aggMax = max(self._aggMax, value)
+        else:
+            self._aggMin = self._aggMax = value
+        self._aggSum += value
+        self._aggCount += 1
+        self._aggLast = value
+
+    def _PublishAggregate(self):
+        if self._aggCount and not shutdown:
+            stats = (self._aggMin, self._aggMax, self._aggSum / self._aggCount, self._aggCount, self._aggLast)
+            if DEBUG: print("Sending aggregated Sensor Data: {}".format(stats))
+            self._Output(str(type(self).NAME), stats, str(type(self).UNIT))
+        self._ResetAggregate()
 
     def desubscribe(self):
         self._sub = False
+        if self.PublishHandle:
+            self.PublishHandle.cancel()
+            self.PublishHandle = None
+        type(self).SampleSubscribers.pop(self, None)
+        type(self).RemoveDemand(self)
 
     def getSensorData(self, OnlyNew = False, Refresh = False):
         """
@@ -352,19 +885,16 @@ class Sensor(metaclass=SensorMeta):
             self.lastPubValue = Value
             return Value
 
-    def _SendSensorData(self, Output, OnlyNew, t):
+    def _SendSensorData(self, Output, OnlyNew):
         """
-        Veroeffentlicht die Sensordaten wiederholt an die uebergebene 'Output(Name, SensorDaten, Einheit)'- Fkt
-        time gibt die Zeit in Sekunden zwischend den Veroeffentlichungen an
-        BEACHTEN: Es macht keinen Sinn, das Intervall der Veroeffentlichungen kleiner zu waehlen
-                  als das Intervall, in dem die jeweiligen Sensordaten aktualisiert werden (REFRESH_TIME)!
+        Veroeffentlicht die Sensordaten an die uebergebene 'Output(Name, SensorDaten, Einheit)'- Fkt.
+        Wird von subscribe einmal direkt und danach vom Publisher in festen Intervallen aufgerufen.
         """
         Data = self.getSensorData(OnlyNew)
         if self._sub and not shutdown:
             if not Data == None:
                 if DEBUG: print("Sending Sensor Data: {}".format(Data))
                 Output(str(type(self).NAME), str(Data), str(type(self).UNIT))
-            self.NextSendTask = loop.call_later(t, self._SendSensorData, Output, OnlyNew, t)
 
 
 # --------------------------------
@@ -372,9 +902,50 @@ class Sensor(metaclass=SensorMeta):
 # --------------------------------
 
 # -- Battery Monitor --
-class Batt_Mon:
+BattMonRecord = collections.namedtuple("BattMonRecord", "time voltage current charge temp")
+
+# Kennung in der Zeile vom BattMon --> Feld im BattMonRecord:
+BATT_MON_FIELDS = {b'V': "voltage", b'A': "current", b'C': "charge", b'T': "temp"}
+
+def ParseBattMonLine(line, receiveTime = None):
+    """
+    Zerlegt eine Zeile vom BattMon (z.B. b'V: 11.2, A: -1.3, C: 3400, T: 24.5\\r\\n') in einen BattMonRecord.
+    Felder, die fehlen oder nicht als Zahl gelesen werden koennen, sind None.
+    """
+    values = dict.fromkeys(BATT_MON_FIELDS.values())
+    for part in line.split(b','):
+        key, sep, value = part.partition(b':')
+        field = BATT_MON_FIELDS.get(key.strip())
+        if field and sep:
+            try:
+                values[field] = float(value)
+            except ValueError:
+                pass
+    return BattMonRecord(receiveTime, **values)
+
+
+class Batt_Mon(Sensor):
+    """
+    Interner Sensor, der die Zeilen vom BattMon (Arduino) empfaengt. Sein Wert ist der zuletzt empfangene BattMonRecord,
+    die Batt_Mon-Sensoren werden daraus ueber DEPENDS_ON berechnet (siehe Batt_Mon_Value).
+    """
+    NAME = "BattMon"
+    UNIT = ""
+    INTERNAL = True
+    PROPAGATE_ALWAYS = True # jede Zeile ist ein neuer Messwert, auch wenn sie der vorigen gleicht
     REFRESH_TIME = 1 # wird eigentlich durch Batt_Mon (Arduino) vorgegeben, muss hier nur als default subscribe-Zeit angegeben werden!
     RefreshTask = None
+    ReceiveTime = None # Zeitpunkt (loop.time()), zu dem der Record in SensorData empfangen wurde
+
+    @classmethod
+    def ConnectionAlert(cls, msg):
+        """Meldet einen Verbindungsfehler bei allen abhaengigen Batt_Mon-Sensoren."""
+        for Sen in cls.Downstream:
+            Sen.NewAlertMsg = msg
+            if Sen.AlertMsg != Sen.NewAlertMsg:
+                Sen.AlertMsg = Sen.NewAlertMsg
+                Sen.AlertSeverity = 2
+                Sen.Alert()
 
     @classmethod
     def ConnectToBattMon(cls):
@@ -389,43 +960,83 @@ class Batt_Mon:
 
         if i == 6:
             print("ERROR: Could not connect to BattMon")
-            for subcls in cls.__subclasses__():
-                subcls.NewAlertMsg = "Could not connect to BattMon"
-                if subcls.AlertMsg != subcls.NewAlertMsg:
-                    subcls.AlertMsg = subcls.NewAlertMsg
-                    subcls.Alert()
-                
+            Batt_Mon.ConnectionAlert("Could not connect to BattMon")
             # try again to connect to BattMon after 5 sec:
             if not shutdown:
                 Batt_Mon.ConnectTask = loop.call_later(5, Batt_Mon.ConnectToBattMon)
         elif i == 10:
             print("Successfully connected to BattMon")
-            Batt_Mon.RefreshTask = loop.run_in_executor(executor, Batt_Mon.ReadSerial)
+            # Der Port wird nicht blockierend im asyncio-Loop gelesen --> kein Thread des Executors wird dauerhaft belegt:
+            cls.ser.timeout = 0
+            cls.LineBuffer = bytearray()
+            Batt_Mon.RefreshTask = loop.call_later(5, Batt_Mon.StartReading) # Wait until Arduino rebooted
 
+    @classmethod
+    def StartReading(cls):
+        if shutdown:
+            cls.ser.close()
+            return
+        try:
+            cls.ser.write(b'start')
+            loop.add_reader(cls.ser.fileno(), cls.ReadSerial)
+        except (serial.serialutil.SerialException, OSError) as e:
+            print(e)
+            cls.ConnectionLost()
 
     @classmethod
     def ReadSerial(cls):
-        time.sleep(5) # Wait until Arduino rebooted
-        cls.ser.write(b'start')
-        while cls.ser.is_open and not shutdown:
-            try:
-                cls.SensorData = cls.ser.readline() # blokiert solange bis eine neue Zeile empfangen wurde
-                cls.ser.reset_input_buffer()        # Sichergehen, dass nur neue Werte gelesen werden
-                for subcls in cls.__subclasses__():
-                    subcls.Refresh()
-            except serial.serialutil.SerialException as e:
-                print(e)
-                break
+        """
+        Wird vom asyncio-Loop aufgerufen, sobald Daten am seriellen Port anliegen.
+        Jede vollstaendige Zeile wird mit ihrem Empfangszeitpunkt (loop.time()) zerlegt und als neuer Wert uebernommen,
+        die Batt_Mon-Sensoren werden dabei ueber _Propagate neu berechnet.
+        Es werden keine Werte verworfen (kein reset_input_buffer mehr).
+        """
+        try:
+            data = cls.ser.read(cls.ser.in_waiting or 1)
+        except (serial.serialutil.SerialException, OSError) as e:
+            print(e)
+            cls.ConnectionLost()
+            return
+        now = loop.time()
+        cls.LineBuffer += data
+        start = 0
+        end = cls.LineBuffer.find(b'\n')
+        while end >= 0:
+            # Die Zeile wird nur einmal zerlegt, alle Batt_Mon-Sensoren lesen danach aus dem Record:
+            Batt_Mon.ReceiveTime = now
+            Batt_Mon._Apply(ParseBattMonLine(bytes(cls.LineBuffer[start : end + 1]), now))
+            start = end + 1
+            end = cls.LineBuffer.find(b'\n', start)
+        del cls.LineBuffer[:start]
+        if len(cls.LineBuffer) > MAX_SERIAL_LINE:
+            # Muell ohne Zeilenende verwerfen:
+            cls.LineBuffer.clear()
+
+    @classmethod
+    def ConnectionLost(cls):
+        try:
+            loop.remove_reader(cls.ser.fileno())
+        except (ValueError, OSError):
+            pass
         cls.ser.close()
         if not shutdown:
-            for subcls in cls.__subclasses__():
-                subcls.NewAlertMsg = "Connection to BattMon lost"
-                if subcls.AlertMsg != subcls.NewAlertMsg:
-                    subcls.AlertMsg = subcls.NewAlertMsg
-                    subcls.Alert()
+            Batt_Mon.ConnectionAlert("Connection to BattMon lost")
             # try again to connect to BattMon after 5 sec:
             Batt_Mon.ConnectTask = loop.call_later(5, Batt_Mon.ConnectToBattMon)
 
+    @classmethod
+    def close(cls):
+        if getattr(cls, "ser", None) and cls.ser.is_open:
+            try:
+                loop.remove_reader(cls.ser.fileno())
+            except (ValueError, OSError):
+                pass
+            cls.ser.close()
+
+    @classmethod
+    def _Reschedule(cls):
+        pass # Der BattMon schickt seine Werte von selbst, die Rate kann hier nicht geaendert werden
+
     @classmethod
     def _AutoRefresh(cls):
         if not Batt_Mon.RefreshTask and not shutdown:
@@ -433,39 +1044,51 @@ class Batt_Mon:
             Batt_Mon.ConnectTask = loop.call_later(5, Batt_Mon.ConnectToBattMon)
 
 
-class Batt_Mon_Voltage(Batt_Mon, Sensor):
-    NAME = "Batt.-Voltage"
-    UNIT = "V"
-    #REFRESH_TIME wird durch Batt_Mon vorgegeben!
+class Batt_Mon_Value:
+    """Mixin fuer die Batt_Mon-Sensoren: jeder liefert ein Feld (FIELD) aus dem BattMonRecord von Batt_Mon."""
+    REFRESH_TIME = 1 # nur Default-Subscribe-Zeit, die Werte werden bei jeder Zeile vom BattMon neu berechnet
+    DEPENDS_ON = (Batt_Mon,)
+    FIELD = None     # Feld im BattMonRecord, das der jeweilige Sensor liefert
 
     @classmethod
     def ReadSensorData(cls):
-        Start = Batt_Mon.SensorData.find(b'V: ') + 3
-        End = Batt_Mon.SensorData.find(b',', Start)
-        voltage = float(Batt_Mon.SensorData[Start : End].decode())
-        if 8 < voltage < 13: return voltage
+        value = getattr(Batt_Mon.SensorData, cls.FIELD)
+        if value is None:
+            raise ValueError("no value for {} received from BattMon".format(cls.FIELD))
+        if cls.Valid(value): return value
         else: return cls.SensorData
-            
+
     @classmethod
-    def CheckAlerts(cls):
-        if cls.SensorData < 9.5:
-            return "Low Voltage"
-        else:
-            return False
+    def Valid(cls, value):
+        """Plausibilitaetspruefung, kann von den Sensoren ueberschrieben werden."""
+        return True
+
+
+class Batt_Mon_Voltage(Batt_Mon_Value, Sensor):
+    NAME = "Batt.-Voltage"
+    ID = 1
+    UNIT = "V"
+    #REFRESH_TIME wird durch Batt_Mon vorgegeben!
+
+    FIELD = "voltage"
+
+    @classmethod
+    def Valid(cls, voltage):
+        return 8 < voltage < 13
+
     
-class Batt_Mon_Current(Batt_Mon, Sensor):
+class Batt_Mon_Current(Batt_Mon_Value, Sensor):
     NAME = "Batt.-Current"
+    ID = 2
     UNIT = "A"
     #REFRESH_TIME wird durch Batt_Mon vorgegeben!
     charging = False
 
+    FIELD = "current"
+
     @classmethod
-    def ReadSensorData(cls):
-        Start = Batt_Mon.SensorData.find(b'A: ') + 3
-        End = Batt_Mon.SensorData.find(b',', Start)
-        current = float(Batt_Mon.SensorData[Start : End].decode())
-        if -10 < current < 2: return current
-        else: return cls.SensorData
+    def Valid(cls, current):
+        return -10 < current < 2
 
     @classmethod
     def CheckAlerts(cls):
@@ -476,43 +1099,28 @@ class Batt_Mon_Current(Batt_Mon, Sensor):
         elif cls.SensorData < 0 and cls.charging:
             Steuerung.light.change_mode(mode = 0)
             cls.charging = False
-
-        if abs(cls.SensorData) > 6:
-            return "High Current"
-        else:
-            return False
+        return False # Alerts: siehe alerts.py
     
-class Batt_Mon_Charge(Batt_Mon, Sensor):
+class Batt_Mon_Charge(Batt_Mon_Value, Sensor):
     NAME = "Batt.-Charge"
+    ID = 3
     UNIT = "mAh"
     MAX_CHARGE = 4800 # Maximale Ladung des Akkus
     #REFRESH_TIME wird durch Batt_Mon vorgegeben!
 
-    @classmethod
-    def ReadSensorData(cls):
-        Start = Batt_Mon.SensorData.find(b'C: ') + 3
-        End = Batt_Mon.SensorData.find(b',', Start)
-        charge = float(Batt_Mon.SensorData[Start : End].decode())
-        if 0 <= charge <= cls.MAX_CHARGE: return charge
-        else: return cls.SensorData
+    FIELD = "charge"
 
     @classmethod
-    def CheckAlerts(cls):
-        if cls.SensorData < 500:
-            return "Low Charge"
-        else:
-            return False
+    def Valid(cls, charge):
+        return 0 <= charge <= cls.MAX_CHARGE
 
-class Batt_Mon_Temp(Batt_Mon, Sensor):
+class Batt_Mon_Temp(Batt_Mon_Value, Sensor):
     NAME = "Batt.-Temp"
+    ID = 4
     UNIT = "°C"
     #REFRESH_TIME wird durch Batt_Mon vorgegeben!
 
-    @classmethod
-    def ReadSensorData(cls):
-        Start = Batt_Mon.SensorData.find(b'T: ') + 3
-        End = Batt_Mon.SensorData.find(b'\r', Start)
-        return float(Batt_Mon.SensorData[Start : End].decode())
+    FIELD = "temp"
             
     #@classmethod
     #def CheckAlerts(cls):
@@ -521,6 +1129,7 @@ class Batt_Mon_Temp(Batt_Mon, Sensor):
 class IP_Addr(Sensor):
     """virtueller Sensor, der die IP-Adresse der WLAN-Schnittstelle zurueckgiebt."""
     NAME = "IP-Address"
+    ID = 5
     REFRESH_TIME = False
     UNIT = ""
 
@@ -534,11 +1143,62 @@ class IP_Addr(Sensor):
         return IP
 
 
-class Sonar_Sensor_Front(Sensor):
+# -- Ultraschall-Sensoren --
+class Sonar:
+    """
+    Gemeinsame Methoden der Ultraschall-Sensoren. Die Sensoren werden nicht mit eigenen Timern aktualisiert,
+    sondern vom gemeinsamen SonarScheduler nacheinander in eigenen Zeitschlitzen angepingt (kein Uebersprechen).
+    Das Intervall haengt von der Geschwindigkeit und Richtung ab, die in der Steuerung gesetzt ist:
+    In Fahrtrichtung wird schnell gemessen, entgegen der Fahrtrichtung langsamer und im Stand nur so oft,
+    wie es die Abnehmer verlangen (ohne Abnehmer alle SONAR_IDLE_TIME Sekunden).
+    """
+    READ_ASYNC = True
+    DIRECTION = 1 # 1: misst nach vorne, -1: misst nach hinten
+    IDLE_REFRESH_TIME = SONAR_IDLE_TIME
+
+    @classmethod
+    def ReadSensorData(cls):
+        data = float("{0:0.1f}".format(cls.son.read()))
+        if data > 0: return data
+        else: return cls.SensorData
+
+    @classmethod
+    async def ReadSensorDataAsync(cls):
+        # Die Messung ist fertig, sobald das Echo zurueck ist, ohne einen Thread des Executors zu blockieren:
+        data = float("{0:0.1f}".format(await cls.son.read_async(loop, SONAR_TIMEOUT)))
+        if data > 0: return data
+        else: return cls.SensorData
+
+    @classmethod
+    def PingInterval(cls):
+        speed = Steuerung.get_speed() # wird aus dem Schattenzustand gelesen --> kein pigpio-Aufruf
+        demanded = cls.CurrentRefreshTime() # Abnehmer oder, ohne Abnehmer, IDLE_REFRESH_TIME
+        if speed == 0:
+            return demanded
+        if (speed > 0) == (cls.DIRECTION > 0):
+            # in Fahrtrichtung: je schneller, desto oefter messen
+            interval = max(SONAR_FAST_TIME, SONAR_SLOW_TIME - (SONAR_SLOW_TIME - SONAR_FAST_TIME) * abs(speed) / 100)
+        else:
+            interval = SONAR_SLOW_TIME
+        return min(interval, demanded) if demanded else interval
+
+    @classmethod
+    def _Reschedule(cls):
+        pass # der SonarScheduler fragt PingInterval vor jedem Zeitschlitz neu ab
+
+    @classmethod
+    def _AutoRefresh(cls):
+        if not shutdown:
+            SonarScheduler.add(cls.RefreshAsync, cls.PingInterval)
+
+
+class Sonar_Sensor_Front(Sonar, Sensor):
     NAME = "Distance Front"
+    ID = 6
     REFRESH_TIME = 0.4
     UNIT = "cm"
 
+    DIRECTION = 1 # zeigt in Fahrtrichtung vorwaerts
     SONAR_TRIGGER = 19
     SONAR_ECHO = 13
     son = sonar.ranger(pi, SONAR_TRIGGER, SONAR_ECHO)
@@ -547,12 +1207,9 @@ class Sonar_Sensor_Front(Sensor):
 
     beep = False
     brake = False
-
-    @classmethod
-    def ReadSensorData(cls):
-        data = float("{0:0.1f}".format(cls.son.read()))
-        if data > 0: return data
-        else: return cls.SensorData
+    # Stufen des Bremsassistenten als Regeln mit Hysterese (ohne Ratenbegrenzung, der Assistent muss sofort reagieren):
+    BrakeAssist = alerts.RuleSet([alerts.Rule("speed limit {} %".format(limit), below = distance, hysteresis = BRAKE_ASSIST_HYSTERESIS)
+                                  for distance, limit in BRAKE_ASSIST_LEVELS], ratelimit = 0)
 
     @classmethod
     def CheckAlerts(cls):
@@ -561,44 +1218,18 @@ class Sonar_Sensor_Front(Sensor):
         if cls.SensorData < 10:
             msg = "Crash!"
             if cls.EN_BUZZER: cls.i = 3
-            if EN_BRAKE_ASSIST:
-                # weiteres Vorwaertsfahren unterbinden
-                Steuerung.set_speed_limit(0, "forward")
-                if not cls.brake:
-                    # nur einmal bremsen, ansonsten kommt man nicht mehr vom Fleck
-                    Steuerung.brake()
-                    cls.brake = True
-                
-            
         elif cls.SensorData < 25:
             msg = "close Obstacle!"
             if cls.EN_BUZZER: cls.i += 2
-            if EN_BRAKE_ASSIST:
-                # Geschwindigkeit auf 20% limitieren
-                Steuerung.set_speed_limit(20, "forward")
-                if not cls.brake:
-                    # nur einmal bremsen, ansonsten kommt man nicht mehr vom Fleck
-                    Steuerung.brake()
-                    cls.brake = True
-            
         elif cls.SensorData < 50:
             msg = "distant Obstacle"
             if cls.EN_BUZZER: cls.i += 1
-            if EN_BRAKE_ASSIST:
-                # Geschwindigkeit auf 50% limitieren
-                Steuerung.set_speed_limit(50, "forward")
-                if not cls.brake:
-                    # nur einmal bremsen, ansonsten kommt man nicht mehr vom Fleck
-                    Steuerung.brake()
-                    cls.brake = True
-            
         else:
             msg = False
             cls.i = 0
-            if EN_BRAKE_ASSIST:
-                # Bremsen wieder erlauben und Speedlimt zuruecksetzen
-                cls.brake = False
-                Steuerung.set_speed_limit(100, "forward")
+
+        if EN_BRAKE_ASSIST:
+            cls.CheckBrakeAssist()
 
         if cls.EN_BUZZER:
             if cls.i >= 3:
@@ -611,12 +1242,34 @@ class Sonar_Sensor_Front(Sensor):
 
         return msg
 
-
-class Sonar_Sensor_Rear(Sensor):
+    @classmethod
+    def CheckBrakeAssist(cls):
+        """
+        Bremsassistent: begrenzt die Geschwindigkeit vorwaerts je nach Abstand (siehe BRAKE_ASSIST_LEVELS).
+        Steuerung wird nur bei einem Wechsel der Stufe aufgerufen.
+        """
+        if cls.BrakeAssist.evaluate(cls.SensorData, loop.time()) is None:
+            return # Stufe unveraendert
+        level = cls.BrakeAssist.state
+        if level is None:
+            # Bremsen wieder erlauben und Speedlimt zuruecksetzen
+            cls.brake = False
+            Steuerung.set_speed_limit(100, "forward")
+            return
+        Steuerung.set_speed_limit(BRAKE_ASSIST_LEVELS[cls.BrakeAssist.rules.index(level)][1], "forward")
+        if not cls.brake:
+            # nur einmal bremsen, ansonsten kommt man nicht mehr vom Fleck
+            Steuerung.brake()
+            cls.brake = True
+
+
+class Sonar_Sensor_Rear(Sonar, Sensor):
     NAME = "Distance Rear"
+    ID = 7
     REFRESH_TIME = 0.6
     UNIT = "cm"
 
+    DIRECTION = -1 # zeigt in Fahrtrichtung rueckwaerts
     SONAR_TRIGGER = 23
     SONAR_ECHO = 24
     son = sonar.ranger(pi, SONAR_TRIGGER, SONAR_ECHO)
@@ -625,12 +1278,6 @@ class Sonar_Sensor_Rear(Sensor):
 
     beep = False
 
-    @classmethod
-    def ReadSensorData(cls):
-        data = float("{0:0.1f}".format(cls.son.read()))
-        if data > 0: return data
-        else: return cls.SensorData
-
     @classmethod
     def CheckAlerts(cls):
         global RearBeep
@@ -661,6 +1308,7 @@ class Sonar_Sensor_Rear(Sensor):
 
 class DS18B20_1(Sensor):
     NAME = "Motor-Temp."
+    ID = 8
     UNIT = "°C"
     REFRESH_TIME = 14
 
@@ -678,23 +1326,19 @@ class DS18B20_1(Sensor):
             return temperature
         else:
             return cls.SensorData # alten Sensorwert zurueckgeben, falls ein Auslesefehler aufgetreten ist
-        
-    @classmethod
-    def CheckAlerts(cls):
-        if cls.SensorData > 60:
-            return "High Motor Temp."
-        else:
-            return False
+
 
 
 # --- DHT22 ---
 class DHT22_Temp(Sensor):
     NAME = "Aussen-Temp"
+    ID = 9
     UNIT = "°C"
     REFRESH_TIME = 20
 
     gpio = 6
     dht22 = DHT22.sensor(pi, gpio)
+    PROPAGATE_ALWAYS = True # jedes Auslesen liefert auch eine neue Luftfeuchtigkeit, auch wenn die Temperatur gleich bleibt
 
     @classmethod
     def ReadSensorData(cls):
@@ -704,9 +1348,11 @@ class DHT22_Temp(Sensor):
     
 class DHT22_Hum(Sensor):
     NAME = "Luftfeuchtigkeit"
+    ID = 10
     UNIT = "%"
     REFRESH_TIME = 20 # Der Sensor wird eigentlich durch die Klasse DHT22_Temp mit aktualisiert,
     # die Refresh-Time muss hier nur als Default-Subscribe-Zeit angegeben werden.
+    DEPENDS_ON = (DHT22_Temp,) # der DHT22 wird von DHT22_Temp ausgelesen
     
     @classmethod
     def ReadSensorData(cls):
@@ -717,6 +1363,7 @@ bmp = Adafruit_BMP.BMP085.BMP085()
 
 class BMP085_Pressure(Sensor):
     NAME = "Luftdruck"
+    ID = 11
     UNIT = "hPa"
     REFRESH_TIME = 25
     
@@ -728,8 +1375,10 @@ class BMP085_Pressure(Sensor):
     
 class BMP_Altitude(Sensor):
     NAME = "Hoehe"
+    ID = 12
     UNIT = "m"
-    REFRESH_TIME = 25
+    REFRESH_TIME = 25 # nur Default-Subscribe-Zeit, die Hoehe wird bei jedem neuen Luftdruck berechnet
+    DEPENDS_ON = (BMP085_Pressure,)
     
     sealevel_pa=101325.0
     
@@ -742,6 +1391,7 @@ class BMP_Altitude(Sensor):
 
 class Mtr_Speed(Sensor):
     NAME = "Motor-Speed"
+    ID = 13
     UNIT = "%"
     REFRESH_TIME = 0.5
 
@@ -751,6 +1401,7 @@ class Mtr_Speed(Sensor):
     
 class Lnk_Pos(Sensor):
     NAME = "Lenk-Position"
+    ID = 14
     UNIT = ""
     REFRESH_TIME = 0.5
 
@@ -785,5 +1436,6 @@ if __name__ == "__main__":
     finally:
         print("Cleaning up...")
         close()
+        pigpio_manager.stop()
         loop.run_until_complete(loop.shutdown_asyncgens())
         loop.close()
@@ -1,9 +1,66 @@
 #!/usr/bin/env python3
 
-## Version 0.6
+## Version 0.7.13
 
 ## Changelog:
 #
+# --- 0.7.13 ---
+# - Protokollaenderung: Der Watchdog ist pro Verbindung nur noch aktiv, wenn der Client ihn mit dem ersten "heartbeat"
+#   (optional mit "timeout") einschaltet. Clients, die nur bei Aenderungen "drive"/"steer" schicken (z.B. der Node-RED-Flow),
+#   werden also nicht mehr nach DISABLE_MOTOR_DELAY Sekunden ohne Befehl gebremst. Beim Verbindungsabbruch wird weiterhin gebremst.
+#
+# --- 0.7.12 ---
+# - Die Zeitstempel des Verlaufs (history) werden erst beim Versenden in Sekunden seit 1970 umgerechnet
+#
+# --- 0.7.11 ---
+# - Beim Verbindungsabbruch wird das Fahrzeug immer zuerst angehalten. Wird der Bremsbefehl abgelehnt oder
+#   tritt beim Aufraeumen ein Fehler auf, wird direkt gebremst (Voraussetzung: Steuerung.py Version 0.5.5).
+#
+# --- 0.7.10 ---
+# - Alerts werden ueber den AlertBus der Sensorik mit eigener Warteschlange pro Verbindung verschickt (Sensorik.py Version 0.8.5)
+#
+# --- 0.7.9 ---
+# - Alerts werden mit der Severity aus den Regeln in alerts.py verschickt (Voraussetzung: Sensorik.py Version 0.8.4)
+#
+# --- 0.7.8 ---
+# - subscribe mit dem Attribut mode="aggregate": pro Intervall eine Zusammenfassung (min, max, mean, count, last) der Sensordaten
+#
+# --- 0.7.7 ---
+# - subscribe mit den Attributen "deadband", "reldeadband" und "maxsilence": Sensordaten nur bei Aenderungen schicken
+#
+# --- 0.7.6 ---
+# - Befehl "history" eingebaut: sendet den Verlauf der Sensordaten (optional "span" in Sekunden und max. Anzahl "points")
+#
+# --- 0.7.5 ---
+# - Verbindungen zu pigpiod werden am Ende zentral ueber pigpio_manager beendet (im Debugging-Modus mit Laufzeitstatistik)
+#
+# --- 0.7.4 ---
+# - Jede Verbindung ist beim Watchdog der Steuerung als eigene Befehlsquelle angemeldet (Voraussetzung: Steuerung.py Version 0.5.1)
+# - Befehl "heartbeat" (optional mit "timeout" in Sekunden) eingebaut, um die Geschwindigkeit ohne neue Fahrbefehle zu halten
+#
+# --- 0.7.3 ---
+# - Fahr- und Lenkbefehle werden an die Regelschleife in Steuerung.py uebergeben (Voraussetzung: Steuerung.py Version 0.5)
+# - ACKs fuer "drive" und "steer" werden pro Takt der Regelschleife zusammengefasst
+#
+# --- 0.7.2 ---
+# - Sendewarteschlange pro Verbindung (srccp.OutboundQueue) mit pause_writing/resume_writing
+# --> bei langsamen Clients werden nur die neuesten Sensordaten aufgehoben, ACK/NACK/Alerts gehen nie verloren
+#
+# --- 0.7.1 ---
+# - Sensordaten werden ueber einen gemeinsamen Hub pro Sensor und Intervall verteilt (srccp.SensorHub)
+# --> jeder Wert wird nur einmal kodiert und an alle Subscriber geschickt, egal wie viele Clients verbunden sind
+# - Bugfix: Beim Desubscriben von Alerts wurde auch die Subscription der Sensordaten geloescht
+#
+# --- 0.7 ---
+# - Kompakte binaere Kodierung der Nachrichten eingebaut (srccp.BinaryCodec, Header "/SRCCP/v0.2b")
+# --> kann von jedem Client mit dem Befehl "encoding" fuer seine Verbindung gewaehlt werden, Standard bleibt XML
+# - Bugfix: beim Desubscriben von Sensordaten wurde statt dem Sensornamen das XML-Element uebergeben
+#
+# --- 0.6.1 ---
+# - Empfangene Daten werden pro Verbindung gepuffert (srccp.FrameDecoder)
+# --> auf mehrere TCP-Segmente aufgeteilte Pakete werden wieder zusammengesetzt
+# --> Paketanfang wird mit bytes.find statt Byte fuer Byte gesucht
+#
 # --- 0.6 ---
 # - Automatisches Starten des Node-Red-Flows eingebaut
 #
@@ -48,7 +105,6 @@
 ## TODO:
 # - Error-Messages (NACK) spezifiezeieren uns festlegen, was bei einem NACK unternommen wird
 # - Alert-Severity einbauen!
-# - Ueberlegen, was passieren soll, falls ein Paket aufgeteilt wird!
 
 
 import asyncio
@@ -61,6 +117,9 @@ import Steuerung #_fake as Steuerung
 import Sensorik  #_fake as Sensorik
 
 import light
+import srccp
+import history
+import pigpio_manager
 
 IP = ""
 PORT = 8889
@@ -69,6 +128,12 @@ EN_NODE_RED = True # Falls True: Node-RED automatisch starten (muss installiert
 
 DEBUG = True if "-d" in sys.argv else False
 
+COALESCED_ACKS = ("drive", "steer", "heartbeat") # ACKs fuer diese Befehle werden pro Takt der Regelschleife zusammengefasst
+
+WRITE_BUFFER_HIGH = 4096 # Bytes im Sendepuffer, ab denen nur noch die neuesten Sensordaten aufgehoben werden
+
+ALERT_RATELIMIT = 0.5 # Alerts werden pro Verbindung hoechstens alle 0.5 s (gesammelt) verschickt
+
 WELCOME_MSG = """
                Welcome to the TCP Socket of the
        
@@ -103,269 +168,329 @@ class SRCCP(asyncio.Protocol):
     def __init__(self):
         """Konstruktor"""
         self.subscribedSensors = {}
+        # Decoder, der die empfangenen Daten puffert und daraus die SRCCP-Pakete zusammensetzt:
+        self.decoder = srccp.FrameDecoder(onError = self.SendTransmissionError)
+        # Kodierung der gesendeten Nachrichten (kann vom Client mit dem Befehl "encoding" geaendert werden):
+        self.codec = CODECS["xml"]
+        # Befehle, deren ACK noch aussteht (siehe QueueACK):
+        self.pendingACKs = set()
 
     def connection_made(self, transport):
         """wird bei jedem neuen Verbindungsaufbau aufgerufen."""
         self.peername = transport.get_extra_info('peername')
         print("Connection from {}".format(self.peername))
         self.transport = transport
+        # Ab dieser Menge an ungesendeten Daten wird "pause_writing" aufgerufen:
+        transport.set_write_buffer_limits(high = WRITE_BUFFER_HIGH)
+        self.outbound = srccp.OutboundQueue(transport)
+        # Beim Watchdog der Steuerung als eigene Befehlsquelle anmelden (ohne Frist, bis der Client "heartbeat" schickt):
+        self.source = "net:{}".format(self.peername)
+        self.watchdogArmed = False
+        Steuerung.register_source(self.source, None)
         self.SendMsg("system", WELCOME_MSG)
-        # Subscribe Alerts from all Sensors:
+        # Subscribe Alerts from all Sensors (mit eigener Warteschlange im AlertBus):
+        Sensorik.Bus.register(self.SendAlert, ALERT_RATELIMIT)
         for Sen in Sensorik.Sensoren:
             Sensorik.Sensoren[Sen].SubscribeAlerts(self.SendAlert)
 
+    def pause_writing(self):
+        """Wird von asyncio aufgerufen, wenn der Sendepuffer des Transports zu voll ist."""
+        if DEBUG: print("Host {} can't keep up, pausing...".format(self.peername))
+        self.outbound.pause()
+
+    def resume_writing(self):
+        """Wird von asyncio aufgerufen, sobald der Sendepuffer wieder geleert wurde."""
+        if DEBUG: print("Host {} resumed, {} outdated packets dropped so far".format(self.peername, self.outbound.dropped))
+        self.outbound.resume()
+
     def connection_lost(self, exc):
         """Wird beim (erwarteten oder unerwarteten) Verbindungsabbruch ausgefuehrt."""
         print("Client {} closed the connection".format(self.peername))
+        print("Stopping Vehicle...")
+        try:
+            if Steuerung.set_brake(self.source) != 0:
+                Steuerung.brake()
+        except Exception as e:
+            print("ERROR while stopping vehicle: {} --> braking directly".format(e))
+            Steuerung.brake()
+        Steuerung.release_source(self.source)
         for sensor in list(self.subscribedSensors):
             print("cancel publishing value of sensor {} to {}".format(sensor,self.peername))
-            self.subscribedSensors[sensor].desubscribe()
+            self.subscribedSensors[sensor].desubscribe(self)
             del self.subscribedSensors[sensor]
         print("desubscribing Alerts from all Sensors...")
         for Sen in Sensorik.Sensoren:
             Sensorik.Sensoren[Sen].DesubscribeAlerts(self.SendAlert)
-        print("Stopping Vehicle...")
-        Steuerung.brake()
+        Sensorik.Bus.unregister(self.SendAlert)
         Steuerung.disable_steering()
 
     def data_received(self, receivedData):
         """
         Wird immer aufgerufen, wenn Daten ("receiveData") von einem verbundenen Client empfangen wird.
-        Die empfangenen Daten werden dann ausgewährtet und auf bekannte Muster geprueft.
+        Die empfangenen Daten werden an den Decoder der Verbindung uebergeben, der die Pakete auch dann
+        wieder zusammensetzt, wenn sie auf mehrere TCP-Segmente aufgeteilt wurden.
+        Jedes vollstaendig empfangene Paket wird anschliessend von "HandleFrame" ausgewertet.
+        """
+        if DEBUG: print("Data received from Host {}: {!r}".format(self.peername, receivedData))
+        self.decoder.feed(receivedData)
+        for header, message in self.decoder.frames():
+            self.HandleFrame(header, message)
+
+    def HandleFrame(self, header, message):
+        """
+        Wertet ein empfangenes SRCCP-Paket aus und prueft es auf bekannte Muster.
         Bei korrekt empfangenen und bekannten Nachrichten wird die gewuenschte Aktion ausgeloest.
         """
-        print("Data received from Host {}: {!r}".format(self.peername, receivedData))
-
-        readPos = 0
-        while readPos < len(receivedData):
-            
-            #gehe die empfangenen bytes solange durch bis "/SRCCP/" gefunden wird
-            if receivedData[readPos+2 : readPos+9] == b'/SRCCP/':
-                
-                try:
-                    length = int.from_bytes(receivedData[readPos : readPos+2], "big")
-        
-                    frame = receivedData[readPos+2 : readPos+length+2]
-                    
-                    if DEBUG: 
-                        print("Received SRCCP-Packet:")
-                        print("parsed length: ", length)   
-                        print("parsed frame: ", frame)
-                    
-                    if not frame.endswith(b'#/'):
-                        print("ERROR: Wrong length or incomplete data received!")
-                        self.SendNACK("TransmissionError", "Incomplete or malformed packet received")
-                        # suche weiter nach einem Paket...
-                        readPos += 1
-                        continue
-                    
-                    
-                    readPos += (length + 2) 
-                    
-                    headerEnd = frame.find(b'/#', 7)
-                    header = frame[ : headerEnd]       
-                    
-                    message = frame[headerEnd+2 : -2].decode()
-                    
-                    ack = 0
-                    
-                    if DEBUG:    
-                        print("header =\n", header)
-                        print("---")
-                        print("parsed length = ", length)
-                        print("---")
-                        print("message =\n", message)
-                        print("---")
-                        print("parsing XML...")
-                       
-                    root = ET.fromstring(message)
-                        
-                    if root.tag == "cmd":
-                        command = root.find("name").text
-                        print("command received: ", command)
-                            
-                        if command == "drive":
-                            speed = root.find("speed").text
-                            ack += Steuerung.drive(int(speed))
-                            
-                        elif command == "brake":
-                            ack += Steuerung.brake()
-                            
-                        elif command == "steer":
-                            angle = root.find("angle").text
-                            if DEBUG:
-                                print("Steering to ", angle)
-                            ack += Steuerung.steer(int(angle))
-                                
-                        elif command == "subscribe":
-                            if root.find("type").text == "data":
-                                for Sen in root.findall("sensor"):
-                                    ack += self.subscribeSensor(Sen.text, Sen.get("interval"))
-                                    
-                            elif root.find("type").text == "alert":
-                                for Sen in root.findall("sensor"):
-                                    ack += self.subscribeAlert(Sen.text)
-                                          
-                        elif command == "desubscribe":
-                            if root.find("type").text == "data":
-                                for sensor in root.findall("sensor"):
-                                    ack += self.desubscribeSensor(sensor)
-                                        
-                            elif root.find("type").text == "alert":
-                                for sensor in root.findall("sensor"):
-                                    ack += self.desubscribeAlerts(sensor)
-
-                        elif command == "irled":
-                            if root.find("value").text == "0":
-                                Steuerung.disable_ir()
-                            elif root.find("value").text == "1":
-                                Steuerung.enable_ir()
-
-                        elif command == "close":
-                            print("Client '{}' closed the connection".format(self.peername))
-                            self.transport.close()
-
-                        elif command == "shutdown":
-                            print("calling shutdown.sh and shutting down pi...")
-                            subprocess.call("/home/pi/RC-Car/shutdown.sh", shell = True)
-
-                        elif command == "reboot":
-                            print("calling reboot.sh and rebooting pi...")
-                            subprocess.call("/home/pi/RC-Car/reboot.sh", shell = True)
-
-                                
-                    elif root.tag == "msg":
-                        print("message received, nothing to do here...")
-                            
-                    elif root.tag == "ctlmsg":
-                        print("controlmessage received. ERROR: Not implemented yet!")
-                        # TODO: z.B. bei NACK Fehlermeldung auswerten und Nachricht evtl wiederholen!
-                            
-                    else:
-                        raise ValueError("unknown message")
-                
-                        
-                except ValueError as e:
-                    print("ValueError:" + e.args[0])
-                    self.SendNACK(command, e.args[0])
-                except KeyError as e:
-                    print("KeyError:" + e.args[0])
-                    self.SendNACK(command, e.args[0])
+        command = "unknown"
+        ack = 0
+        newCodec = None
+
+        if DEBUG:
+            print("Received SRCCP-Packet:")
+            print("header =\n", bytes(header))
+            print("---")
+            print("message =\n", bytes(message))
+            print("---")
+            print("decoding message...")
+
+        try:
+            # Die Kodierung jedes empfangenen Pakets ergibt sich aus dessen Header:
+            codec = CODECS_BY_HEADER.get(bytes(header), CODECS["xml"])
+            tag, cmd = codec.decode(message)
+
+            if tag == "cmd":
+                command = cmd["name"]
+                print("command received: ", command)
+
+                # Fahr- und Lenkbefehle werden nur im Briefkasten der Regelschleife abgelegt (siehe Steuerung.set_drive):
+                if command == "drive":
+                    ack += Steuerung.set_drive(int(cmd["speed"]), self.source)
+
+                elif command == "brake":
+                    ack += Steuerung.set_brake(self.source)
+
+                elif command == "steer":
+                    if DEBUG:
+                        print("Steering to ", cmd["angle"])
+                    ack += Steuerung.set_steer(int(cmd["angle"]), self.source)
+
+                elif command == "heartbeat":
+                    # Haelt die aktuelle Geschwindigkeit, ohne einen neuen Fahrbefehl zu schicken.
+                    # Der erste heartbeat schaltet den Watchdog fuer diese Verbindung ein (Standard: DISABLE_MOTOR_DELAY),
+                    # optional kann der Timeout des Watchdogs fuer diese Verbindung geaendert werden:
+                    if cmd.get("timeout"):
+                        Steuerung.register_source(self.source, float(cmd["timeout"]))
+                        self.watchdogArmed = True
+                    elif not self.watchdogArmed:
+                        Steuerung.register_source(self.source)
+                        self.watchdogArmed = True
+                    ack += Steuerung.heartbeat(self.source)
+
+                elif command == "subscribe":
+                    if cmd["type"] == "data":
+                        for sensor, attrs in cmd["sensors"]:
+                            ack += self.subscribeSensor(sensor, attrs.get("interval"), attrs.get("deadband"),
+                                                        attrs.get("reldeadband"), attrs.get("maxsilence"),
+                                                        attrs.get("mode") == "aggregate")
+
+                    elif cmd["type"] == "alert":
+                        for sensor, attrs in cmd["sensors"]:
+                            ack += self.subscribeAlert(sensor)
+
+                elif command == "desubscribe":
+                    if cmd["type"] == "data":
+                        for sensor, attrs in cmd["sensors"]:
+                            ack += self.desubscribeSensor(sensor)
+
+                    elif cmd["type"] == "alert":
+                        for sensor, attrs in cmd["sensors"]:
+                            ack += self.desubscribeAlerts(sensor)
+
+                elif command == "history":
+                    # Verlauf der Sensordaten, damit Clients ihre Diagramme beim Verbinden auffuellen koennen:
+                    for sensor, attrs in cmd["sensors"]:
+                        ack += self.SendHistory(sensor, attrs.get("span"), attrs.get("points"))
+
+                elif command == "irled":
+                    if cmd["value"] == "0":
+                        Steuerung.disable_ir()
+                    elif cmd["value"] == "1":
+                        Steuerung.enable_ir()
+
+                elif command == "encoding":
+                    # Die neue Kodierung gilt erst nach dem ACK:
+                    newCodec = CODECS[cmd["value"]]
+
+                elif command == "close":
+                    print("Client '{}' closed the connection".format(self.peername))
+                    self.transport.close()
+
+                elif command == "shutdown":
+                    print("calling shutdown.sh and shutting down pi...")
+                    subprocess.call("/home/pi/RC-Car/shutdown.sh", shell = True)
+
+                elif command == "reboot":
+                    print("calling reboot.sh and rebooting pi...")
+                    subprocess.call("/home/pi/RC-Car/reboot.sh", shell = True)
+
+
+            elif tag == "msg":
+                print("message received, nothing to do here...")
+
+            elif tag == "ctlmsg":
+                print("controlmessage received. ERROR: Not implemented yet!")
+                # TODO: z.B. bei NACK Fehlermeldung auswerten und Nachricht evtl wiederholen!
+
+            else:
+                raise ValueError("unknown message")
+
+
+        except ValueError as e:
+            print("ValueError:" + e.args[0])
+            self.SendNACK(command, e.args[0])
+        except KeyError as e:
+            print("KeyError:" + e.args[0])
+            self.SendNACK(command, e.args[0])
+        except ET.ParseError as e:
+            print("ParseError:" + str(e))
+            self.SendNACK(command, "malformed XML: " + str(e))
+        else:
+            if ack == 0:
+                if command in COALESCED_ACKS:
+                    self.QueueACK(command)
                 else:
-                    if ack == 0:
-                        self.SendACK(command)
-                    else:
-                        self.SendNACK(command)
+                    self.SendACK(command)
+                if newCodec:
+                    print("Host {} switched to encoding '{}'".format(self.peername, newCodec.NAME))
+                    self.codec = newCodec
             else:
-                #print('unknown protocol!\n') # kann sehr Ressourcen-fressend werden, falls viele unbekannte Daten empfangen werden!
-                readPos += 1 #gehe einfach zum naechsten Zeichen und suche weiter nach bekannten Mustern...
+                self.SendNACK(command)
+
+    def SendTransmissionError(self, Errormsg):
+        """wird vom Decoder aufgerufen, falls ein fehlerhaftes Paket empfangen wurde."""
+        print("ERROR: Wrong length or incomplete data received!")
+        self.SendNACK("TransmissionError", Errormsg)
 
     def SendMsg(self, Sensor, Message, Unit=None):
         """
-        Diese Funktion packt die Sensordaten eines Sensors und optional die zugehoerige Einheit in eine XML
-        und sendet diese XML als SRCCP-Paket an den Client, der den Sensor subscribed hat.
+        Diese Funktion packt die Sensordaten eines Sensors und optional die zugehoerige Einheit
+        in der Kodierung der Verbindung (standardmaessig XML) in ein SRCCP-Paket
+        und sendet dieses an den Client, der den Sensor subscribed hat.
         """
-        
         if DEBUG: print( "Sending Message of Sensor '{}' to Host '{}': '{}'".format(Sensor, self.peername, Message))
-        root = ET.Element('msg')
-        name = ET.SubElement(root, 'name')
-        name.text = "sensordata"
-        sensor = ET.SubElement(root, 'sensor')
-        sensor.text = Sensor
-        data = ET.SubElement(root, 'data')
-        data.text = Message
-        if Unit:
-            unit = ET.SubElement(root, 'unit')
-            unit.text = Unit
-        xml = ET.tostring(root)
-        if DEBUG:
-            print("sending xml:\n", xml)
-        self.SendSRCCPPacket(xml)
-        
+        self.SendSRCCPPacket(self.codec.sensordata(Sensor, Message, Unit), key = Sensor)
+
 
-    def SendAlert(self, Sensor, Message):
+    def SendAlert(self, Sensor, Message, Severity = 1):
         """
         Diese Funktion sendet eine Alert-Message eines Sensors an die Subscriber,
-        indem sie eine XML erstellt und diese als SRCCP-Paket verschickt.
+        indem sie die Nachricht kodiert und als SRCCP-Paket verschickt.
         """
-        if DEBUG: print( "Sending Alert of Sensor '{}' to Host '{}': '{}'".format(Sensor, self.peername, Message))
-        root = ET.Element('msg')
-        name = ET.SubElement(root, 'name')
-        name.text = "alert"
-        sensor = ET.SubElement(root, 'sensor')
-        sensor.text = Sensor
-        #TODO: Severity einbauen!
-        severity = ET.SubElement(root, 'severity')
-        severity.text = "1"
-        message = ET.SubElement(root, 'message')
-        message.text = Message
-        xml = ET.tostring(root)
-        if DEBUG:
-            print("sending xml:\n", xml)
-        self.SendSRCCPPacket(xml)
-        
-        
+        if DEBUG: print( "Sending Alert of Sensor '{}' (severity {}) to Host '{}': '{}'".format(Sensor, Severity, self.peername, Message))
+        self.SendSRCCPPacket(self.codec.alert(Sensor, Message, Severity))
+
+
+    def SendHistory(self, sensor, span = None, points = None):
+        """
+        Sendet den Verlauf eines Sensors (siehe Sensorik.Sensor.History) der letzten "span" Sekunden
+        (Standard: gesamter Verlauf) mit hoechstens "points" Werten, die gleichmaessig verteilt ausgewaehlt werden.
+        """
+        try:
+            SensorCls = Sensorik.Sensoren[sensor]
+            span = float(span) if span else None
+            points = min(int(points), srccp.MAX_HISTORY_POINTS) if points else srccp.MAX_HISTORY_POINTS
+            if points <= 0:
+                raise ValueError("points must be positive")
+        except KeyError:
+            print("ERROR: Unknown sensor '{}'".format(sensor))
+            self.SendNACK("history", "unknown sensor {}".format(sensor))
+            return 1
+        except ValueError as e:
+            print("ValueError:" + e.args[0])
+            self.SendNACK("history", e.args[0])
+            return 1
+        times, values = SensorCls.History.decimated(span, points)
+        times = history.to_wallclock(times)
+        if DEBUG: print("Sending {} values of Sensor '{}' history to Host '{}'".format(len(values), sensor, self.peername))
+        self.SendSRCCPPacket(self.codec.history(sensor, times, values, str(SensorCls.UNIT)))
+        return 0
+
+
     def SendACK(self, command):
         """
         Sendet ein acknowledgement
         """
-        root = ET.Element('ctlmsg')
-        name = ET.SubElement(root, 'name')
-        name.text = "ack"
-        type = ET.SubElement(root, 'type')
-        type.text = command
-        xml = ET.tostring(root)
-        if DEBUG:
-            print("sending ACK to Host '{}':\n {}".format(self.peername, xml))
-        self.SendSRCCPPacket(xml)
+        if DEBUG: print("sending ACK for '{}' to Host '{}'".format(command, self.peername))
+        self.SendSRCCPPacket(self.codec.ack(command))
+
+
+    def QueueACK(self, command):
+        """
+        Fasst die ACKs fuer schnell aufeinanderfolgende Befehle zusammen:
+        Pro Takt der Regelschleife wird fuer jeden Befehl hoechstens ein ACK verschickt.
+        """
+        if command not in self.pendingACKs:
+            self.pendingACKs.add(command)
+            loop.call_later(Steuerung.CONTROL_PERIOD, self.SendPendingACK, command)
+
+    def SendPendingACK(self, command):
+        self.pendingACKs.discard(command)
+        if not self.transport.is_closing():
+            self.SendACK(command)
+
 
-    
     def SendNACK(self, Type, Errormsg = None):
         """
         Sendet ein NOTAcknowledgement
         """
-        root = ET.Element('ctlmsg')
-        name = ET.SubElement(root, 'name')
-        name.text = "nack"
-        type = ET.SubElement(root, 'type')
-        type.text = Type
-        if Errormsg:
-            errormsg = ET.SubElement(root, 'message')
-            errormsg.text = Errormsg
-        xml = ET.tostring(root)
-        if DEBUG:
-            print("sending NACK to Host '{}':\n {}".format(self.peername, xml))
-        self.SendSRCCPPacket(xml)
-        
-    
-    def SendSRCCPPacket(self, XML):
+        if DEBUG: print("sending NACK for '{}' to Host '{}': {}".format(Type, self.peername, Errormsg))
+        self.SendSRCCPPacket(self.codec.nack(Type, Errormsg))
+
+
+    def SendSRCCPPacket(self, Packet, key = None):
         """
-        Packt ein uebergebenes XML (oder eine andere Nachricht) in ein SRCCP-Paket,
-        indem es den notwendigen Rahmen inklusive Paketgroesse hinzufuegt.
+        Sendet ein fertiges SRCCP-Paket (siehe srccp.pack) ueber die Sendewarteschlange an den Client.
+        Pakete mit key (Sensordaten) werden bei einem langsamen Client durch neuere Pakete mit demselben
+        key ersetzt, Pakete ohne key (ACK, NACK, Alerts) werden immer in der richtigen Reihenfolge verschickt.
         """
-        frame = b'/SRCCP/v0.1/#' + XML + b'#/'
-        length = len(frame).to_bytes(2, "big")
-        Packet = length + frame
         if DEBUG: print("Sending SRCCP-Packet to Host '{}':\n {}".format(self.peername, Packet))
-        self.transport.write(Packet)
-        
-        
-    def subscribeSensor(self, sensor, refreshtime = None):
+        self.outbound.write(Packet, key)
+
+
+    def subscribeSensor(self, sensor, refreshtime = None, deadband = None, reldeadband = None, maxsilence = None, aggregate = False):
+        """
+        Meldet die Verbindung beim Hub des Sensors fuer das gewuenschte Intervall an.
+        Alle Verbindungen mit demselben Sensor und denselben Parametern teilen sich einen Hub,
+        der jeden Wert nur einmal kodiert (siehe srccp.SensorHub).
+        Mit "deadband", "reldeadband" oder "maxsilence" werden die Werte nur bei Aenderungen verschickt, z.B.:
+        <sensor deadband="0.5" maxsilence="60">Aussen-Temp</sensor>
+        Mit "aggregate" wird pro Intervall nur eine Zusammenfassung (min, max, mean, count, last) aller Werte verschickt, z.B.:
+        <sensor interval="5" mode="aggregate">Batt.-Current</sensor>
+        """
         try:
+            SensorCls = Sensorik.Sensoren[sensor]
+            # Eingaben pruefen, bevor eine bestehende Subscription geloescht wird:
+            for value in (refreshtime, deadband, reldeadband, maxsilence):
+                if value and float(value) < 0:
+                    raise ValueError("negative values are not allowed")
+            if aggregate and not SensorCls.REFRESH_TIME:
+                raise ValueError("sensor {} can not be aggregated".format(sensor))
+
             # if already subscribed desubscribe first:
             if sensor in self.subscribedSensors:
-                self.subscribedSensors[sensor].desubscribe()
-            else:
-                self.subscribedSensors[sensor] = Sensorik.Sensoren[sensor]()
+                self.subscribedSensors[sensor].desubscribe(self)
+                del self.subscribedSensors[sensor]
+
+            hub = srccp.SensorHub.get(SensorCls, refreshtime, deadband, reldeadband, maxsilence, aggregate)
 
             # Subscribe:
             if refreshtime:
                 if DEBUG: print("Host {} subscribes Sensor '{}' with refresh time {}\n".format(self.peername, sensor, refreshtime))
-                self.subscribedSensors[sensor].subscribe(self.SendMsg, OnlyNew = False, time = refreshtime) # Geaendert: Alle werte publishen, nicht nur neue!
             else:
                 if DEBUG: print("Host {} subscribes Sensor '{}' with default refresh time\n".format(self.peername, sensor))
-                self.subscribedSensors[sensor].subscribe(self.SendMsg, OnlyNew = False)
-        
+            self.subscribedSensors[sensor] = hub
+            hub.subscribe(self)
+
         except KeyError:
             print("ERROR: Unknown sensor '{}'".format(sensor))
             self.SendNACK("subscribe", "unknown sensor {}".format(sensor))
@@ -406,7 +531,7 @@ class SRCCP(asyncio.Protocol):
     def desubscribeSensor(self, sensor):
         try:
             if DEBUG: print("Host {} desubscribes Sensor {}\n".format(self.peername, sensor))
-            self.subscribedSensors[sensor].desubscribe()
+            self.subscribedSensors[sensor].desubscribe(self)
             del self.subscribedSensors[sensor]
         except KeyError:
             print("KeyError: Sensor not subscribed or unknown sensor '{}'".format(sensor))
@@ -419,7 +544,6 @@ class SRCCP(asyncio.Protocol):
         try:
             if DEBUG: print("Host {} desubscribes Alerts from Sensor {}\n".format(self.peername, sensor))
             Sensorik.Sensoren[sensor].DesubscribeAlerts(self.SendAlert)
-            del self.subscribedSensors[sensor]
         except KeyError:
             print("KeyError: Sensor not subscribed or unknown sensor '{}'".format(sensor))
             self.SendNACK("desubscribe", "Sensor not subscribed or unknown sensor '{}'".format(sensor))
@@ -455,6 +579,13 @@ if DEBUG:
 
 Sensorik.init(loop)
 
+# Verfuegbare Kodierungen der SRCCP-Nachrichten (siehe srccp.py):
+CODECS = {
+    "xml": srccp.XMLCodec(),
+    "binary": srccp.BinaryCodec({Sen.NAME: Sen.ID for Sen in Sensorik.SensorenList if getattr(Sen, "ID", None)}),
+    }
+CODECS_BY_HEADER = {codec.HEADER: codec for codec in CODECS.values()}
+
 # Serve requests until Ctrl+C is pressed
 print('Serving on {}'.format(server.sockets[0].getsockname()))
 
@@ -483,5 +614,7 @@ finally:
     # Stop autorefreshing the sensors:
     Sensorik.close()
     Steuerung.close()
+    if DEBUG: pigpio_manager.print_stats()
+    pigpio_manager.stop()
     loop.run_until_complete(loop.shutdown_asyncgens())
     loop.close()
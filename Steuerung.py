@@ -1,9 +1,34 @@
 #!/usr/bin/env python3
 
-## Version 0.4
+## Version 0.5.5
     
 ## Changelog:
 #
+# --- Version 0.5.5 ---
+# - Bremsen wird nie mehr abgelehnt (auch nicht bei blockiertem Motor), und ein direkter Aufruf von brake()
+#   (z.B. Bremsassistent) verwirft einen noch nicht ausgefuehrten Fahrbefehl im Briefkasten.
+# - Der Schattenzustand wird nur uebernommen, wenn pigpio den Aufruf angenommen hat (Rueckgabewert >= 0),
+#   sonst gilt der Ausgang als unbekannt und wird beim naechsten Mal erneut geschrieben.
+#
+# --- Version 0.5.4 ---
+# - Beim Beenden wird gewartet, bis der Render-Thread von light die ausgeschalteten LEDs gesendet hat.
+#
+# --- Version 0.5.3 ---
+# - Verbindungsaufbau zu pigpiod (inkl. Starten von pigpiod) nach pigpio_manager ausgelagert
+# - Motor und Lenkung teilen sich eine Verbindung, Richtungs-Pins werden gebuendelt geschrieben (write_bank/clear_bank)
+#
+# --- Version 0.5.2 ---
+# - Schattenzustand der Ausgaenge eingebaut: Nur noch geaenderte Ausgaenge werden an pigpiod geschickt,
+#   get_speed und get_pw werden ohne pigpio-Aufrufe beantwortet.
+#
+# --- Version 0.5.1 ---
+# - Watchdog (Idee DISABLE_MOTOR_DELAY aus Steuerung-Async.py) wieder eingebaut: Jede Befehlsquelle hat eine Frist,
+#   nach deren Ablauf ohne neuen Befehl oder heartbeat das Fahrzeug gebremst wird (siehe register_source, heartbeat).
+#
+# --- Version 0.5 ---
+# - Regelschleife mit fester Frequenz (CONTROL_RATE) eingebaut: Fahr- und Lenkbefehle (Netzwerk und XBox-Controller)
+#   werden mit set_drive/set_steer nur noch abgelegt, pro Takt wird nur der jeweils neueste Befehl an pigpio uebergeben.
+#
 # --- Version 0.4 ---
 # - Steuerung mit XBox-Controller (wieder) eingebaut (benoetigt "xbox_modified").
 # - Fehlerkorrekturen beim setzen des Speedlimits.
@@ -23,14 +48,12 @@
 
 import time
 import sys
-import os               # wird verwendet, um pigpiod automatisch zu starten
 import subprocess
 import threading
 import xbox_modified as xbox
 import pigpio
+import pigpio_manager   # Verbindungen zu pigpiod (pigpiod wird dort bei Bedarf gestartet)
 # Verwendung: http://abyz.me.uk/rpi/pigpio/python.html#set_servo_pulsewidth
-# Beachten: bevor mittels l = pigpio.pi() eine Instanz der pigpio.pi Klasse
-# erstellt werden kann, muss der Daemon "pigpiod" mittels "sudo pigpiod" gestartet werden!
 
 EN_LIGHT = True
 if EN_LIGHT:
@@ -72,6 +95,68 @@ EN = 17                 # Hauptmotor
 IN1 = 27                # Motor Forwaerts: 0
 IN2 = 22                # Motor Forwaerts: 1
 
+# --- Regelschleife ---
+CONTROL_RATE = 50                   # Frequenz in Hz, mit der neue Fahr- und Lenkbefehle uebernommen werden
+CONTROL_PERIOD = 1 / CONTROL_RATE
+
+# --- Watchdog ---
+# Nach dieser Anzahl an Sekunden ohne neuen Befehl (oder heartbeat) der Quelle, die das Fahrzeug bewegt,
+# wird DEADLINE_ACTION ausgefuehrt. Kann pro Quelle mit register_source geaendert werden.
+DISABLE_MOTOR_DELAY = 1
+MAX_COMMAND_TIMEOUT = 10            # groesster erlaubter Timeout einer Quelle in Sekunden
+DEADLINE_ACTION = "brake"           # "brake" oder "roll"
+
+
+# ------------------------
+## --- Schattenzustand ---
+# ------------------------
+
+# Im Programm gefuehrte Kopie der zuletzt geschriebenen Ausgaenge (Richtungs-Pins, Dutycycle und Pulsweite der Servo).
+# Jeder pigpio-Aufruf ist ein Roundtrip ueber TCP zu pigpiod, deshalb werden nur geaenderte Ausgaenge geschrieben
+# und Abfragen wie get_speed oder get_pw aus dem Schattenzustand beantwortet. None = Zustand unbekannt.
+_Shadow = {IN1: None, IN2: None, "duty": None, "pw": None}
+_ShadowLock = threading.RLock()
+
+def _set_direction(in1, in2):
+    """
+    Setzt die Richtungs-Pins IN1 und IN2. Nur geaenderte Pins werden geschrieben,
+    und zwar gebuendelt mit je einem Aufruf fuer alle zu setzenden und alle zu loeschenden Pins.
+    """
+    with _ShadowLock:
+        setBits = clearBits = 0
+        for pin, level in ((IN1, in1), (IN2, in2)):
+            if _Shadow[pin] != level:
+                if level:
+                    setBits |= 1 << pin
+                else:
+                    clearBits |= 1 << pin
+        ret = 0
+        if clearBits:
+            ret = min(ret, v.clear_bank(clearBits))
+        if setBits:
+            ret = min(ret, v.write_bank(setBits))
+        # Bei einem Fehler (negativer Rueckgabewert) ist der Zustand der Pins unbekannt:
+        _Shadow[IN1], _Shadow[IN2] = (in1, in2) if ret >= 0 else (None, None)
+        return ret
+
+def _set_duty(duty):
+    """Setzt den Dutycycle des Motors nur, falls er sich geaendert hat."""
+    with _ShadowLock:
+        if _Shadow["duty"] == duty:
+            return 0
+        ret = v.set_PWM_dutycycle(EN, duty)
+        _Shadow["duty"] = duty if ret >= 0 else None
+        return ret
+
+def _set_pw(pw):
+    """Setzt die Pulsweite der Servo nur, falls sie sich geaendert hat."""
+    with _ShadowLock:
+        if _Shadow["pw"] == pw:
+            return 0
+        ret = l.set_servo_pulsewidth(SIG_PIN, pw)
+        _Shadow["pw"] = pw if ret >= 0 else None
+        return ret
+
 
 # ----------------
 ## --- Lenkung ---
@@ -93,7 +178,7 @@ def steer(newPos):
     if int(newPos) in range(101):
         _Pos = int(newPos)
         if DEBUG: print("Steering to Position {} ...".format(_Pos))
-        return l.set_servo_pulsewidth(SIG_PIN, _percent_to_pw(_Pos))
+        return _set_pw(_percent_to_pw(_Pos))
     else:
         raise ValueError("Position must be between 0 (right limit) and 100 (left limit)!")
 
@@ -108,7 +193,7 @@ def disable_steering():
     Deaktiviert die Servo
     """
     if DEBUG: print("Disabling Servo...")
-    return l.set_servo_pulsewidth(SIG_PIN, 0)
+    return _set_pw(0)
 
 def get_pos():
     """
@@ -118,9 +203,9 @@ def get_pos():
 
 def get_pw():
     """
-    Gibt die Pulsweite am Signal-Pin des Servos zurueck.
+    Gibt die Pulsweite am Signal-Pin des Servos zurueck (aus dem Schattenzustand, ohne pigpio-Aufruf).
     """
-    return l.get_servo_pulsewidth(SIG_PIN)
+    return _Shadow["pw"] or 0
 
 
 # -----------------------
@@ -135,7 +220,7 @@ def drive(speed):
     Ausnahme: string 'stop' bewirkt Bremsen.
     """
     if speed == "stop":
-        return brake()
+        return _brake()
     elif speed > 0:
         return forward(speed)
     elif speed < 0:
@@ -150,15 +235,14 @@ def forward(speed):
     if speed < 0 or speed > PWM_RANGE:
         raise ValueError("Speed out of range")
     # Richtung festlegen:
-    v.write(IN1, 0)
-    v.write(IN2, 1)
+    _set_direction(0, 1)
     if DEBUG:
         print("Driving forward with speed {} ...".format(int(speed * _Limit_F)))
     if EN_LIGHT:
         light.brake_light(0)
         light.reverse_light(0)
     # Geschwindigkeit ueber PWM festlegen:
-    return v.set_PWM_dutycycle(EN,int(speed * _Limit_F))   
+    return _set_duty(int(speed * _Limit_F))   
 
 def backward(speed):
     if _BlockMtr:
@@ -167,15 +251,14 @@ def backward(speed):
     if speed < 0 or speed > PWM_RANGE:
         raise ValueError("Speed out of range")
     # Richtung festlegen
-    v.write(IN1, 1)
-    v.write(IN2, 0)
+    _set_direction(1, 0)
     if DEBUG:
         print("Driving backward with speed {} ...".format(int(speed * _Limit_B)))
     if EN_LIGHT:
         light.brake_light(0)
         light.reverse_light(1)
     # Geschwindigkeit ueber PWM festlegen:
-    return v.set_PWM_dutycycle(EN,int(speed * _Limit_B))
+    return _set_duty(int(speed * _Limit_B))
 
 
 def roll():
@@ -183,29 +266,40 @@ def roll():
     if EN_LIGHT:
         light.brake_light(0)
         light.reverse_light(0)
-    return v.set_PWM_dutycycle(EN,0)
+    return _set_duty(0)
 
 def brake():
     """
     Bremst das Fahrzeug aus, indem der Motor kurzgeschlossen wird.
+    Ein noch nicht ausgefuehrter Fahrbefehl im Briefkasten wird verworfen,
+    damit er die Bremsung nicht mit dem naechsten Takt der Regelschleife wieder aufhebt.
     """
-    v.write(IN1, 1)
-    v.write(IN2, 1)
+    global _DriveSource
+    with _SetpointLock:
+        _Setpoints["drive"] = None
+        _DriveSource = None
+    return _brake()
+
+def _brake():
+    _set_direction(1, 1)
     if DEBUG: print("Braking vehicle")
     if EN_LIGHT:
         light.brake_light(1)
         light.reverse_light(0)
-    return v.set_PWM_dutycycle(EN,PWM_RANGE)
+    return _set_duty(PWM_RANGE)
 
 def get_speed():
     """
     Gibt die aktuell gesetzte Geschwindigkeit als Prozentwert zwischen -100 und 100 zurueck.
     Ein negativer Wert bedeutet, dass sich das Fahrzeug rueckwaerts bewegt.
+    Der Wert wird aus dem Schattenzustand gelesen, ohne pigpiod abzufragen.
     """
-    if v.read(IN1)==0 and v.read(IN2)==1:
-        return v.get_PWM_dutycycle(EN)
-    elif v.read(IN1)==1 and v.read(IN2)==0:
-        return 0 - v.get_PWM_dutycycle(EN)
+    with _ShadowLock:
+        in1, in2, duty = _Shadow[IN1], _Shadow[IN2], _Shadow["duty"] or 0
+    if in1 == 0 and in2 == 1:
+        return duty
+    elif in1 == 1 and in2 == 0:
+        return 0 - duty
     else:
         return 0
 
@@ -263,6 +357,137 @@ def disable_ir():
     """
     return light.change_mode(mode = 0)
 
+# ----------------------
+## --- Regelschleife ---
+# ----------------------
+
+# Briefkasten mit je einem Platz fuer den neuesten Fahr- und Lenkbefehl (None = kein neuer Befehl).
+# Neuere Befehle ueberschreiben aeltere, die noch nicht ausgefuehrt wurden.
+_Setpoints = {"drive": None, "steer": None}
+_SetpointLock = threading.Lock()
+
+# Watchdog: Fuer jede Befehlsquelle (z.B. eine Netzwerkverbindung) wird eine Frist gefuehrt, die mit jedem
+# Befehl (oder heartbeat) neu beginnt. Laeuft die Frist der Quelle ab, die den Motor zuletzt in Bewegung
+# gesetzt hat, wird DEADLINE_ACTION ausgefuehrt.
+_Timeouts = {}        # Quelle --> Timeout in Sekunden (None = keine Frist)
+_Deadlines = {}       # Quelle --> Zeitpunkt (time.monotonic()), an dem die Frist ablaeuft
+_DriveSource = None   # Quelle, die den Motor zuletzt in Bewegung gesetzt hat
+
+def register_source(source, timeout = DISABLE_MOTOR_DELAY):
+    """
+    Meldet eine Befehlsquelle beim Watchdog an oder aendert deren Timeout.
+    timeout = None: Fuer diese Quelle wird keine Frist ueberwacht (z.B. XBox-Controller,
+    der nur bei Aenderungen neue Werte liefert und einen Verbindungsabbruch selbst erkennt).
+    """
+    if timeout is not None and not 0 < timeout <= MAX_COMMAND_TIMEOUT:
+        raise ValueError("Timeout must be between 0 and {} sec".format(MAX_COMMAND_TIMEOUT))
+    with _SetpointLock:
+        _Timeouts[source] = timeout
+        _refresh_deadline(source)
+
+def release_source(source):
+    """Meldet eine Befehlsquelle beim Watchdog ab (z.B. beim Verbindungsabbruch)."""
+    global _DriveSource
+    with _SetpointLock:
+        _Timeouts.pop(source, None)
+        _Deadlines.pop(source, None)
+        if _DriveSource == source:
+            _DriveSource = None
+
+def heartbeat(source):
+    """Startet die Frist der Quelle neu, ohne einen neuen Befehl abzulegen."""
+    with _SetpointLock:
+        _refresh_deadline(source)
+    return 0
+
+def _refresh_deadline(source):
+    """Nur mit _SetpointLock aufrufen!"""
+    if source is None:
+        return
+    timeout = _Timeouts.get(source, DISABLE_MOTOR_DELAY)
+    if timeout is None:
+        _Deadlines.pop(source, None)
+    else:
+        _Deadlines[source] = time.monotonic() + timeout
+
+def set_drive(speed, source = None):
+    """
+    Legt eine neue Geschwindigkeit (siehe drive) im Briefkasten ab. Sie wird mit dem naechsten Takt
+    der Regelschleife uebernommen, falls bis dahin kein neuerer Fahrbefehl eintrifft.
+    Ungueltige Werte werden sofort mit einem ValueError abgelehnt.
+    source gibt die Befehlsquelle fuer den Watchdog an (siehe register_source).
+    """
+    global _DriveSource
+    if speed != "stop" and not -PWM_RANGE <= speed <= PWM_RANGE:
+        raise ValueError("Speed out of range")
+    # Bremsen ist auch bei blockiertem Motor immer erlaubt:
+    if _BlockMtr and speed != "stop":
+        print("Motor blocked!")
+        return -1
+    with _SetpointLock:
+        _Setpoints["drive"] = speed
+        _refresh_deadline(source)
+        # Nur Quellen, die den Motor in Bewegung setzen, werden ueberwacht:
+        _DriveSource = source if speed not in ("stop", 0) else None
+    return 0
+
+def set_brake(source = None):
+    """Legt einen Bremsbefehl im Briefkasten ab."""
+    return set_drive("stop", source)
+
+def set_steer(newPos, source = None):
+    """
+    Legt eine neue Lenkposition (siehe steer) im Briefkasten ab. Sie wird mit dem naechsten Takt
+    der Regelschleife uebernommen, falls bis dahin kein neuerer Lenkbefehl eintrifft.
+    """
+    if int(newPos + 0.5) not in range(101):
+        raise ValueError("Position must be between 0 (right limit) and 100 (left limit)!")
+    with _SetpointLock:
+        _Setpoints["steer"] = newPos
+        _refresh_deadline(source)
+    return 0
+
+def _control_loop():
+    """
+    Laeuft in einem eigenen Thread und uebernimmt mit fester Frequenz (CONTROL_RATE)
+    den jeweils neuesten Fahr- und Lenkbefehl aus dem Briefkasten.
+    Ausserdem wird in jedem Takt geprueft, ob die Frist der Quelle abgelaufen ist, die das Fahrzeug bewegt.
+    Das Fahrzeug wird also spaetestens Timeout + CONTROL_PERIOD nach dem letzten Befehl angehalten.
+    """
+    global _DriveSource
+    nextTick = time.monotonic()
+    while _ControlRunning:
+        with _SetpointLock:
+            speed, pos = _Setpoints["drive"], _Setpoints["steer"]
+            _Setpoints["drive"] = _Setpoints["steer"] = None
+            expired = None
+            if _DriveSource is not None and speed is None:
+                deadline = _Deadlines.get(_DriveSource)
+                if deadline is not None and time.monotonic() > deadline:
+                    expired = _DriveSource
+                    _DriveSource = None
+        try:
+            if speed is not None:
+                drive(speed)
+            elif expired is not None:
+                print("WARNING: No commands from '{}' for too long! Stopping vehicle ({})".format(expired, DEADLINE_ACTION))
+                if DEADLINE_ACTION == "brake":
+                    _brake()
+                else:
+                    roll()
+            if pos is not None:
+                steer(pos)
+        except Exception as e:
+            print("ERROR in control loop: ", e)
+        nextTick += CONTROL_PERIOD
+        delay = nextTick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Takt verpasst (z.B. weil pigpiod zu langsam war) --> nicht versuchen aufzuholen
+            nextTick = time.monotonic()
+
+
 # --------------
 ## --- close ---
 # --------------
@@ -271,14 +496,14 @@ def close():
     """
     Gibt verwendete Ressourcen frei. Beim Beenden des Skripts ausfuehren!
     """
-    global EN_XBOX_CONTROLLER
+    global EN_XBOX_CONTROLLER, _ControlRunning
+    _ControlRunning = False
+    control_thread.join()
     roll()
-    v.stop()
     disable_steering()
-    l.stop()
     if EN_LIGHT:
         light.Pixels.clear()
-        light.Pixels.show()
+        light.Pixels.show(wait = True)
     EN_XBOX_CONTROLLER = False
 
 
@@ -336,6 +561,9 @@ def test():
 def control_with_joystick():
     joy = None
     
+    # Der Controller liefert nur bei Aenderungen neue Werte --> kein Watchdog (Verbindungsabbruch wird unten erkannt)
+    register_source("xbox", None)
+
     print("Trying to connect to xbox controller... Press any button!")
     try:
         while not joy and EN_XBOX_CONTROLLER:
@@ -353,12 +581,12 @@ def control_with_joystick():
             if joy.connected():
                 # Motorsteuerung:
                 if joy.B():
-                    brake() # Bremsen mit B
+                    set_brake("xbox") # Bremsen mit B
                 else:
-                    drive((joy.rightTrigger()-joy.leftTrigger())*100)
+                    set_drive((joy.rightTrigger()-joy.leftTrigger())*100, "xbox")
 
                 # Lenkung:
-                steer((-1+joy.leftX())*-50)
+                set_steer((-1+joy.leftX())*-50, "xbox")
                 
                 #Licht an/aus
                 if EN_LIGHT and joy.dpadUp():
@@ -414,24 +642,13 @@ _k = (_MAX_PW - _MIN_PW)/100
 _Pos = 50
 
 
-print("trying to connect to pigpio daemon")
-# mit pigpio-Daemon verbinden und ein Objekt der Klasse pigpio.pi erstellen:
-l = pigpio.pi()
-i=0
-# Versuchen pigpiod zu starten, falls notwendig:
-while not l.connected and i<5:
-    os.system("sudo pigpiod")
-    time.sleep(5)     # pigpiod needs some time to startup...
-    l = pigpio.pi()
-    i+=1
-if l.connected:
-    print("Successfully connected to pigpio daemon")
-else:
-    raise OSError("Could not connect to pigpiod after {} tries\n".format(i+1))
-        
+# Motor und Lenkung teilen sich eine eigene Verbindung zu pigpiod (die Regelschleife soll nicht hinter
+# Befehlen anderer Module warten muessen). pigpio_manager startet pigpiod, falls notwendig:
+v = pigpio_manager.get("motor")
+l = v
+
 # --- Initialisiere Motor ---
 
-v = pigpio.pi()          # pigpiod muss im Hintergrund laufen!
 v.set_mode(EN, pigpio.OUTPUT)
 v.set_mode(IN1, pigpio.OUTPUT)
 v.set_mode(IN2, pigpio.OUTPUT)
@@ -444,6 +661,11 @@ v.set_PWM_range(EN, PWM_RANGE)
 deblock_mtr()
 set_speed_limit(100)
 
+# --- Starte Regelschleife ---
+_ControlRunning = True
+control_thread = threading.Thread(target=_control_loop, daemon=True)
+control_thread.start()
+
 
 # -------------
 ## --- Main ---
@@ -458,6 +680,7 @@ if __name__ == "__main__":
             test()
     finally:
         close()
+        pigpio_manager.stop()
 else:
     # Steuerung mit xbox controller in eigenem Thread:
     if EN_XBOX_CONTROLLER:
@@ -36,6 +36,10 @@ PWM_FREQ = 50               # PWM-Frequenz
 PWM_RANGE = 100             # Dutycycle-Range
 # (siehe http://abyz.me.uk/rpi/pigpio/python.html#set_PWM_range)
 
+# --- Regelschleife ---
+CONTROL_RATE = 50
+CONTROL_PERIOD = 1 / CONTROL_RATE
+
 # ----------------
 ## --- Lenkung ---
 # ----------------
@@ -160,6 +164,31 @@ def deblock_mtr():
     if DEBUG: print("Motor deblocked")
     _BlockMtr = False
 
+
+# ----------------------
+## --- Regelschleife ---
+# ----------------------
+
+# Im Fake-Modul gibt es weder Regelschleife noch Watchdog, die Befehle werden direkt ausgefuehrt:
+
+def register_source(source, timeout = None):
+    pass
+
+def release_source(source):
+    pass
+
+def heartbeat(source):
+    return 0
+
+def set_drive(speed, source = None):
+    return drive(speed) or 0
+
+def set_brake(source = None):
+    return brake() or 0
+
+def set_steer(newPos, source = None):
+    return steer(newPos) or 0
+
     
 # --------------
 ## --- close ---
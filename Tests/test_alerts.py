@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# Tests fuer die Entprellung (hold) und Ratenbegrenzung der Alert-Regeln (alerts.RuleSet).
+# Ausfuehren mit pytest oder direkt: python3 Tests/test_alerts.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import alerts
+
+
+def low_voltage(ratelimit = 0):
+    return alerts.RuleSet([alerts.Rule("Low", below = 9.5, hold = 2)], ratelimit)
+
+def test_raise_after_hold():
+    rules = low_voltage()
+    assert rules.evaluate(9, 0) is None
+    assert rules.evaluate(9, 1) is None
+    assert rules.evaluate(9, 2) == ("Low", 1)
+
+def test_raise_interrupted_before_hold():
+    rules = low_voltage()
+    assert rules.evaluate(9, 0) is None
+    assert rules.evaluate(10, 1) is None
+    assert rules.evaluate(9, 2) is None
+    assert rules.state is None
+
+def test_clear_after_hold():
+    rules = low_voltage()
+    rules.evaluate(9, 0)
+    assert rules.evaluate(9, 2) == ("Low", 1)
+    # Das Aufheben muss ebenfalls die Haltezeit abwarten:
+    assert rules.evaluate(10, 10) is None
+    assert rules.evaluate(10, 11) is None
+    assert rules.evaluate(10, 12) == (False, 0)
+
+def test_clear_interrupted_before_hold():
+    rules = low_voltage()
+    rules.evaluate(9, 0)
+    rules.evaluate(9, 2)
+    assert rules.evaluate(10, 10) is None
+    assert rules.evaluate(9, 11) is None
+    assert rules.evaluate(10, 12) is None
+    assert rules.state is not None
+    assert rules.evaluate(10, 14) == (False, 0)
+
+def test_ratelimit():
+    rules = alerts.RuleSet([alerts.Rule("Low", below = 9.5)], 5)
+    assert rules.evaluate(9, 0) == ("Low", 1)
+    assert rules.evaluate(10, 1) is None
+    assert rules.evaluate(10, 5) == (False, 0)
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print("{}: ok".format(name))
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# Regelbasierte Alerts fuer die Sensoren.
+#
+# Statt fest eingebauter Schwellwerte in den CheckAlerts-Methoden der Sensoren werden die Alerts
+# ueber eine Regeltabelle (DEFAULT_RULES) festgelegt. Jede Regel gibt an:
+#   - message:    Text des Alerts
+#   - below/above: Schwellwert, unter- bzw. oberhalb dessen die Regel aktiv wird
+#   - absolute:   True --> der Betrag des Werts wird verglichen (z.B. fuer Stroeme in beide Richtungen)
+#   - hysteresis: die Regel wird erst wieder inaktiv, wenn der Wert den Schwellwert um mehr als diesen Betrag verlassen hat
+#   - hold:       ein neuer Zustand muss so viele Sekunden ununterbrochen anliegen, bevor er uebernommen wird (Entprellen)
+#   - severity:   1 = Hinweis, 2 = Warnung, 3 = kritisch
+# Pro Sensor kann ausserdem mit "ratelimit" angegeben werden, wie viele Sekunden mindestens zwischen zwei Zustandswechseln liegen.
+#
+# Die Regeln koennen ohne Aendern der Sensor-Klassen in der Datei RULES_FILE (JSON) ueberschrieben werden, z.B.:
+#   {"Distance Front": {"ratelimit": 1, "rules": [{"message": "Crash!", "below": 10, "hysteresis": 3, "severity": 3}]}}
+# Sensoren, die dort (oder in DEFAULT_RULES) nicht vorkommen, verwenden weiterhin ihre CheckAlerts-Methode.
+#
+# Ausgeliefert werden die Alerts ueber den AlertBus: jeder Abnehmer (Log, LCD, LEDs, Netzwerkverbindungen)
+# hat eine eigene Warteschlange, in der Bursts zusammengefasst werden, und eine eigene Ratenbegrenzung.
+
+import os
+import json
+import collections
+import time
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alerts.json")
+
+DEFAULT_RATELIMIT = 1 # Sekunden
+
+NOTHING_PENDING = object() # RuleSet.pending: kein Zustandswechsel vorgemerkt (None bedeutet dort "kein Alert")
+
+DEFAULT_RULES = {
+    "Batt.-Voltage": {"rules": [
+        {"message": "Low Voltage", "below": 9.5, "hysteresis": 0.2, "hold": 2, "severity": 2},
+    ]},
+    "Batt.-Current": {"rules": [
+        {"message": "High Current", "above": 6, "absolute": True, "hysteresis": 0.5, "severity": 2},
+    ]},
+    "Batt.-Charge": {"rules": [
+        {"message": "Low Charge", "below": 500, "hysteresis": 50, "severity": 2},
+    ]},
+    "Distance Front": {"ratelimit": 0.5, "rules": [
+        {"message": "Crash!", "below": 10, "hysteresis": 3, "severity": 3},
+        {"message": "close Obstacle!", "below": 25, "hysteresis": 3, "severity": 2},
+        {"message": "distant Obstacle", "below": 50, "hysteresis": 5, "severity": 1},
+    ]},
+    "Distance Rear": {"ratelimit": 0.5, "rules": [
+        {"message": "Crash!", "below": 10, "hysteresis": 3, "severity": 3},
+        {"message": "close Obstacle!", "below": 25, "hysteresis": 3, "severity": 2},
+        {"message": "distant Obstacle", "below": 50, "hysteresis": 5, "severity": 1},
+    ]},
+    "Motor-Temp.": {"rules": [
+        {"message": "High Motor Temp.", "above": 60, "hysteresis": 5, "severity": 2},
+    ]},
+}
+
+
+class Rule:
+    KEYS = ("message", "below", "above", "absolute", "hysteresis", "hold", "severity")
+
+    def __init__(self, message, below = None, above = None, absolute = False, hysteresis = 0, hold = 0, severity = 1):
+        if below is None and above is None:
+            raise ValueError("rule '{}' needs a threshold (below or above)".format(message))
+        self.message = message
+        self.below = below
+        self.above = above
+        self.absolute = absolute
+        self.hysteresis = hysteresis
+        self.hold = hold
+        self.severity = severity
+
+    def active(self, value, wasActive):
+        """Prueft, ob die Regel fuer den Wert aktiv ist. Eine aktive Regel bleibt bis hinter das Hysterese-Band aktiv."""
+        if self.absolute:
+            value = abs(value)
+        band = self.hysteresis if wasActive else 0
+        if self.below is not None and value < self.below + band:
+            return True
+        if self.above is not None and value > self.above - band:
+            return True
+        return False
+
+
+class RuleSet:
+    """
+    Regeln und Zustand eines Sensors. Die Regeln sind nach Prioritaet sortiert (die erste aktive Regel gilt).
+    evaluate liefert nur bei einem echten Zustandswechsel einen neuen Zustand zurueck.
+    """
+
+    def __init__(self, rules, ratelimit = DEFAULT_RATELIMIT):
+        self.rules = rules
+        self.ratelimit = ratelimit
+        self.activeRules = set() # Regeln, die gerade (inkl. Hysterese) aktiv sind
+        self.state = None        # aktuell gemeldete Regel (None: kein Alert)
+        self.pending = NOTHING_PENDING # Regel (bzw. None: kein Alert), die den Zustand demnaechst abloesen soll
+        self.pendingSince = None
+        self.lastChange = None
+
+    def evaluate(self, value, now = None):
+        """
+        Bewertet einen neuen Wert. Rueckgabe: (Alert-Text, Severity) bzw. (False, 0) bei einem Zustandswechsel,
+        None, wenn sich der gemeldete Zustand nicht aendert.
+        """
+        if now is None:
+            now = time.monotonic()
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        self.activeRules = {rule for rule in self.rules if rule.active(value, rule in self.activeRules)}
+        candidate = next((rule for rule in self.rules if rule in self.activeRules), None)
+
+        if candidate is self.state:
+            self.pending = NOTHING_PENDING
+            return None
+        if candidate is not self.pending:
+            self.pending = candidate
+            self.pendingSince = now
+        # Entprellen: der neue Zustand muss lange genug anliegen (beim Aufheben gilt die Haltezeit der bisherigen Regel):
+        hold = (candidate or self.state).hold
+        if now - self.pendingSince < hold:
+            return None
+        # Ratenbegrenzung: Zustandswechsel hoechstens alle "ratelimit" Sekunden
+        if self.lastChange is not None and now - self.lastChange < self.ratelimit:
+            return None
+
+        self.state = candidate
+        self.pending = NOTHING_PENDING
+        self.lastChange = now
+        if candidate is None:
+            return False, 0
+        return candidate.message, candidate.severity
+
+
+def _parse_rule(sensor, rule):
+    """Erstellt eine Regel aus einem Eintrag der Konfiguration. Fehlerhafte Regeln werden gemeldet und uebersprungen (None)."""
+    try:
+        if not isinstance(rule, dict):
+            raise ValueError("rule must be an object")
+        unknown = set(rule) - set(Rule.KEYS)
+        if unknown:
+            raise ValueError("unknown keys {}".format(", ".join(sorted(unknown))))
+        return Rule(**rule)
+    except (TypeError, ValueError) as e:
+        print("ERROR: skipping invalid alert rule {!r} of sensor '{}': {}".format(rule, sensor, e))
+        return None
+
+
+def load_rules(path = RULES_FILE):
+    """
+    Liefert ein Dictionary Sensorname --> RuleSet aus DEFAULT_RULES und (falls vorhanden) der Datei "path".
+    Eintraege in der Datei ersetzen die Standard-Regeln des jeweiligen Sensors vollstaendig.
+    Fehler in der Datei werden gemeldet, fehlerhafte Regeln uebersprungen (die Sensorik startet trotzdem).
+    """
+    config = dict(DEFAULT_RULES)
+    if path and os.path.exists(path):
+        try:
+            with open(path) as f:
+                config.update(json.load(f))
+            print("Alert rules loaded from {}".format(path))
+        except (OSError, ValueError, TypeError) as e:
+            print("ERROR: could not load alert rules from {}: {} --> using default rules".format(path, e))
+    result = {}
+    for sensor, entry in config.items():
+        if not isinstance(entry, dict):
+            print("ERROR: skipping invalid alert rules of sensor '{}'".format(sensor))
+            continue
+        rules = [_parse_rule(sensor, rule) for rule in entry.get("rules", [])]
+        try:
+            ratelimit = float(entry.get("ratelimit", DEFAULT_RATELIMIT))
+        except (TypeError, ValueError):
+            print("ERROR: invalid ratelimit of sensor '{}' --> using {} s".format(sensor, DEFAULT_RATELIMIT))
+            ratelimit = DEFAULT_RATELIMIT
+        result[sensor] = RuleSet([rule for rule in rules if rule is not None], ratelimit)
+    return result
+
+
+# ------------------
+## --- Alert-Bus ---
+# ------------------
+
+class AlertConsumer:
+    """
+    Warteschlange eines Abnehmers der Alerts (z.B. Log, LCD, LEDs, eine Netzwerkverbindung).
+    Pro Sensor wird nur der neueste Alert aufgehoben (Zusammenfassen von Bursts). Die gesammelten Alerts
+    werden hoechstens alle "ratelimit" Sekunden gemeinsam ausgeliefert.
+    single = True: pro Auslieferung nur den wichtigsten Alert (hoechste Severity, bei Gleichstand den neuesten).
+    """
+
+    def __init__(self, loop, output, ratelimit = 0, single = False):
+        self.loop = loop
+        self.output = output
+        self.ratelimit = ratelimit
+        self.single = single
+        self.pending = collections.OrderedDict() # Sensor --> (Nachricht, Severity)
+        self.scheduled = None
+        self.lastDelivery = None
+
+    def post(self, sensor, message, severity):
+        # aelteren Alert desselben Sensors ersetzen und ans Ende stellen:
+        self.pending.pop(sensor, None)
+        self.pending[sensor] = (message, severity)
+        if self.scheduled is None:
+            delay = 0
+            if self.lastDelivery is not None:
+                delay = max(0, self.lastDelivery + self.ratelimit - self.loop.time())
+            self.scheduled = self.loop.call_later(delay, self.deliver)
+
+    def deliver(self):
+        self.scheduled = None
+        self.lastDelivery = self.loop.time()
+        batch = self.pending
+        self.pending = collections.OrderedDict()
+        items = list(batch.items())
+        if self.single and items:
+            # max liefert bei Gleichstand das erste Element --> rueckwaerts, damit der neueste gewinnt:
+            items = [max(reversed(items), key = lambda item: item[1][1])]
+        for sensor, (message, severity) in items:
+            try:
+                self.output(sensor, message, severity)
+            except Exception as e:
+                print("ERROR while delivering alert to {}: {}".format(self.output, e))
+
+    def cancel(self):
+        if self.scheduled:
+            self.scheduled.cancel()
+            self.scheduled = None
+        self.pending.clear()
+
+
+class AlertBus:
+    """
+    Verteilt die Alerts aller Sensoren an ihre Abnehmer. Jeder Abnehmer (Output-Funktion) hat seine eigene
+    Warteschlange mit eigener Ratenbegrenzung, ein langsamer Abnehmer haelt also weder die anderen
+    noch den Sensor auf, der den Alert ausgeloest hat.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.consumers = {} # Output-Funktion --> AlertConsumer
+
+    def register(self, output, ratelimit = 0, single = False):
+        """Legt die Ratenbegrenzung eines Abnehmers fest. Nicht registrierte Abnehmer bekommen jeden Alert sofort."""
+        consumer = self.consumers.get(output)
+        if consumer is None:
+            consumer = self.consumers[output] = AlertConsumer(self.loop, output, ratelimit, single)
+        else:
+            consumer.ratelimit = ratelimit
+            consumer.single = single
+        return consumer
+
+    def unregister(self, output):
+        """Entfernt einen Abnehmer, noch nicht ausgelieferte Alerts werden verworfen."""
+        consumer = self.consumers.pop(output, None)
+        if consumer:
+            consumer.cancel()
+
+    def post(self, sensor, message, severity, outputs):
+        """Stellt einen Alert in die Warteschlangen der uebergebenen Abnehmer."""
+        for output in outputs:
+            consumer = self.consumers.get(output)
+            if consumer is None:
+                consumer = self.register(output)
+            consumer.post(sensor, message, severity)
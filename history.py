@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Verlauf der Sensordaten: Pro Sensor ein Ringpuffer fester Groesse mit Zeitstempeln und Werten.
+#
+# Die Werte liegen in zwei vorab angelegten array('d') (je 8 Byte pro Eintrag), d.h. beim Anhaengen
+# wird kein Speicher angefordert und nichts verschoben. Abfragen arbeiten mit Slices der Arrays und
+# den eingebauten Funktionen min/max/sum, die Schleifen laufen also in C statt in Python.
+# Die Zeitstempel sind Sekunden von time.monotonic(): Der Pi hat keine Echtzeituhr, time.time() springt also z.B.
+# beim ersten Abgleich mit NTP, und die binaere Suche ueber die Zeitstempel setzt aufsteigende Werte voraus.
+# Erst beim Versenden an Clients werden sie mit to_wallclock in Sekunden seit 1970 umgerechnet.
+
+import array
+import bisect
+import threading
+import time
+
+DEFAULT_SIZE = 600 # Standard-Anzahl der Eintraege pro Sensor
+
+
+def to_wallclock(times):
+    """Rechnet Zeitstempel von time.monotonic() in Sekunden seit 1970 (time.time()) um, Ergebnis als array('d')."""
+    offset = time.time() - time.monotonic()
+    return array.array('d', (t + offset for t in times))
+
+
+class History:
+    """
+    Ringpuffer mit "size" Eintraegen (Zeitstempel, Wert). Ist er voll, wird der aelteste Eintrag ueberschrieben.
+    append ist O(1). Alle Abfragen liefern die Eintraege zeitlich sortiert (aeltester zuerst).
+    """
+
+    def __init__(self, size = DEFAULT_SIZE):
+        self.size = size
+        self._times = array.array('d', bytes(8 * size))
+        self._values = array.array('d', bytes(8 * size))
+        self._next = 0  # Index, an dem der naechste Eintrag gespeichert wird
+        self._count = 0 # Anzahl der gueltigen Eintraege
+        self._lock = threading.Lock() # Sensoren werden teilweise aus den Threads des Executors aktualisiert
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, timestamp = None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            self._times[self._next] = timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.size
+            if self._count < self.size:
+                self._count += 1
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def _ordered(self, arr):
+        """Liefert den gueltigen Teil von arr als neues Array, zeitlich sortiert."""
+        start = self._next - self._count
+        if start >= 0:
+            return arr[start : self._next]
+        return arr[start:] + arr[:self._next]
+
+    def _snapshot(self):
+        with self._lock:
+            return self._ordered(self._times), self._ordered(self._values)
+
+    def last(self, n):
+        """Die letzten n Eintraege als Tupel (Zeitstempel, Werte)."""
+        times, values = self._snapshot()
+        if n <= 0:
+            return times[:0], values[:0]
+        return times[-n:], values[-n:]
+
+    def window(self, span = None, now = None):
+        """
+        Alle Eintraege der letzten "span" Sekunden vor "now" (time.monotonic(), Standard: jetzt) als Tupel (Zeitstempel, Werte).
+        span = None: der gesamte Verlauf.
+        """
+        times, values = self._snapshot()
+        if span is None:
+            return times, values
+        if now is None:
+            now = time.monotonic()
+        # Die Zeitstempel sind aufsteigend sortiert --> Anfang des Fensters mit binaerer Suche finden:
+        start = bisect.bisect_left(times, now - span)
+        return times[start:], values[start:]
+
+    def stats(self, span = None, now = None):
+        """
+        Minimum, Maximum, Mittelwert und Anzahl der Werte der letzten "span" Sekunden
+        als Tupel (min, max, mean, count). Ohne Werte: (None, None, None, 0).
+        """
+        times, values = self.window(span, now)
+        if not values:
+            return None, None, None, 0
+        return min(values), max(values), sum(values) / len(values), len(values)
+
+    def decimated(self, span = None, points = None, now = None):
+        """
+        Wie window, liefert aber hoechstens "points" Eintraege, die gleichmaessig ueber das Fenster verteilt sind.
+        Der neueste Eintrag ist immer enthalten.
+        """
+        times, values = self.window(span, now)
+        if not points or len(values) <= points:
+            return times, values
+        # Schrittweite so waehlen, dass hoechstens "points" Eintraege uebrig bleiben:
+        step = -(-len(values) // points)
+        offset = (len(values) - 1) % step
+        return times[offset::step], values[offset::step]
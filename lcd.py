@@ -3,12 +3,12 @@
 # - von smbus auf pigpio umgestellt
 # - auf asyncio umgestellt
 # - Funktion ergaenzt, die es ermoeglicht scrollenden Text anzuzeigen ("printScrollingString")
+# - gemeinsame Verbindung zu pigpiod ueber pigpio_manager
 
-
-import pigpio
+import pigpio_manager
 import asyncio
 
-pi = pigpio.pi()
+pi = pigpio_manager.get()
 
 # Basic display data (change them for your display)
 deviceAddress  = 0x27   # I2C device address
@@ -123,4 +123,5 @@ if __name__ == "__main__":
         loop.run_forever()
     finally:
         loop.run_until_complete(close())
-        loop.close()
\ No newline at end of file
+        loop.close()
+        pigpio_manager.stop()
\ No newline at end of file
@@ -1,4 +1,17 @@
 # Simple demo of of the WS2801/SPI-like addressable RGB LED lights.
+#
+# Die Beleuchtung besteht aus Ebenen (Layer) mit Prioritaet, die der Compositor "Pixels" zu einem Bild zusammensetzt:
+#
+#   alert (Alarm-Blinken) > brake > reverse > turn (Blinker) > headlights > battery (Akku-Anzeige) > effect > ambient
+#
+# Jede Ebene hat einen eigenen Puffer und eine Maske: nur gesetzte Pixel einer Ebene verdecken die darunterliegenden
+# Ebenen, geloeschte Pixel sind durchsichtig. Ein Licht-Modus schaltet nur Ebenen ein und aus (keine Threads mehr),
+# Brems- und Rueckfahrlicht funktionieren deshalb in jedem Modus.
+# Animationen (Regenbogen, Alarm-Blinken) werden vom einzigen Render-Thread des Compositors berechnet,
+# nur dieser Thread greift auf SPI zu.
+# Die Farben des Farbrads (WHEEL_TABLE) und die Bilder des Regenbogens (RAINBOW_FRAMES) werden beim Import einmal
+# berechnet, Effekte setzen dann pro Bild nur noch den ganzen Puffer einer Ebene (Layer.set_frame).
+# Helligkeit und Gamma-Korrektur werden beim Senden ueber eine Tabelle (bytes.translate) auf das ganze Bild angewendet.
 import time
 import RPi.GPIO as GPIO
 
@@ -7,7 +20,9 @@ import Adafruit_WS2801
 import Adafruit_GPIO.SPI as SPI
 
 import threading
+import atexit
 import pigpio
+import pigpio_manager
 
 import Sensorik #_fake as Sensorik
 
@@ -15,10 +30,215 @@ import Sensorik #_fake as Sensorik
 # Configure the count of pixels:
 PIXEL_COUNT = 40
 
+# Maximale Bildrate, mit der der Framebuffer an die LEDs geschickt wird:
+MAX_FPS = 50
+
+# Helligkeit (0..1) und Gamma-Korrektur beim Senden (1.0 / 1.0: Farben unveraendert):
+BRIGHTNESS = 1.0
+GAMMA = 1.0
+
 # Alternatively specify a hardware SPI connection on /dev/spidev0.0:
 SPI_PORT   = 0
 SPI_DEVICE = 0
-Pixels = Adafruit_WS2801.WS2801Pixels(PIXEL_COUNT, spi=SPI.SpiDev(SPI_PORT, SPI_DEVICE), gpio=GPIO)
+Spi = SPI.SpiDev(SPI_PORT, SPI_DEVICE)
+# WS2801Pixels konfiguriert die SPI-Schnittstelle (Takt, Modus), geschrieben wird aber nur noch vom Compositor:
+Strip = Adafruit_WS2801.WS2801Pixels(PIXEL_COUNT, spi=Spi, gpio=GPIO)
+
+
+def gamma_table(brightness = BRIGHTNESS, gamma = GAMMA):
+    """Tabelle (256 Bytes fuer bytes.translate), die jeden Farbwert auf Helligkeit und Gamma-Kurve abbildet."""
+    return bytes(min(255, int(round(255 * brightness * (v / 255) ** gamma))) for v in range(256))
+
+IDENTITY_TABLE = bytes(range(256))
+
+
+class Layer:
+    """
+    Eine Ebene des Compositors mit denselben Methoden wie WS2801Pixels (count, clear, set_pixel, set_pixel_rgb, show).
+    Neben dem Puffer (3 Byte RGB pro Pixel) gibt es eine Maske (0xFF pro gesetztem Byte), clear macht die Ebene durchsichtig.
+    animation: Funktion(layer, t), die bei eingeschalteter Ebene fuer jedes Bild aufgerufen wird
+               (t: Sekunden seit dem Einschalten). Liefert sie False, wird die Ebene ausgeschaltet.
+    on_finish: Funktion(layer), die (im Render-Thread) aufgerufen wird, nachdem sich die Ebene so ausgeschaltet hat.
+    """
+
+    def __init__(self, compositor, name, priority, animation = None, on_finish = None):
+        self.compositor = compositor
+        self.name = name
+        self.priority = priority
+        self.animation = animation
+        self.on_finish = on_finish
+        self.enabled = False
+        self.since = 0 # Zeitpunkt des Einschaltens (time.monotonic())
+        self._count = compositor.count()
+        self._buffer = bytearray(3 * self._count)
+        self._mask = bytearray(3 * self._count)
+        self._lock = threading.Lock()
+
+    def count(self):
+        return self._count
+
+    def set_pixel_rgb(self, n, r, g, b):
+        with self._lock:
+            self._buffer[n*3 : n*3 + 3] = bytes((r & 0xFF, g & 0xFF, b & 0xFF))
+            self._mask[n*3 : n*3 + 3] = b'\xff\xff\xff'
+
+    def set_pixel(self, n, color):
+        self.set_pixel_rgb(n, color >> 16, color >> 8, color)
+
+    def get_pixel_rgb(self, n):
+        with self._lock:
+            return tuple(self._buffer[n*3 : n*3 + 3])
+
+    def set_frame(self, frame, mask = None):
+        """
+        Setzt den ganzen Puffer auf einmal (frame: 3 Byte RGB pro Pixel).
+        mask: gleich lang wie frame, 0xFF fuer gesetzte und 0 fuer durchsichtige Bytes (Standard: alle Pixel gesetzt).
+        """
+        if len(frame) != len(self._buffer) or (mask is not None and len(mask) != len(self._mask)):
+            raise ValueError("frame needs {} bytes".format(len(self._buffer)))
+        with self._lock:
+            self._buffer[:] = frame
+            self._mask[:] = b'\xff' * len(self._mask) if mask is None else mask
+
+    def fill(self, area, color):
+        for n in area:
+            self.set_pixel_rgb(n, color[0], color[1], color[2])
+
+    def clear(self, area = None):
+        """Macht die Pixel in "area" (Standard: alle) durchsichtig."""
+        with self._lock:
+            if area is None:
+                self._mask[:] = bytes(len(self._mask))
+            else:
+                for n in area:
+                    self._mask[n*3 : n*3 + 3] = bytes(3)
+
+    def show(self):
+        """Neues Bild anfordern (nur noetig, wenn die Ebene ausserhalb ihrer Animation geaendert wurde)."""
+        self.compositor.show()
+
+    def _blend(self, frame):
+        """Legt die gesetzten Pixel dieser Ebene ueber "frame" (alle Pixel als eine grosse Ganzzahl)."""
+        with self._lock:
+            buffer = int.from_bytes(self._buffer, "big")
+            mask = int.from_bytes(self._mask, "big")
+        return (frame & ~mask) | (buffer & mask)
+
+
+class Compositor:
+    """
+    Setzt die eingeschalteten Ebenen nach Prioritaet zu einem Bild zusammen und schickt es mit einem einzigen
+    SPI-Aufruf an die LEDs. Ein einziger Render-Thread erledigt das mit hoechstens MAX_FPS Bildern pro Sekunde:
+    solange eine Animation laeuft in jedem Takt, sonst nur nach einer Aenderung (show, enable).
+    Unveraenderte Bilder werden nicht erneut gesendet.
+    """
+
+    def __init__(self, count, spi, fps = MAX_FPS):
+        self._count = count
+        self._spi = spi
+        self._period = 1 / fps
+        self.layers = {} # Name --> Layer
+        self._order = [] # Ebenen nach aufsteigender Prioritaet
+        self._dirty = threading.Event()
+        self._rendered = threading.Condition()
+        self._requested = 0 # Nummer der zuletzt angeforderten Aenderung
+        self._done = 0      # Nummer der Aenderung, die mit dem letzten Bild gesendet wurde
+        self.frames = 0     # Anzahl der gesendeten Bilder
+        self._table = None  # Tabelle fuer Helligkeit/Gamma (None: Farben unveraendert)
+        self.set_brightness(BRIGHTNESS, GAMMA)
+        self._thread = threading.Thread(target = self._render, name = "LED-Renderer", daemon = True)
+        self._thread.start()
+
+    def count(self):
+        return self._count
+
+    def add_layer(self, name, priority, animation = None, on_finish = None):
+        layer = Layer(self, name, priority, animation, on_finish)
+        self.layers[name] = layer
+        self._order = sorted(self.layers.values(), key = lambda layer: layer.priority)
+        return layer
+
+    def enable(self, name, on = True):
+        layer = self.layers[name]
+        if on and not layer.enabled:
+            layer.since = time.monotonic()
+        layer.enabled = on
+        self.show()
+
+    def disable(self, name):
+        self.enable(name, False)
+
+    def set_brightness(self, brightness = BRIGHTNESS, gamma = GAMMA):
+        """Legt Helligkeit (0..1) und Gamma-Korrektur fest, die beim Senden auf jedes Bild angewendet werden."""
+        table = gamma_table(brightness, gamma)
+        self._table = None if table == IDENTITY_TABLE else table
+        self.show()
+
+    def clear(self):
+        """Schaltet alle Ebenen aus und loescht sie (alle LEDs aus)."""
+        for layer in self._order:
+            layer.enabled = False
+            layer.clear()
+        self.show()
+
+    def show(self, wait = False):
+        """
+        Fordert ein neues Bild an. wait = True: wartet (max. 1 s), bis es gesendet wurde (z.B. vor dem Beenden).
+        """
+        with self._rendered:
+            self._requested += 1
+            request = self._requested
+        self._dirty.set()
+        if wait:
+            with self._rendered:
+                self._rendered.wait_for(lambda: self._done >= request, timeout = 1)
+
+    def _compose(self, now):
+        frame = 0
+        for layer in self._order:
+            if not layer.enabled:
+                continue
+            if layer.animation and layer.animation(layer, now - layer.since) is False:
+                layer.enabled = False
+                if layer.on_finish:
+                    layer.on_finish(layer)
+                continue
+            frame = layer._blend(frame)
+        return frame.to_bytes(3 * self._count, "big")
+
+    def _render(self):
+        last = None
+        while True:
+            # Ohne laufende Animation nur auf Aenderungen warten:
+            if not any(layer.enabled and layer.animation for layer in self._order):
+                self._dirty.wait()
+            start = time.monotonic()
+            self._dirty.clear()
+            with self._rendered:
+                request = self._requested
+            frame = self._compose(start)
+            table = self._table
+            if table is not None:
+                frame = frame.translate(table)
+            if frame != last:
+                self._spi.write(frame)
+                self.frames += 1
+                last = frame
+            with self._rendered:
+                self._done = request
+                self._rendered.notify_all()
+            # Bildrate begrenzen (WS2801 braucht ausserdem min. 500 us Pause zum Uebernehmen der Daten):
+            time.sleep(max(0, self._period - (time.monotonic() - start)))
+
+
+Pixels = Compositor(PIXEL_COUNT, Spi)
+
+def _switch_off():
+    # show() sendet nur ueber den (Daemon-)Render-Thread --> beim Beenden warten, bis die LEDs wirklich aus sind
+    Pixels.clear()
+    Pixels.show(wait = True)
+
+atexit.register(_switch_off)
 
 BLINK_RIGHT = (3, 4, 5, 15)
 BLINK_LEFT = (34, 35, 36, 24)
@@ -28,231 +248,270 @@ FRONT_LIGHT = (0, 1, 2, 37, 38, 39)
 BACK_LIGHT = (16, 23)
 REVERSE_LIGHT = (19, 20)
 
+ALERT_COLOR = (100, 0, 0)
+ALERT_BLINK_DELAY = 0.5 # Sekunden an bzw. aus
+ALERT_BLINK_TIMES = 10
+
+RAINBOW_APPEAR_DELAY = 0.1 # Sekunden, bis beim Start des Regenbogens das naechste Pixel erscheint
+RAINBOW_STEP_TIME = 0.02   # Sekunden pro Schritt des Farbrads (256 Schritte pro Umlauf)
+
 light_modes = (-1,0,1,2,10)
 light_mode = 0
-light_events = {}
-for mode in light_modes:
-    light_events[mode] = None
+base_mode = 0 # Modus unter dem Alert-Blinken (Mode -1 wird nur darueber gelegt)
+_ModeLock = threading.RLock() # change_mode wird aus mehreren Threads aufgerufen (Loop, Regelschleife, Render-Thread)
+front_light_on = False
 
 # --- Initialisiere IR-LED ---
 IR = 21
-l = pigpio.pi()
+l = pigpio_manager.get()
 l.set_mode(IR, pigpio.OUTPUT)
 l.write(IR, 0) # IR-LED standardmaessig aus
 
 
-# --- Effects ---- 
+# --- Effects ----
 # Define the wheel function to interpolate between different hues.
-def wheel(pos):
+def _wheel_rgb(pos):
     if pos < 85:
-        return Adafruit_WS2801.RGB_to_color(pos * 3, 255 - pos * 3, 0)
+        return (pos * 3, 255 - pos * 3, 0)
     elif pos < 170:
         pos -= 85
-        return Adafruit_WS2801.RGB_to_color(255 - pos * 3, 0, pos * 3)
+        return (255 - pos * 3, 0, pos * 3)
     else:
         pos -= 170
-        return Adafruit_WS2801.RGB_to_color(0, pos * 3, 255 - pos * 3)
+        return (0, pos * 3, 255 - pos * 3)
 
+# Farbrad als Tabelle: 3 Byte RGB fuer jede der 256 Positionen
+WHEEL_TABLE = bytes(c for pos in range(256) for c in _wheel_rgb(pos))
 
-def appear_from_back_blocking(pixels = Pixels, color="changing", step = 1, wait = 0.02):
-    pos = 0
+def wheel(pos):
+    r, g, b = WHEEL_TABLE[3 * (pos % 256) : 3 * (pos % 256) + 3]
+    return (r << 16) | (g << 8) | b
+
+
+def rainbow_frame(count, j = 0):
+    """
+    Ein Bild des Regenbogens (3 Byte RGB pro Pixel): jedes Pixel bekommt seinen Anteil am Farbrad,
+    j verschiebt das Farbrad ueber die Pixel.
+    """
+    positions = (3 * ((i * 256 // count + j) % 256) for i in range(count))
+    return b''.join(WHEEL_TABLE[pos : pos + 3] for pos in positions)
+
+# Alle 256 Bilder eines Umlaufs des Regenbogens (ca. 30 kB), werden beim Import einmal berechnet:
+RAINBOW_FRAMES = tuple(rainbow_frame(PIXEL_COUNT, j) for j in range(256))
+
+
+def appear_from_back_frames(count, color = "changing", step = 1):
+    """
+    Erzeugt die Bilder der Warte-Animation als Tupel (Bild, Maske) fuer Layer.set_frame: die Pixel laufen
+    in Gruppen von "step" Pixeln von hinten nach vorne und bleiben am Anfang des Streifens liegen.
+    """
     if color == "changing":
-        change = True
+        strip = RAINBOW_FRAMES[0] if count == PIXEL_COUNT else rainbow_frame(count)
+        block = lambda j: WHEEL_TABLE[3 * (j * 256 // count) : 3 * (j * 256 // count) + 3] * step
     else:
-        change = False
-    for i in range(0, pixels.count(), step):
-        for j in reversed(range(i, pixels.count()- step + 1, step)):
-            pixels.clear()
+        rgb = bytes(c & 0xFF for c in color)
+        strip = rgb * count
+        block = lambda j: rgb * step
+    for i in range(0, count, step):
+        for j in reversed(range(i, count - step + 1, step)):
+            frame = bytearray(3 * count)
+            mask = bytearray(3 * count)
             # first set all pixels at the begin
-            for k in range(i):
-                if change:
-                    pixels.set_pixel(k, wheel(((k * 256 // pixels.count())) % 256))
-                else:
-                    pixels.set_pixel(k, Adafruit_WS2801.RGB_to_color( color[0], color[1], color[2] ))
-            # set then the pixel at position j
-            if change:
-                for l in range(j, j+step):
-                    pixels.set_pixel(l, wheel(((j * 256 // pixels.count())) % 256))
-            else:
-                for l in range(j, j+step):
-                    pixels.set_pixel(l, Adafruit_WS2801.RGB_to_color( color[0], color[1], color[2] ))
-            pixels.show()
-            time.sleep(wait)
-
-
-# Define rainbow cycle function to do a cycle of all hues.
-def rainbow_cycle_successive(pixels = Pixels, wait=0.1):
-    current_light_mode = light_mode
-    for i in range(pixels.count()):
-        # tricky math! we use each pixel as a fraction of the full 96-color wheel
-        # (thats the i / strip.numPixels() part)
-        # Then add in j which makes the colors go around per pixel
-        # the % 96 is to make the wheel cycle around
-        pixels.set_pixel(i, wheel(((i * 256 // pixels.count())) % 256) )
+            frame[:3*i] = strip[:3*i]
+            mask[:3*i] = b'\xff' * (3*i)
+            # set then the pixels at position j
+            frame[3*j : 3*(j+step)] = block(j)
+            mask[3*j : 3*(j+step)] = b'\xff' * (3*step)
+            yield frame, mask
+
+
+def appear_from_back_blocking(pixels = None, color="changing", step = 1, wait = 0.02):
+    # Standard: auf der Ebene "effect", die danach wieder geloescht und ausgeschaltet wird
+    if pixels is None:
+        Pixels.enable("effect")
+        try:
+            return appear_from_back_blocking(Effect, color, step, wait)
+        finally:
+            Effect.clear()
+            Pixels.disable("effect")
+    for frame, mask in appear_from_back_frames(pixels.count(), color, step):
+        pixels.set_frame(frame, mask)
         pixels.show()
-        if light_events[current_light_mode].wait(timeout = wait):
-            return
+        time.sleep(wait)
 
 
-def rainbow_cycle(pixels = Pixels, wait=0.005):
-    current_light_mode = light_mode
-    rainbow_cycle_successive()
-    while not light_events[current_light_mode].wait(timeout = wait):
-        for j in range(256): # one cycle of all 256 colors in the wheel
-            for i in range(pixels.count()):
-                pixels.set_pixel(i, wheel(((i * 256 // pixels.count()) + j) % 256) )
-            pixels.show()
-            if light_events[current_light_mode].wait(timeout = wait):
-                return
+# Define rainbow cycle function to do a cycle of all hues.
+def rainbow_cycle(pixels, t):
+    """
+    Animation der Ebene "ambient" (Mode 2): zuerst erscheinen die Pixel nacheinander,
+    danach laeuft das Farbrad ueber alle Pixel (vorberechnete Bilder aus RAINBOW_FRAMES).
+    """
+    count = pixels.count()
+    frames = RAINBOW_FRAMES if count == PIXEL_COUNT else tuple(rainbow_frame(count, j) for j in range(256))
+    appeared = int(t / RAINBOW_APPEAR_DELAY) + 1
+    if appeared <= count:
+        pixels.set_frame(frames[0], b'\xff' * (3 * appeared) + bytes(3 * (count - appeared)))
+        return
+    j = int((t - count * RAINBOW_APPEAR_DELAY) / RAINBOW_STEP_TIME) % 256
+    pixels.set_frame(frames[j])
+
+
+def alert_blink(pixels, t):
+    """Animation der Ebene "alert" (Mode -1): alle Pixel blinken ALERT_BLINK_TIMES mal, danach schaltet sich die Ebene aus."""
+    phase = int(t / ALERT_BLINK_DELAY)
+    if phase >= 2 * ALERT_BLINK_TIMES:
+        return False
+    # Die Ebene deckt waehrend des Blinkens alle Pixel ab (auch in der Aus-Phase):
+    pixels.fill(range(pixels.count()), ALERT_COLOR if phase % 2 == 0 else (0, 0, 0))
+
+
+def alert_finished(pixels):
+    """Nach dem Alarm-Blinken wieder den Modus darunter einstellen, damit neue Alerts wieder blinken koennen."""
+    global light_mode
+    with _ModeLock:
+        if light_mode == -1 and not pixels.enabled:
+            light_mode = base_mode
+            print("Light Mode set to", light_mode)
+
+
+# Ebenen nach Prioritaet (hoehere Prioritaet verdeckt niedrigere):
+Alert = Pixels.add_layer("alert", 70, animation = alert_blink, on_finish = alert_finished)
+Brake = Pixels.add_layer("brake", 60)
+Reverse = Pixels.add_layer("reverse", 50)
+Turn = Pixels.add_layer("turn", 40)
+Headlights = Pixels.add_layer("headlights", 30)
+Gauge = Pixels.add_layer("battery", 20)
+Effect = Pixels.add_layer("effect", 10)
+Ambient = Pixels.add_layer("ambient", 0, animation = rainbow_cycle)
+
+# Brems- und Rueckfahrlicht sind in jedem Modus eingeschaltet (die Ebenen sind durchsichtig, solange das Licht aus ist):
+Pixels.enable("brake")
+Pixels.enable("reverse")
+
+# Ebenen der einzelnen Modi:
+MODE_LAYERS = {
+    -1: ("alert",),
+    0: ("headlights", "turn"),
+    1: ("battery",),
+    2: ("ambient",),
+    10: (),
+}
 
 
-def blink(pixels = Pixels, blink_range = range(Pixels.count()), blink_delay = 0.5, color = (255, 50, 0), blink_times = 1):
-    blink_counter = 0
-    current_light_mode = light_mode
-    while blink_counter < blink_times:
-        try:
-            for i in blink_range:
-                pixels.set_pixel_rgb(i, color[0], color[1], color[2])
-            pixels.show()
-            if light_events[current_light_mode].wait(timeout = blink_delay):
-                return
-            for i in blink_range:
-                pixels.set_pixel_rgb(i, 0, 0, 0)
-            pixels.show()
-            if light_events[current_light_mode].wait(timeout = blink_delay):
-                return
-            blink_counter += 1
-        finally:
-            for i in blink_range:
-                pixels.set_pixel_rgb(i, 0, 0, 0)
-            pixels.show()
- 
-# -------------- 
+# --------------
 # --- MODE 0 ---
 # --------------
-def front_light(on = "toggle", area = FRONT_LIGHT, area_back = BACK_LIGHT, pixels = Pixels, color = (255, 120, 100), color_back = (90, 0, 0)):
-    if light_mode == 0:
-        global front_light_on
-        if on == "toggle":
-            front_light_on = not front_light_on
-        else:
-            front_light_on = on
+def front_light(on = "toggle", area = FRONT_LIGHT, area_back = BACK_LIGHT, pixels = Headlights, color = (255, 120, 100), color_back = (90, 0, 0)):
+    global front_light_on
+    if on == "toggle":
+        front_light_on = not front_light_on
+    else:
+        front_light_on = on
 
-        if front_light_on:
-            for pixel in area:
-                pixels.set_pixel_rgb(pixel, color[0], color[1], color[2])
-            for pixel in area_back:
-                pixels.set_pixel_rgb(pixel, color_back[0], color_back[1], color_back[2])
-        else:
-            for pixel in area + area_back:
-                pixels.set_pixel_rgb(pixel, 0, 0, 0)
-        pixels.show()
+    if front_light_on:
+        pixels.fill(area, color)
+        pixels.fill(area_back, color_back)
+    else:
+        pixels.clear(area + area_back)
+    pixels.show()
 
-def brake_light(on = True, area = BRAKE_LIGHT, pixels = Pixels, color = (255, 0, 0)):
-    if light_mode == 0:
-        if on:
-            for pixel in area:
-                pixels.set_pixel_rgb(pixel, color[0], color[1], color[2])
-        else:
-            for pixel in area:
-                pixels.set_pixel_rgb(pixel, 0, 0, 0)
-        #pixels.show()
+def brake_light(on = True, area = BRAKE_LIGHT, pixels = Brake, color = (255, 0, 0)):
+    if on:
+        pixels.fill(area, color)
+    else:
+        pixels.clear(area)
+    pixels.show()
 
-def reverse_light(on = True, area = REVERSE_LIGHT, pixels = Pixels, color = (255, 120, 100)):
-    if light_mode == 0:
-        if on:
-            for pixel in area:
-                pixels.set_pixel_rgb(pixel, color[0], color[1], color[2])
-        else:
-            for pixel in area:
-                pixels.set_pixel_rgb(pixel, 0, 0, 0)
+def reverse_light(on = True, area = REVERSE_LIGHT, pixels = Reverse, color = (255, 120, 100)):
+    if on:
+        pixels.fill(area, color)
+    else:
+        pixels.clear(area)
+    pixels.show()
 
 # ---------------
 
 
 class battery():
-    
-    def __init__(self, pixels = Pixels):
-        self.pixels = Pixels
+
+    def __init__(self, pixels = Gauge):
+        self.pixels = pixels
         self.BattSenCurrent = None
         self.BattSenCharge = None
         self.Blink = False
         self.toggle_off = False
-        
+
     def start(self):
-        self.light_mode = light_mode
-        
         if not self.BattSenCharge:
             self.BattSenCharge = Sensorik.Batt_Mon_Charge()
             self.BattSenCharge.subscribe(self.receive_charge, OnlyNew = False, time = 1)
-            
+
         if not self.BattSenCurrent:
             self.BattSenCurrent = Sensorik.Batt_Mon_Current()
             self.BattSenCurrent.subscribe(self.receive_current, OnlyNew = False, time = 1)
-            
+
     def stop(self):
         if self.BattSenCurrent:
             self.BattSenCurrent.desubscribe()
             self.BattSenCurrent = None
-            
+
         if self.BattSenCharge:
             self.BattSenCharge.desubscribe()
             self.BattSenCharge = None
-        
+
     def receive_charge(self, Sensor, Data, Unit):
-        if self.light_mode == light_mode:
-            self.pixels.clear()
-            if not self.toggle_off:
-                percent = int(float(Data) / type(self.BattSenCharge).MAX_CHARGE * 100)
-                activatedPixels =  int(percent * self.pixels.count() / 100) + 1
-                if activatedPixels in range(0, self.pixels.count() + 1):
-                    for pixel in range(activatedPixels):
-                        self.pixels.set_pixel_rgb(pixel, 256 - 2 * percent, percent, 0)
-                if self.Blink:
-                    self.toggle_off = True
-            else:
-                self.toggle_off = False
-            self.pixels.show()
-            
+        if not self.BattSenCharge:
+            return
+        self.pixels.clear()
+        if not self.toggle_off:
+            percent = int(float(Data) / type(self.BattSenCharge).MAX_CHARGE * 100)
+            activatedPixels =  int(percent * self.pixels.count() / 100) + 1
+            if activatedPixels in range(0, self.pixels.count() + 1):
+                for pixel in range(activatedPixels):
+                    self.pixels.set_pixel_rgb(pixel, 256 - 2 * percent, percent, 0)
+            if self.Blink:
+                self.toggle_off = True
+        else:
+            self.toggle_off = False
+        self.pixels.show()
+
     def receive_current(self, Sensor, Data, Unit):
         if float(Data) > 0:
             #Beim Laden Blinken aktivieren:
             self.Blink = True
         else:
             self.Blink = False
-        
+
 
 class blinker():
-    
-    def __init__(self, pixels = Pixels, color = (255, 50, 0)):
+
+    def __init__(self, pixels = Turn, color = (255, 50, 0)):
         self.LED_ON = False
         self.color = color
-        self.pixels = Pixels
+        self.pixels = pixels
         self.LenkSen = None
-        
+
     def start(self):
-        self.light_mode = light_mode
-        
         if not self.LenkSen:
             self.LenkSen = Sensorik.Lnk_Pos()
             self.LenkSen.subscribe(self.receive_steer_position, OnlyNew = False, time = 0.5)
-            
+
     def stop(self):
         if self.LenkSen:
             self.LenkSen.desubscribe()
             self.LenkSen = None
-        
+        self.off()
+
     def receive_steer_position(self, Sensor, Data, Unit):
-        if self.light_mode == light_mode:
-            if self.LED_ON:
-                self.off()
-            elif int(Data) > 75:
-                self.on("left")
-            elif int(Data) < 25:
-                self.on("right")
-            else:
-                self.off()
-        
+        if self.LED_ON:
+            self.off()
+        elif int(Data) > 75:
+            self.on("left")
+        elif int(Data) < 25:
+            self.on("right")
+        else:
+            self.off()
+
     def on(self, side = "both"):
         if side == "left":
             blinker = BLINK_LEFT
@@ -260,71 +519,64 @@ class blinker():
             blinker = BLINK_RIGHT
         else:
             blinker = BLINK_LEFT + BLINK_RIGHT
-            
-        for pixel in blinker:
-            self.pixels.set_pixel_rgb(pixel, self.color[0], self.color[1], self.color[2])
+
+        self.pixels.fill(blinker, self.color)
         self.pixels.show()
         self.LED_ON = True
-        
+
     def off(self):
-        blinker = BLINK_LEFT + BLINK_RIGHT    
-        for pixel in blinker:
-            self.pixels.set_pixel_rgb(pixel, 0, 0, 0)
+        self.pixels.clear(BLINK_LEFT + BLINK_RIGHT)
         self.pixels.show()
         self.LED_ON = False
- 
+
 Battery = battery()
 Blinker = blinker()
 
 def change_mode(mode = "toggle"):
-    global light_mode, light_thread, light_events, Blinker
-
-    # Stop light_threads:
-    if light_events[light_mode]:
-        light_events[light_mode].set()
+    """
+    Schaltet den Licht-Modus um: nur die Ebenen des alten Modus werden aus- und die des neuen eingeschaltet.
+    Mode -1 (Alert) legt das Blinken ueber den aktuellen Modus, dessen Ebenen bleiben dabei unveraendert.
+    Danach (oder beim Umschalten mit "toggle") geht es mit dem Modus darunter (base_mode) weiter.
+    """
+    with _ModeLock:
+        _change_mode(mode)
 
-    Pixels.clear()
-    Pixels.show()  # Make sure to call show() after changing any pixels!
+def _change_mode(mode):
+    global light_mode, base_mode
 
     if mode == "toggle":
-        light_mode = light_modes[(light_modes.index(light_mode) + 1) % len(light_modes)]
-        while light_mode < 0:
-            light_mode = light_modes[(light_modes.index(light_mode) + 1) % len(light_modes)]
-    elif mode in light_modes:
-        light_mode = mode
-    else:
+        mode = light_modes[(light_modes.index(base_mode) + 1) % len(light_modes)]
+        while mode < 0:
+            mode = light_modes[(light_modes.index(mode) + 1) % len(light_modes)]
+    elif mode not in light_modes:
         raise ValueError("invalid light_mode")
 
+    print("Light Mode set to", mode)
 
-    print("Light Mode set to", light_mode)
+    if mode == -1:
+        light_mode = mode
+        Pixels.enable("alert")
+        return
 
-    if light_mode == -1:
-        light_events[light_mode] = threading.Event()
-        thread = threading.Thread(target=blink, kwargs={'blink_times':10, 'color':(100, 0, 0)})
-        thread.start()
+    Pixels.disable("alert")
+    for name in MODE_LAYERS[base_mode]:
+        Pixels.disable(name)
+    light_mode = base_mode = mode
+    for name in MODE_LAYERS[light_mode]:
+        Pixels.enable(name)
 
     if light_mode == 0:
         Blinker.start()
         front_light(on = True)
-        light_thread = None
-        light_events[light_mode] = None
     else:
         Blinker.stop()
 
     if light_mode == 1:
         Battery.start()
-        light_thread = None
-        light_events[light_mode] = None
     else:
         Battery.stop()
 
-    if light_mode == 2:
-        light_events[light_mode] = threading.Event()
-        thread = threading.Thread(target=rainbow_cycle)
-        thread.start()
-
     if light_mode == 10:
         l.write(IR, 1)
     else:
         l.write(IR, 0)
-
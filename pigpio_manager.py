@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Zentrale Verwaltung der Verbindungen zum pigpio-Daemon.
+#
+# Jedes pigpio.pi()-Objekt oeffnet zwei Sockets zu pigpiod und startet einen eigenen Callback-Thread.
+# Deshalb teilen sich alle Module (Steuerung, Sensorik, light, lcd, ...) standardmaessig eine Verbindung.
+# Nur wo Befehle nicht hinter anderen warten duerfen (z.B. die Motorsteuerung), wird mit get(name)
+# eine eigene Verbindung verwendet. Ausserdem wird hier die Dauer jedes pigpio-Aufrufs gemessen.
+
+import os
+import sys
+import time
+import threading
+import pigpio
+
+DEBUG = True if "-d" in sys.argv else False
+
+RETRIES = 5          # Anzahl der Versuche, pigpiod zu starten
+STARTUP_DELAY = 5    # pigpiod needs some time to startup...
+
+_connections = {}
+_lock = threading.Lock()
+
+
+class Connection:
+    """
+    Huelle um ein pigpio.pi-Objekt, die alle Methoden von pigpio.pi weiterreicht
+    und dabei Anzahl, Gesamtdauer und maximale Dauer der Aufrufe pro Methode mitschreibt.
+    """
+
+    def __init__(self, name, pi):
+        self.name = name
+        self.pi = pi
+        self._stats = {}   # Methode --> [Anzahl, Gesamtdauer, maximale Dauer]
+        self._statsLock = threading.Lock()
+
+    def __getattr__(self, attr):
+        # Wird nur beim ersten Zugriff auf eine Methode aufgerufen, danach findet Python die gespeicherte Huelle direkt.
+        func = getattr(self.pi, attr)
+        if not callable(func):
+            return func
+        with self._statsLock:
+            stat = self._stats.setdefault(attr, [0, 0.0, 0.0])
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                with self._statsLock:
+                    stat[0] += 1
+                    stat[1] += duration
+                    if duration > stat[2]:
+                        stat[2] = duration
+        setattr(self, attr, timed)
+        return timed
+
+    def write_bank(self, bits):
+        """Setzt alle GPIOs (0-31), deren Bit in "bits" gesetzt ist, mit einem einzigen Aufruf auf 1."""
+        return self.set_bank_1(bits)
+
+    def clear_bank(self, bits):
+        """Setzt alle GPIOs (0-31), deren Bit in "bits" gesetzt ist, mit einem einzigen Aufruf auf 0."""
+        return self.clear_bank_1(bits)
+
+    def stats(self):
+        """Liefert ein Dictionary Methode --> (Anzahl, mittlere Dauer, maximale Dauer) in Sekunden."""
+        with self._statsLock:
+            return {attr: (n, total / n, maximum) for attr, (n, total, maximum) in self._stats.items() if n}
+
+
+def _connect():
+    """Verbindet sich mit pigpiod und versucht pigpiod zu starten, falls notwendig."""
+    print("trying to connect to pigpio daemon")
+    pi = pigpio.pi()
+    i = 0
+    while not pi.connected and i < RETRIES:
+        os.system("sudo pigpiod")
+        time.sleep(STARTUP_DELAY)
+        pi = pigpio.pi()
+        i += 1
+    if pi.connected:
+        print("Successfully connected to pigpio daemon")
+    else:
+        raise OSError("Could not connect to pigpiod after {} tries\n".format(i+1))
+    return pi
+
+
+def get(name = "shared"):
+    """
+    Liefert die Verbindung mit dem uebergebenen Namen und baut sie beim ersten Aufruf auf.
+    Alle Aufrufer mit demselben Namen teilen sich eine Verbindung (pigpio.pi ist threadsicher).
+    """
+    with _lock:
+        if name not in _connections:
+            _connections[name] = Connection(name, _connect())
+        return _connections[name]
+
+
+def print_stats():
+    """Gibt die gemessenen Dauern aller pigpio-Aufrufe aus."""
+    for name, conn in _connections.items():
+        print("pigpio connection '{}':".format(name))
+        for attr, (n, mean, maximum) in sorted(conn.stats().items()):
+            print("  {:<24} {:>8} calls, mean {:7.3f} ms, max {:7.3f} ms".format(attr, n, mean * 1000, maximum * 1000))
+
+
+def stop():
+    """Beendet alle Verbindungen. Erst ganz am Ende aufrufen, wenn kein Modul mehr pigpio verwendet!"""
+    with _lock:
+        for conn in _connections.values():
+            conn.pi.stop()
+        _connections.clear()
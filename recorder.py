@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# Aufzeichnung von Sensordaten in kompakte binaere Log-Dateien (z.B. fuer Ladekennlinien ueber mehrere Stunden).
+#
+# Der Recorder liest im asyncio-Loop in einem festen Intervall die aktuellen Werte aller gewaehlten Sensoren
+# und haengt sie als eine Zeile an Puffer im Arbeitsspeicher an (kein Dateizugriff im Loop).
+# Waehrend der Aufzeichnung ist er bei jedem Sensor als Abnehmer angemeldet (AddDemand), damit die Sensoren
+# mindestens im Aufzeichnungsintervall aktualisiert werden und nicht nur alle IDLE_REFRESH_TIME Sekunden.
+# Die Puffer werden blockweise von einem eigenen Thread in die Datei geschrieben. Ist ein Segment zu gross
+# oder zu alt, wird ein neues Segment (neue Datei) angefangen.
+#
+# Aufbau eines Segments (alle Zahlen little endian):
+#
+#   | MAGIC (8 Byte) | Anzahl Spalten n (H) | n x (Name, Einheit) als (B)-Laenge + UTF-8 |
+#   | Block | Block | ...
+#
+#   Block:  | Anzahl Zeilen r (I) | r Zeitstempel (d) | r Werte der 1. Spalte (d) | ... | r Werte der n. Spalte (d) |
+#
+# Die Werte werden also spaltenweise gespeichert, d.h. eine Spalte eines Blocks kann beim Lesen ohne
+# Umwandlung direkt aus der gemappten Datei uebernommen werden. Fehlende Werte sind NaN.
+# Die Zeitstempel sind Sekunden seit 1970 (time.time()).
+
+import sys
+import glob
+import mmap
+import array
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MAGIC = b'SRCREC01'
+SUFFIX = ".rec"
+
+FLUSH_ROWS = 256               # spaetestens nach so vielen Zeilen wird ein Block geschrieben
+FLUSH_TIME = 30                # spaetestens nach so vielen Sekunden wird ein Block geschrieben
+SEGMENT_SIZE = 16 * 1024**2    # ab dieser Groesse in Bytes wird ein neues Segment angefangen
+SEGMENT_TIME = 3600            # nach so vielen Sekunden wird ein neues Segment angefangen
+
+NAN = float("nan")
+
+_BLOCK_HEADER = struct.Struct("<I")
+
+
+def _le(arr):
+    """Liefert die Bytes eines array('d') in little endian."""
+    if sys.byteorder != "little":
+        arr = array.array('d', arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+class Recorder:
+    """
+    Zeichnet die Werte der uebergebenen Sensor-Klassen (z.B. Sensorik.Batt_Mon_Voltage) alle "interval" Sekunden auf.
+    Die Segmente heissen <prefix>-<Startzeit>-<Nummer>.rec.
+    """
+
+    def __init__(self, loop, sensors, prefix, interval = 1):
+        self.loop = loop
+        self.sensors = list(sensors)
+        self.prefix = prefix
+        self.interval = interval
+        self.columns = [(Sen.NAME, str(Sen.UNIT)) for Sen in self.sensors]
+        self._times = array.array('d')
+        self._values = [array.array('d') for Sen in self.sensors]
+        self._lastFlush = time.time()
+        # Ein einzelner Thread schreibt alle Bloecke --> die Reihenfolge bleibt erhalten und die Threads der Sensorik bleiben frei:
+        self._writer = ThreadPoolExecutor(max_workers = 1)
+        self._file = None
+        self._segment = 0
+        self._segmentStart = 0
+        self._task = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for Sen in self.sensors:
+            Sen.AddDemand(self, self.interval)
+        self._sample()
+
+    def _sample(self):
+        """Liest die aktuellen Werte aller Sensoren (nur die Klassenattribute, kein Zugriff auf die Hardware)."""
+        if not self.running:
+            return
+        now = time.time()
+        self._times.append(now)
+        for Sen, column in zip(self.sensors, self._values):
+            try:
+                column.append(float(Sen.SensorData))
+            except (TypeError, ValueError):
+                column.append(NAN)
+        if len(self._times) >= FLUSH_ROWS or now - self._lastFlush >= FLUSH_TIME:
+            self.flush()
+        self._task = self.loop.call_later(self.interval, self._sample)
+
+    def flush(self):
+        """Uebergibt die gepufferten Zeilen als Block an den Schreib-Thread."""
+        self._lastFlush = time.time()
+        if not self._times:
+            return
+        block = (self._times, self._values)
+        self._times = array.array('d')
+        self._values = [array.array('d') for Sen in self.sensors]
+        return self._writer.submit(self._write, block)
+
+    def close(self):
+        """Beendet die Aufzeichnung und schreibt alle gepufferten Werte in die Datei."""
+        if self.running:
+            for Sen in self.sensors:
+                Sen.RemoveDemand(self)
+        self.running = False
+        if self._task:
+            self._task.cancel()
+        self.flush()
+        self._writer.shutdown(wait = True)
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    # -- die folgenden Methoden laufen im Schreib-Thread --
+
+    def _open_segment(self):
+        if self._file:
+            self._file.close()
+        self._segmentStart = time.time()
+        name = "{}-{}-{:03d}{}".format(self.prefix, time.strftime("%Y%m%d-%H%M%S", time.localtime(self._segmentStart)),
+                                        self._segment, SUFFIX)
+        self._segment += 1
+        print("Recording to {}".format(name))
+        self._file = open(name, "wb")
+        header = bytearray(MAGIC)
+        header += struct.pack("<H", len(self.columns))
+        for colname, unit in self.columns:
+            for text in (colname.encode()[:255], unit.encode()[:255]):
+                header += struct.pack("<B", len(text)) + text
+        self._file.write(header)
+
+    def _write(self, block):
+        times, values = block
+        if self._file is None or self._file.tell() >= SEGMENT_SIZE or time.time() - self._segmentStart >= SEGMENT_TIME:
+            self._open_segment()
+        data = [_BLOCK_HEADER.pack(len(times)), _le(times)]
+        data.extend(_le(column) for column in values)
+        self._file.write(b''.join(data))
+        self._file.flush()
+
+
+# -------------------
+## --- Auswertung ---
+# -------------------
+
+class Segment:
+    """
+    Liest ein Segment, indem die Datei in den Speicher gemappt wird. Beim Oeffnen werden nur die Blockkoepfe
+    gelesen, eine Spalte wird erst bei Bedarf blockweise direkt aus der gemappten Datei kopiert.
+    Ein unvollstaendiger letzter Block (z.B. nach einem Absturz waehrend des Schreibens) wird ignoriert.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError("{} is not a recorder segment".format(path))
+        pos = len(MAGIC)
+        n, = struct.unpack_from("<H", self._map, pos)
+        pos += 2
+        self.columns = []
+        for i in range(n):
+            texts = []
+            for j in range(2):
+                length = self._map[pos]
+                texts.append(self._map[pos + 1 : pos + 1 + length].decode())
+                pos += 1 + length
+            self.columns.append(tuple(texts))
+        self._blocks = [] # (Offset der Daten, Anzahl Zeilen)
+        size = len(self._map)
+        while pos + _BLOCK_HEADER.size <= size:
+            rows, = _BLOCK_HEADER.unpack_from(self._map, pos)
+            end = pos + _BLOCK_HEADER.size + 8 * rows * (n + 1)
+            if end > size:
+                break
+            self._blocks.append((pos + _BLOCK_HEADER.size, rows))
+            pos = end
+
+    def __len__(self):
+        return sum(rows for offset, rows in self._blocks)
+
+    def column(self, name = None):
+        """
+        Liefert alle Werte der Spalte "name" (None = Zeitstempel) als array('d').
+        """
+        index = 0 if name is None else 1 + [colname for colname, unit in self.columns].index(name)
+        result = array.array('d')
+        with memoryview(self._map) as view:
+            for offset, rows in self._blocks:
+                start = offset + 8 * rows * index
+                result.frombytes(view[start : start + 8 * rows])
+        if sys.byteorder != "little":
+            result.byteswap()
+        return result
+
+    def close(self):
+        self._map.close()
+
+
+def load(prefix):
+    """
+    Liest alle Segmente mit dem uebergebenen Praefix (zeitlich sortiert) und liefert ein Dictionary
+    Spaltenname --> array('d') mit allen Werten, die Zeitstempel unter dem Key "time".
+    """
+    result = {}
+    for path in sorted(glob.glob(glob.escape(prefix) + "-*" + SUFFIX)):
+        seg = Segment(path)
+        try:
+            length = len(result.get("time", ()))
+            result.setdefault("time", array.array('d')).extend(seg.column())
+            for colname, unit in seg.columns:
+                # Spalten, die in frueheren Segmenten fehlen, mit NaN auffuellen:
+                col = result.setdefault(colname, array.array('d', [NAN]) * length)
+                col.extend(seg.column(colname))
+            for colname, col in result.items():
+                if len(col) < len(result["time"]):
+                    col.extend([NAN] * (len(result["time"]) - len(col)))
+        finally:
+            seg.close()
+    return result
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import time
+import asyncio
 
 import pigpio
 
@@ -31,6 +32,10 @@ class ranger:
 
       self._triggered = False
 
+      self._loop = None
+      self._future = None
+      self._timeout = None
+
       self._trig_mode = pi.get_mode(self._trig)
       self._echo_mode = pi.get_mode(self._echo)
 
@@ -53,9 +58,15 @@ class ranger:
                self._high = tick
             else:
                if self._high is not None:
-                  self._time = tick - self._high
+                  self._time = pigpio.tickDiff(self._high, tick)
                   self._high = None
                   self._ping = True
+                  # called from the pigpio callback thread, the loop
+                  # thread may reset self._future at any time
+                  fut = self._future
+                  if fut is not None:
+                     self._loop.call_soon_threadsafe(
+                        self._resolve, fut, self._time / 2000000 * 34030)
 
    def read(self):
       """
@@ -79,6 +90,40 @@ class ranger:
       else:
          return None
 
+   def read_async(self, loop, timeout=0.09):
+      """
+      Triggers a reading without blocking.  Returns an asyncio
+      future which is resolved with the one way distance in cms
+      as soon as the echo falls, or with -1 if no echo was
+      received within timeout seconds.
+
+      Must be called from the thread running the event loop.
+      """
+      future = loop.create_future()
+      if not self._inited:
+         future.set_result(None)
+         return future
+      if self._future is not None:
+         # a reading is still pending, abandon it
+         self._resolve(self._future, -1)
+      self._loop = loop
+      self._future = future
+      self._ping = False
+      # forget a half received echo of an abandoned ping, so
+      # it can't resolve this reading
+      self._triggered = False
+      self._high = None
+      self._timeout = loop.call_later(timeout, self._resolve, future, -1)
+      self.pi.gpio_trigger(self._trig)
+      return future
+
+   def _resolve(self, future, distance):
+      if future is self._future:
+         self._future = None
+         self._timeout.cancel()
+      if not future.done():
+         future.set_result(distance)
+
    def cancel(self):
       """
       Cancels the ranger and returns the gpios to their
@@ -90,6 +135,79 @@ class ranger:
          self.pi.set_mode(self._trig, self._trig_mode)
          self.pi.set_mode(self._echo, self._echo_mode)
 
+class scheduler:
+   """
+   Time-slots several rangers on one timeline so that their
+   pings never overlap and corrupt each other's echoes.
+
+   Every registered job (a coroutine function that triggers one
+   ranger and waits for its echo, e.g. using ranger.read_async)
+   runs in its own slot.  The next slot starts only after the
+   previous job finished plus a guard time for late echoes.
+
+   The interval of each job is asked from its interval function
+   before every slot, so the ping rate can follow the vehicle
+   state.  If the interval function returns None the job is
+   paused.
+   """
+
+   def __init__(self, loop, guard=0.01, poll=0.1):
+      """
+      guard is the pause in seconds after each slot.  poll is the
+      longest time in seconds the scheduler sleeps before asking
+      the interval functions again.
+      """
+      self._loop = loop
+      self._guard = guard
+      self._poll = poll
+      self._jobs = []
+      self._task = None
+
+   def add(self, job, interval):
+      """
+      Adds the coroutine function job which is run every
+      interval() seconds.
+      """
+      self._jobs.append([job, interval, 0])
+      if self._task is None:
+         self._task = asyncio.ensure_future(self._run(), loop=self._loop)
+
+   def cancel(self):
+      if self._task is not None:
+         self._task.cancel()
+         self._task = None
+
+   def _next(self):
+      """
+      Returns the job which is due first and the time it is due.
+      """
+      due = None
+      for entry in self._jobs:
+         interval = entry[1]()
+         if interval is None:
+            continue
+         t = entry[2] + interval
+         if due is None or t < due[1]:
+            due = (entry, t)
+      return due
+
+   async def _run(self):
+      while True:
+         due = self._next()
+         now = self._loop.time()
+         if due is None or due[1] > now:
+            # the intervals may change meanwhile, so ask again soon
+            wait = self._poll if due is None else min(due[1] - now, self._poll)
+            await asyncio.sleep(wait)
+            continue
+         entry = due[0]
+         entry[2] = now
+         try:
+            await entry[0]()
+         except Exception as e:
+            print("sonar scheduler: job failed: {}".format(e))
+         await asyncio.sleep(self._guard)
+
 if __name__ == "__main__":
 
    import time
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+
+# Hilfsklassen fuer das "Smart RC Car Protocol" (SRCCP), die unabhaengig vom Socket-Server
+# (und damit auch ohne pigpio etc.) importiert und getestet werden koennen.
+#
+# Aufbau eines SRCCP-Pakets:
+#
+#   | Laenge (2 Byte, big endian) | /SRCCP/<Version>/# | Nachricht | #/ |
+#                                 |<----------- Laenge ------------------->|
+#
+# Die Nachricht wird standardmaessig als XML kodiert (Header "/SRCCP/v0.1"). Alternativ kann
+# jeder Client fuer seine Verbindung die kompakte binaere Kodierung (Header "/SRCCP/v0.2b") waehlen.
+
+import sys
+import array
+import struct
+import collections
+import xml.etree.ElementTree as ET
+
+MARKER = b'/SRCCP/'
+HEADER_END = b'/#'
+TRAILER = b'#/'
+
+MAX_FRAME_SIZE = 0xFFFF # groesste Laenge, die sich mit 2 Byte angeben laesst
+MAX_RECEIVE_SIZE = 4096 # groesste Laenge eines empfangenen Pakets (Befehle der Clients sind viel kuerzer)
+MAX_HISTORY_POINTS = 1000 # hoechstens so viele Werte pro history-Nachricht, damit sie in ein Paket passen (auch als XML)
+
+
+class FrameDecoder:
+    """
+    Inkrementeller Decoder fuer SRCCP-Pakete. Pro Verbindung wird ein Objekt erstellt.
+    Die empfangenen Daten werden mit "feed" in einen wachsenden Empfangspuffer geschrieben.
+    Unvollstaendige Pakete bleiben im Puffer, bis der Rest mit dem naechsten "feed" ankommt.
+    "frames" liefert alle vollstaendigen Pakete als (header, message) - memoryviews auf den
+    Empfangspuffer, d.h. es wird nichts kopiert. Die memoryviews sind nur bis zum naechsten
+    Aufruf von "feed" gueltig und duerfen daher nicht aufgehoben werden!
+    """
+
+    def __init__(self, onError = None, maxLength = MAX_RECEIVE_SIZE):
+        """
+        onError(Errormsg) wird aufgerufen, falls ein fehlerhaftes Paket empfangen wurde.
+        Pakete mit einer Laengenangabe ueber maxLength gelten als fehlerhaft (z.B. Muell vor einem "/SRCCP/"),
+        damit nicht auf bis zu 64 kB gewartet wird, bevor weiter nach dem naechsten Paket gesucht wird.
+        """
+        self._buf = bytearray()
+        self._pos = 0 # Alles vor dieser Position ist bereits verarbeitet
+        self.onError = onError
+        self.maxLength = maxLength
+
+    def feed(self, data):
+        """Haengt die empfangenen Daten an den Empfangspuffer an."""
+        try:
+            if self._pos:
+                # bereits verarbeitete Daten verwerfen:
+                del self._buf[:self._pos]
+                self._pos = 0
+            self._buf += data
+        except BufferError:
+            # Es wurde noch ein memoryview auf den alten Puffer aufgehoben --> neuen Puffer anlegen
+            self._buf = self._buf[self._pos:] + data
+            self._pos = 0
+
+    def frames(self):
+        """
+        Generator, der alle vollstaendig empfangenen Pakete als Tupel (header, message) zurueckgibt.
+        header enthaelt z.B. b'/SRCCP/v0.1', message die eigentliche Nachricht (z.B. XML).
+        """
+        buf = self._buf
+        view = memoryview(buf)
+        try:
+            while True:
+                # "/SRCCP/" mit bytes.find suchen, davor muessen noch die 2 Byte der Laenge Platz haben:
+                markerPos = buf.find(MARKER, self._pos + 2)
+                if markerPos < 0:
+                    # Kein Paketanfang gefunden. Alles bis auf die letzten Bytes verwerfen,
+                    # da dort ein Teil von Laenge + "/SRCCP/" stehen koennte:
+                    self._pos = max(self._pos, len(buf) - len(MARKER) - 1)
+                    return
+
+                start = markerPos - 2
+                length = int.from_bytes(buf[start : markerPos], "big")
+                if length > self.maxLength:
+                    # unsinnige Laenge --> hinter diesem "/SRCCP/" weiter nach einem Paket suchen
+                    self._pos = markerPos + 1 - 2
+                    if self.onError:
+                        self.onError("Packet length {} exceeds maximum of {}".format(length, self.maxLength))
+                    continue
+                end = markerPos + length
+                if end > len(buf):
+                    # Paket noch nicht vollstaendig empfangen --> beim naechsten "feed" weitermachen
+                    self._pos = start
+                    return
+
+                headerEnd = buf.find(HEADER_END, markerPos + len(MARKER), end)
+                if headerEnd < 0 or length < len(MARKER) + len(HEADER_END) + len(TRAILER) \
+                        or buf[end - len(TRAILER) : end] != TRAILER:
+                    # suche hinter dem fehlerhaften "/SRCCP/" weiter nach einem Paket...
+                    self._pos = markerPos + 1 - 2
+                    if self.onError:
+                        self.onError("Incomplete or malformed packet received")
+                    continue
+
+                self._pos = end
+                yield view[markerPos : headerEnd], view[headerEnd + len(HEADER_END) : end - len(TRAILER)]
+        finally:
+            view.release()
+
+
+def pack(header, message):
+    """Packt eine Nachricht mit dem uebergebenen Header in ein SRCCP-Paket inkl. Laengenangabe."""
+    frame = header + HEADER_END + message + TRAILER
+    if len(frame) > MAX_FRAME_SIZE:
+        raise ValueError("SRCCP-Packet too long ({} Bytes)".format(len(frame)))
+    return len(frame).to_bytes(2, "big") + frame
+
+
+# -------------------------------
+## --- Kodierung der Nachrichten ---
+# -------------------------------
+
+# Jeder Codec erstellt fertige SRCCP-Pakete (inkl. Header und Laenge) und dekodiert empfangene
+# Nachrichten in ein Tupel (Tag, Befehl). Tag ist "cmd", "msg" oder "ctlmsg", Befehl ist ein Dictionary
+# mit dem Namen des Befehls unter "name", den Sensoren als Liste von (Name, Attribute)-Tupeln unter
+# "sensors" und allen weiteren Parametern (z.B. "speed" oder "type") als eigene Eintraege.
+
+class XMLCodec:
+    """Standard-Kodierung: Die Nachrichten werden als XML verschickt."""
+
+    NAME = "xml"
+    HEADER = b'/SRCCP/v0.1'
+
+    def sensordata(self, Sensor, Data, Unit = None):
+        root = ET.Element('msg')
+        name = ET.SubElement(root, 'name')
+        name.text = "sensordata"
+        sensor = ET.SubElement(root, 'sensor')
+        sensor.text = Sensor
+        data = ET.SubElement(root, 'data')
+        data.text = Data
+        if Unit:
+            unit = ET.SubElement(root, 'unit')
+            unit.text = Unit
+        return pack(self.HEADER, ET.tostring(root))
+
+    def alert(self, Sensor, Message, Severity = 1):
+        root = ET.Element('msg')
+        name = ET.SubElement(root, 'name')
+        name.text = "alert"
+        sensor = ET.SubElement(root, 'sensor')
+        sensor.text = Sensor
+        severity = ET.SubElement(root, 'severity')
+        severity.text = str(Severity)
+        message = ET.SubElement(root, 'message')
+        message.text = Message
+        return pack(self.HEADER, ET.tostring(root))
+
+    def history(self, Sensor, Times, Values, Unit = None):
+        root = ET.Element('msg')
+        name = ET.SubElement(root, 'name')
+        name.text = "history"
+        sensor = ET.SubElement(root, 'sensor')
+        sensor.text = Sensor
+        if Unit:
+            unit = ET.SubElement(root, 'unit')
+            unit.text = Unit
+        for t, value in zip(Times, Values):
+            data = ET.SubElement(root, 'data', t = "{:.3f}".format(t))
+            data.text = str(value)
+        return pack(self.HEADER, ET.tostring(root))
+
+    def aggregate(self, Sensor, Stats, Unit = None):
+        """Stats: (min, max, mean, count, last) ueber ein Intervall (siehe Sensor.subscribeAggregate)."""
+        root = ET.Element('msg')
+        name = ET.SubElement(root, 'name')
+        name.text = "aggregate"
+        sensor = ET.SubElement(root, 'sensor')
+        sensor.text = Sensor
+        for tag, value in zip(("min", "max", "mean", "count", "last"), Stats):
+            element = ET.SubElement(root, tag)
+            element.text = str(value)
+        if Unit:
+            unit = ET.SubElement(root, 'unit')
+            unit.text = Unit
+        return pack(self.HEADER, ET.tostring(root))
+
+    def ack(self, Command):
+        root = ET.Element('ctlmsg')
+        name = ET.SubElement(root, 'name')
+        name.text = "ack"
+        type = ET.SubElement(root, 'type')
+        type.text = Command
+        return pack(self.HEADER, ET.tostring(root))
+
+    def nack(self, Type, Errormsg = None):
+        root = ET.Element('ctlmsg')
+        name = ET.SubElement(root, 'name')
+        name.text = "nack"
+        type = ET.SubElement(root, 'type')
+        type.text = Type
+        if Errormsg:
+            errormsg = ET.SubElement(root, 'message')
+            errormsg.text = Errormsg
+        return pack(self.HEADER, ET.tostring(root))
+
+    def decode(self, message):
+        root = ET.fromstring(message)
+        cmd = {"sensors": []}
+        for child in root:
+            if child.tag == "sensor":
+                cmd["sensors"].append((child.text, dict(child.attrib)))
+            else:
+                cmd[child.tag] = child.text
+        return root.tag, cmd
+
+
+class BinaryCodec:
+    """
+    Kompakte binaere Kodierung mit struct-gepackten Feldern (big endian) und numerischen Sensor-IDs.
+    Der Header lautet "/SRCCP/v0.2b". Das erste Byte jeder Nachricht gibt den Nachrichtentyp an:
+
+    vom Server:
+      SENSORDATA  (0x01): Sensor-ID (B), Wert (d)
+      SENSORTEXT  (0x02): Sensor-ID (B), Wert als UTF-8 (fuer nicht numerische Werte, ID 0 = "system")
+      ALERT       (0x03): Sensor-ID (B), Severity (B), Nachricht als UTF-8
+      ACK         (0x04): Befehls-ID (B)
+      NACK        (0x05): Befehls-ID (B), Fehlermeldung als UTF-8
+      HISTORY     (0x06): Sensor-ID (B), Anzahl n (H), n Zeitstempel in s seit 1970 (d), n Werte (d)
+      AGGREGATE   (0x07): Sensor-ID (B), Anzahl (H), min (d), max (d), mean (d), last (d)
+    vom Client:
+      CMD         (0x10): Befehls-ID (B), danach abhaengig vom Befehl:
+                          drive:       Geschwindigkeit (b)
+                          steer:       Position (B)
+                          subscribe:   Typ (B, 0 = data, 1 = alert), dann je Sensor: Sensor-ID (B), Intervall in ms (H, 0 = Standard)
+                          desubscribe: Typ (B, 0 = data, 1 = alert), dann je Sensor: Sensor-ID (B)
+                          irled:       Wert (B)
+                          encoding:    Kodierung (B, 0 = xml, 1 = binary)
+                          heartbeat:   optional Timeout des Watchdogs in ms (H)
+                          history:     je Sensor: Sensor-ID (B), Zeitraum in s (H, 0 = alles), max. Anzahl Werte (H, 0 = Standard)
+    """
+
+    NAME = "binary"
+    HEADER = b'/SRCCP/v0.2b'
+
+    SENSORDATA = 0x01
+    SENSORTEXT = 0x02
+    ALERT = 0x03
+    ACK = 0x04
+    NACK = 0x05
+    HISTORY = 0x06
+    AGGREGATE = 0x07
+    CMD = 0x10
+
+    # Die Position in diesem Tupel ist die Befehls-ID (neue Befehle nur hinten anhaengen!):
+    COMMANDS = ("unknown", "drive", "brake", "steer", "subscribe", "desubscribe", "irled",
+                "close", "shutdown", "reboot", "encoding", "heartbeat", "history")
+    SUB_TYPES = ("data", "alert")
+    ENCODINGS = ("xml", "binary")
+
+    def __init__(self, SensorIDs):
+        """SensorIDs: Dictionary mit dem Namen jedes Sensors als Key und dessen numerischer ID als Wert"""
+        self.SensorIDs = dict(SensorIDs)
+        self.SensorNames = {ID: Name for Name, ID in self.SensorIDs.items()}
+        self.CommandIDs = {Name: ID for ID, Name in enumerate(self.COMMANDS)}
+
+    def sensordata(self, Sensor, Data, Unit = None):
+        ID = self.SensorIDs.get(Sensor, 0)
+        try:
+            return pack(self.HEADER, struct.pack(">BBd", self.SENSORDATA, ID, float(Data)))
+        except (TypeError, ValueError):
+            return pack(self.HEADER, struct.pack(">BB", self.SENSORTEXT, ID) + str(Data).encode())
+
+    def alert(self, Sensor, Message, Severity = 1):
+        ID = self.SensorIDs.get(Sensor, 0)
+        return pack(self.HEADER, struct.pack(">BBB", self.ALERT, ID, int(Severity)) + Message.encode())
+
+    def history(self, Sensor, Times, Values, Unit = None):
+        ID = self.SensorIDs.get(Sensor, 0)
+        # Zeitstempel und Werte werden spaltenweise als ganze Arrays gepackt statt Wert fuer Wert:
+        times = array.array('d', Times)
+        values = array.array('d', Values)
+        if sys.byteorder == "little":
+            times.byteswap()
+            values.byteswap()
+        return pack(self.HEADER, struct.pack(">BBH", self.HISTORY, ID, len(times)) + times.tobytes() + values.tobytes())
+
+    def aggregate(self, Sensor, Stats, Unit = None):
+        ID = self.SensorIDs.get(Sensor, 0)
+        minimum, maximum, mean, count, last = Stats
+        return pack(self.HEADER, struct.pack(">BBHdddd", self.AGGREGATE, ID, min(count, 0xFFFF), minimum, maximum, mean, last))
+
+    def ack(self, Command):
+        return pack(self.HEADER, struct.pack(">BB", self.ACK, self.CommandIDs.get(Command, 0)))
+
+    def nack(self, Type, Errormsg = None):
+        message = struct.pack(">BB", self.NACK, self.CommandIDs.get(Type, 0))
+        if Errormsg:
+            message += Errormsg.encode()
+        return pack(self.HEADER, message)
+
+    def decode(self, message):
+        try:
+            if message[0] != self.CMD:
+                raise ValueError("unknown message type {}".format(message[0]))
+            ID = message[1]
+            if ID >= len(self.COMMANDS) or ID == 0:
+                raise ValueError("unknown command {}".format(ID))
+            cmd = {"name": self.COMMANDS[ID], "sensors": []}
+            args = message[2:]
+            if cmd["name"] == "drive":
+                cmd["speed"], = struct.unpack(">b", args)
+            elif cmd["name"] == "steer":
+                cmd["angle"], = struct.unpack(">B", args)
+            elif cmd["name"] == "subscribe":
+                cmd["type"] = self.SUB_TYPES[args[0]]
+                for SenID, interval in struct.iter_unpack(">BH", args[1:]):
+                    attrs = {"interval": str(interval / 1000)} if interval else {}
+                    cmd["sensors"].append((self.SensorNames[SenID], attrs))
+            elif cmd["name"] == "desubscribe":
+                cmd["type"] = self.SUB_TYPES[args[0]]
+                for SenID in args[1:]:
+                    cmd["sensors"].append((self.SensorNames[SenID], {}))
+            elif cmd["name"] == "irled":
+                cmd["value"] = str(args[0])
+            elif cmd["name"] == "encoding":
+                cmd["value"] = self.ENCODINGS[args[0]]
+            elif cmd["name"] == "history":
+                for SenID, span, points in struct.iter_unpack(">BHH", args):
+                    attrs = {}
+                    if span: attrs["span"] = str(span)
+                    if points: attrs["points"] = str(points)
+                    cmd["sensors"].append((self.SensorNames[SenID], attrs))
+            elif cmd["name"] == "heartbeat" and args:
+                cmd["timeout"] = str(struct.unpack(">H", args)[0] / 1000)
+        except (IndexError, struct.error) as e:
+            raise ValueError("malformed binary message: {}".format(e))
+        except KeyError as e:
+            raise ValueError("unknown sensor ID {}".format(e.args[0]))
+        return "cmd", cmd
+
+
+# ---------------------------------
+## --- Sendewarteschlange ---
+# ---------------------------------
+
+class OutboundQueue:
+    """
+    Sendewarteschlange einer Verbindung, die den Gegendruck (Backpressure) des Transports beruecksichtigt.
+    Solange der Transport nicht pausiert ist, werden die Pakete direkt geschrieben.
+    Waehrend er pausiert ist (asyncio ruft "pause_writing" des Protokolls auf), werden
+    - Pakete mit key (Sensordaten) nur als neuester Wert pro key aufgehoben (latest-value-wins) und
+    - Pakete ohne key (ACK, NACK, Alerts) alle in der richtigen Reihenfolge gespeichert.
+    Bei "resume" werden zuerst die Pakete ohne key und dann die neuesten Sensordaten verschickt.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.paused = False
+        self.control = collections.deque()
+        self.latest = collections.OrderedDict()
+        self.dropped = 0 # Anzahl der veralteten und deshalb verworfenen Pakete
+
+    def write(self, packet, key = None):
+        if not self.paused:
+            self.transport.write(packet)
+        elif key is None:
+            self.control.append(packet)
+        else:
+            if self.latest.pop(key, None) is not None:
+                self.dropped += 1
+            self.latest[key] = packet
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        # transport.write kann den Transport sofort wieder pausieren, deshalb jedes Mal pruefen:
+        while self.control and not self.paused:
+            self.transport.write(self.control.popleft())
+        while self.latest and not self.paused:
+            key, packet = self.latest.popitem(last = False)
+            self.transport.write(packet)
+
+
+# ---------------------------------------
+## --- Verteilen der Sensordaten (Hub) ---
+# ---------------------------------------
+
+class SensorHub:
+    """
+    Pro Sensor und Intervall gibt es genau einen Hub, der den Sensor einmal subscribed,
+    jeden Wert nur einmal pro Kodierung in ein fertiges SRCCP-Paket packt
+    und dieselben Bytes an alle Verbindungen schickt, die den Sensor subscribed haben.
+    Eine Verbindung muss das Attribut "codec" und die Methode "SendSRCCPPacket(Packet, key)" besitzen.
+    """
+
+    hubs = {} # (Sensorname, Intervall, deadband, reldeadband, maxsilence, aggregate) --> SensorHub
+
+    @classmethod
+    def get(cls, SensorCls, interval = None, deadband = None, reldeadband = None, maxsilence = None, aggregate = False):
+        """
+        Liefert den Hub fuer die uebergebene Sensor-Klasse und das Intervall und erstellt ihn, falls noetig.
+        interval = None: Standard-Intervall des Sensors (REFRESH_TIME).
+        Ist deadband, reldeadband oder maxsilence angegeben, werden die Werte nur bei Aenderungen
+        verschickt (siehe Sensor.subscribeOnChange), sonst in jedem Intervall.
+        aggregate = True: pro Intervall wird eine Zusammenfassung aller Werte verschickt (siehe Sensor.subscribeAggregate).
+        Nicht angegeben sind nur None und "" (leeres Attribut), 0 ist ein gueltiger Wert (z.B. deadband="0").
+        """
+        key = (SensorCls.NAME,) + tuple(None if value is None or value == "" else float(value)
+                                        for value in (interval, deadband, reldeadband, maxsilence)) \
+              + (bool(aggregate),)
+        if key not in cls.hubs:
+            cls.hubs[key] = cls(SensorCls, *key[1:])
+        return cls.hubs[key]
+
+    def __init__(self, SensorCls, interval, deadband = None, reldeadband = None, maxsilence = None, aggregate = False):
+        self.SensorCls = SensorCls
+        self.interval = interval
+        self.deadband = deadband
+        self.reldeadband = reldeadband
+        self.maxsilence = maxsilence
+        self.aggregate = aggregate
+        self.key = (SensorCls.NAME, interval, deadband, reldeadband, maxsilence, aggregate)
+        self.sensor = SensorCls()
+        self.subscribers = []
+
+    def subscribe(self, conn):
+        if conn in self.subscribers:
+            return
+        self.subscribers.append(conn)
+        if len(self.subscribers) == 1:
+            if self.aggregate:
+                # erster Subscriber --> Sensor subscriben (eine Zusammenfassung pro Intervall)
+                self.sensor.subscribeAggregate(self.publishAggregate, self.interval)
+            elif self.deadband is not None or self.reldeadband is not None or self.maxsilence is not None:
+                # erster Subscriber --> Sensor subscriben (nur bei Aenderungen publishen)
+                self.sensor.subscribeOnChange(self.publish, self.interval, self.deadband, self.reldeadband, self.maxsilence)
+            else:
+                # erster Subscriber --> Sensor subscriben (alle Werte publishen, nicht nur neue!)
+                self.sensor.subscribe(self.publish, OnlyNew = False, time = self.interval)
+        elif self.SensorCls.SensorData is not None and not self.aggregate:
+            # Weitere Subscriber bekommen den aktuellen Wert sofort, so wie beim eigenen Subscriben:
+            conn.SendSRCCPPacket(conn.codec.sensordata(str(self.SensorCls.NAME), str(self.SensorCls.SensorData), str(self.SensorCls.UNIT)),
+                                 key = self.SensorCls.NAME)
+
+    def desubscribe(self, conn):
+        self.subscribers.remove(conn)
+        if not self.subscribers:
+            self.sensor.desubscribe()
+            del SensorHub.hubs[self.key]
+
+    def publish(self, Sensor, Data, Unit):
+        """Output-Funktion fuer Sensor.subscribe: kodiert den Wert einmal pro Kodierung und verschickt ihn an alle."""
+        packets = {}
+        for conn in list(self.subscribers):
+            packet = packets.get(conn.codec)
+            if packet is None:
+                packet = packets[conn.codec] = conn.codec.sensordata(Sensor, Data, Unit)
+            conn.SendSRCCPPacket(packet, key = Sensor)
+
+    def publishAggregate(self, Sensor, Stats, Unit):
+        """Output-Funktion fuer Sensor.subscribeAggregate."""
+        packets = {}
+        for conn in list(self.subscribers):
+            packet = packets.get(conn.codec)
+            if packet is None:
+                packet = packets[conn.codec] = conn.codec.aggregate(Sensor, Stats, Unit)
+            conn.SendSRCCPPacket(packet, key = (Sensor, "aggregate"))